@@ -0,0 +1,73 @@
+"""Throughput of VoteWorkout/CountVotes at increasing numbers of concurrent streams.
+
+Start the service once per mode and point the benchmark at it:
+    GRPC_SERVER_MODE=threads python src/app.py
+    GRPC_SERVER_MODE=aio python src/app.py
+    python benchmarks/concurrency_benchmark.py --target localhost:50052
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import grpc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import activity_service_pb2  # noqa: E402
+import activity_service_pb2_grpc  # noqa: E402
+
+
+async def run(stub, concurrency, duration):
+    latencies = []
+    errors = 0
+    # Votes are only accepted for an open session
+    session = await stub.StartGroupWorkoutSession(
+        activity_service_pb2.WorkoutRequest(user_id=f'bench-{concurrency}'), timeout=10
+    )
+    session_id = session.session_id
+    deadline = time.perf_counter() + duration
+
+    async def stream(worker):
+        nonlocal errors
+        i = 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                if i % 4 == 3:
+                    await stub.CountVotes(
+                        activity_service_pb2.SessionRequest(session_id=session_id), timeout=10
+                    )
+                else:
+                    await stub.VoteWorkout(activity_service_pb2.VoteRequest(
+                        session_id=session_id, user_id=f'user{worker}',
+                        workout_type=('yoga', 'running', 'cycling')[i % 3], duration=30
+                    ), timeout=10)
+                latencies.append(time.perf_counter() - start)
+            except grpc.aio.AioRpcError:
+                errors += 1
+            i += 1
+
+    await asyncio.gather(*(stream(worker) for worker in range(concurrency)))
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0.0
+    return len(latencies) / duration, p99, errors
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--target', default='localhost:50052')
+    parser.add_argument('--concurrency', default='10,100,1000')
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args()
+
+    async with grpc.aio.insecure_channel(args.target) as channel:
+        stub = activity_service_pb2_grpc.ActivityServiceStub(channel)
+        for concurrency in [int(c) for c in args.concurrency.split(',')]:
+            rps, p99, errors = await run(stub, concurrency, args.duration)
+            print(f'{concurrency:>5} streams  {rps:>9.0f} req/s  p99 {p99:8.2f} ms  errors {errors}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
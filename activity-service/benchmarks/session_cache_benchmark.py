@@ -0,0 +1,161 @@
+"""MongoDB reads behind VoteWorkout/CountVotes in a vote storm, with and without the session cache.
+
+Usage: python benchmarks/session_cache_benchmark.py [--sessions 200] [--votes 100000]
+       [--replicas 3] [--cold] [--mongo mongodb://localhost:27017/] [--redis localhost]
+
+Works in a scratch database (session_cache_benchmark, dropped at the end)
+and runs in-process: --replicas SessionCache instances with their own local
+tier share one Redis, as the replicas behind nginx-activity do, and every
+request goes to a random one. Votes are spread over the group sessions by
+a Zipf-like popularity, one in ten is followed by a CountVotes, and a
+fifth of the sessions end halfway through, so late votes for them are
+refused. Each request looks the session up the way the RPC does; the tally
+itself is not written. MongoDB reads are counted with a command listener.
+Sessions are cached as they start, as StartGroupWorkoutSession does; with
+--cold the storm starts from empty caches instead, as after a Redis flush.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from concurrent import futures
+
+import redis
+from pymongo import MongoClient, monitoring
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from session_cache import CHANNEL, KEY_PREFIX, CachedSession, SessionCache  # noqa: E402
+from sessions import SessionStore  # noqa: E402
+
+DATABASE = 'session_cache_benchmark'
+
+
+class ReadCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.reads = 0
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if event.command_name == 'find' and event.database_name == DATABASE:
+            with self._lock:
+                self.reads += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+class Uncached:
+    """Every lookup reads MongoDB, as the RPCs would without the cache."""
+
+    def __init__(self, store):
+        self._store = store
+
+    def get(self, session_id):
+        document = self._store.get(session_id)
+        return CachedSession.from_document(document) if document is not None else None
+
+    def put(self, document):
+        pass
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+def storm(sessions, votes, seed):
+    # (session index, 'vote' | 'count') in arrival order; session i gets a share of 1 / (i + 1)
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(sessions)]
+    requests = []
+    for index in rng.choices(range(sessions), weights, k=votes):
+        requests.append((index, 'vote'))
+        if rng.random() < 0.1:
+            requests.append((index, 'count'))
+    return requests
+
+
+def run(mode, args, db, redis_client, counter):
+    db.sessions.drop()
+    for key in redis_client.scan_iter(KEY_PREFIX + '*'):
+        redis_client.delete(key)
+    store = SessionStore(db.sessions)
+    if mode == 'none':
+        replicas = [Uncached(store) for _ in range(args.replicas)]
+    else:
+        # A local tier of size 0 keeps nothing, leaving Redis alone
+        maxsize = 10000 if mode == 'both' else 0
+        replicas = [SessionCache(redis_client, store, maxsize=maxsize) for _ in range(args.replicas)]
+    for replica in replicas:
+        replica.start()
+    rng = random.Random(args.seed)
+    sessions = []
+    for i in range(args.sessions):
+        session = store.start(f'host{i}', group=True)
+        if not args.cold:
+            rng.choice(replicas).put(session)
+        sessions.append(str(session['_id']))
+    requests = storm(args.sessions, args.votes, args.seed)
+    ending = set(rng.sample(range(args.sessions), args.sessions // 5))
+    halfway = len(requests) // 2
+
+    def handle(request):
+        # Returns whether a vote was refused
+        index, kind = request
+        session = random.choice(replicas).get(sessions[index])
+        return kind == 'vote' and not session.open
+
+    def end_sessions():
+        for index in ending:
+            document = store.end(sessions[index])
+            rng.choice(replicas).put(document)
+
+    time.sleep(0.5)
+    counter.reads = 0
+    started = time.perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        refused = sum(pool.map(handle, requests[:halfway]))
+        end_sessions()
+        refused += sum(pool.map(handle, requests[halfway:]))
+    elapsed = time.perf_counter() - started
+    for replica in replicas:
+        replica.stop()
+    return len(requests), elapsed, counter.reads, refused
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=200)
+    parser.add_argument('--votes', type=int, default=100000)
+    parser.add_argument('--replicas', type=int, default=3)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--cold', action='store_true', help='start the storm with empty caches')
+    parser.add_argument('--mongo', default='mongodb://localhost:27017/')
+    parser.add_argument('--redis', default='localhost')
+    args = parser.parse_args()
+
+    counter = ReadCounter()
+    client = MongoClient(args.mongo, event_listeners=[counter])
+    redis_client = redis.Redis(host=args.redis, port=6379, db=0)
+    print(f'{args.votes} votes over {args.sessions} sessions, {args.replicas} replicas; '
+          f'invalidations on {CHANNEL}')
+    try:
+        for mode, label in [('none', 'no cache'), ('redis', 'redis only'), ('both', 'local + redis')]:
+            requests, elapsed, reads, refused = run(mode, args, client[DATABASE], redis_client, counter)
+            print(f'{label:<14} {requests / elapsed:>9.0f} req/s  mongo reads {reads:>7} '
+                  f'({reads / elapsed:>8.0f}/s, {reads / requests:.4f} per request)  refused votes {refused}')
+    finally:
+        client.drop_database(DATABASE)
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Export and import throughput of src/snapshot.py for a large sessions collection.
+
+Usage: python benchmarks/snapshot_benchmark.py [--sessions 10000000] [--format parquet]
+       [--mongo mongodb://localhost:27017/]
+
+Works in a scratch database (snapshot_benchmark, dropped at the end): fills
+a source collection with synthetic ended sessions, exports it, and imports
+the file into an empty target collection.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from datafiles import open_reader, open_writer  # noqa: E402
+from sessions import SessionStore  # noqa: E402
+from snapshot import FIELDS, defer_indexes, export_sessions, import_sessions  # noqa: E402
+
+WORKOUT_TYPES = ['run', 'yoga', 'cycling', 'strength', 'swim']
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def fill(collection, sessions, chunk=50000):
+    SessionStore(collection).ensure_indexes()
+    for first in range(0, sessions, chunk):
+        documents = []
+        for i in range(first, min(first + chunk, sessions)):
+            start = START + timedelta(seconds=37 * i)
+            duration = float(600 + i % 3000)
+            document = {
+                '_id': ObjectId(), 'user_id': f'user{i % 100000}', 'start_time': start,
+                'end_time': start + timedelta(seconds=duration), 'duration': duration,
+                'workout_type': WORKOUT_TYPES[i % len(WORKOUT_TYPES)],
+            }
+            if i % 10 == 0:
+                document.update(group=True, participants=[document['user_id'], f'user{(i + 1) % 100000}'])
+            documents.append(document)
+        collection.insert_many(documents, ordered=False)
+
+
+def timed(label, rows, fn):
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    print(f'{label:<28} {rows:>10} docs {elapsed:8.1f}s {rows / elapsed:>10.0f} docs/s')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=10_000_000)
+    parser.add_argument('--format', choices=['parquet', 'ndjson.gz', 'ndjson'], default='parquet')
+    parser.add_argument('--chunk', type=int, default=50000)
+    parser.add_argument('--mongo', default='mongodb://localhost:27017/')
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo)
+    db = client['snapshot_benchmark']
+    client.drop_database('snapshot_benchmark')
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, f'sessions.{args.format}')
+            timed('fill source (insert_many)', args.sessions, lambda: fill(db['source'], args.sessions))
+            with open_writer(path, FIELDS) as writer:
+                timed(f'export to {args.format}', args.sessions,
+                      lambda: export_sessions(db['source'], writer, args.chunk))
+            print(f'file size {os.path.getsize(path) / 2 ** 20:.1f} MiB')
+
+            defer_indexes(db['target'])
+            with open_reader(path, FIELDS, args.chunk) as reader:
+                imported = timed(f'import from {args.format}', args.sessions,
+                                 lambda: import_sessions(db['target'], reader))
+            timed('build deferred indexes', args.sessions, lambda: SessionStore(db['target']).ensure_indexes())
+            assert imported == args.sessions, imported
+    finally:
+        client.drop_database('snapshot_benchmark')
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Load test for VoteWorkout/CountVotes with thousands of voters per session.
+
+Against a running service (through nginx-activity):
+    python benchmarks/vote_load_test.py --target localhost:50052
+Directly against the Redis tally:
+    python benchmarks/vote_load_test.py --redis localhost
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent import futures
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+WORKOUT_TYPES = ['yoga', 'running', 'cycling', 'strength', 'hiit', 'swimming']
+
+
+def grpc_client(target):
+    import grpc
+    import activity_service_pb2
+    import activity_service_pb2_grpc
+
+    stub = activity_service_pb2_grpc.ActivityServiceStub(grpc.insecure_channel(target))
+
+    def vote(session_id, user_id, workout_type, duration):
+        stub.VoteWorkout(activity_service_pb2.VoteRequest(
+            session_id=session_id, user_id=user_id,
+            workout_type=workout_type, duration=duration
+        ))
+
+    def count(session_id):
+        return stub.CountVotes(activity_service_pb2.SessionRequest(session_id=session_id))
+
+    def start(name):
+        # Votes are only accepted for an open session
+        return stub.StartGroupWorkoutSession(activity_service_pb2.WorkoutRequest(user_id=name)).session_id
+
+    return vote, count, start
+
+
+def redis_client(host):
+    import redis
+    from votes import VoteTally
+
+    tally = VoteTally(redis.Redis(host=host, port=6379, db=0))
+    return tally.cast, tally.leader, lambda name: name
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--target')
+    group.add_argument('--redis')
+    parser.add_argument('--sessions', type=int, default=5)
+    parser.add_argument('--voters', type=int, default=5000)
+    parser.add_argument('--revote-ratio', type=float, default=0.3)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+
+    vote, count, start_session = grpc_client(args.target) if args.target else redis_client(args.redis)
+    run_id = int(time.time())
+    sessions = [start_session(f'loadtest-{run_id}-{i}') for i in range(args.sessions)]
+
+    ballots = []
+    for session_id in sessions:
+        for voter in range(args.voters):
+            ballots.append((session_id, f'user{voter}'))
+    # Some voters change their mind, exercising the decrement/increment path
+    ballots += random.sample(ballots, int(len(ballots) * args.revote_ratio))
+    random.shuffle(ballots)
+
+    vote_latencies = []
+    count_latencies = []
+
+    def cast(ballot):
+        session_id, user_id = ballot
+        start = time.perf_counter()
+        vote(session_id, user_id, random.choice(WORKOUT_TYPES), random.randint(10, 90))
+        vote_latencies.append(time.perf_counter() - start)
+        if random.random() < 0.1:
+            start = time.perf_counter()
+            count(session_id)
+            count_latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(cast, ballots))
+    elapsed = time.perf_counter() - start
+
+    print(f'{len(ballots)} votes across {args.sessions} sessions of {args.voters} voters '
+          f'in {elapsed:.2f}s ({len(ballots) / elapsed:.0f} votes/s)')
+    print(f'VoteWorkout  p50 {percentile(vote_latencies, 0.5):.2f} ms  '
+          f'p99 {percentile(vote_latencies, 0.99):.2f} ms')
+    print(f'CountVotes   p50 {percentile(count_latencies, 0.5):.2f} ms  '
+          f'p99 {percentile(count_latencies, 0.99):.2f} ms')
+    for session_id in sessions:
+        print(session_id, count(session_id))
+
+
+if __name__ == '__main__':
+    main()
@@ -24,7 +24,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x16\x61\x63tivity_service.proto\x12\x10\x61\x63tivity_service\"!\n\x0eWorkoutRequest\x12\x0f\n\x07user_id\x18\x01 \x01(\t\"$\n\x0eSessionRequest\x12\x12\n\nsession_id\x18\x01 \x01(\t\"9\n\x0fWorkoutResponse\x12\x12\n\nsession_id\x18\x01 \x01(\t\x12\x12\n\nstart_time\x18\x02 \x01(\t\"Z\n\x0bVoteRequest\x12\x12\n\nsession_id\x18\x01 \x01(\t\x12\x0f\n\x07user_id\x18\x02 \x01(\t\x12\x14\n\x0cworkout_type\x18\x03 \x01(\t\x12\x10\n\x08\x64uration\x18\x04 \x01(\x05\"\x1f\n\x0cVoteResponse\x12\x0f\n\x07message\x18\x01 \x01(\t\"<\n\x12\x43ountVotesResponse\x12\x14\n\x0cworkout_type\x18\x01 \x01(\t\x12\x10\n\x08\x64uration\x18\x02 \x01(\x05\x32\xcc\x03\n\x0f\x41\x63tivityService\x12Z\n\x13StartWorkoutSession\x12 .activity_service.WorkoutRequest\x1a!.activity_service.WorkoutResponse\x12_\n\x18StartGroupWorkoutSession\x12 .activity_service.WorkoutRequest\x1a!.activity_service.WorkoutResponse\x12X\n\x11\x45ndWorkoutSession\x12 .activity_service.SessionRequest\x1a!.activity_service.WorkoutResponse\x12L\n\x0bVoteWorkout\x12\x1d.activity_service.VoteRequest\x1a\x1e.activity_service.VoteResponse\x12T\n\nCountVotes\x12 .activity_service.SessionRequest\x1a$.activity_service.CountVotesResponseb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x16\x61\x63tivity_service.proto\x12\x10\x61\x63tivity_service\"7\n\x0eWorkoutRequest\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x14\n\x0cworkout_type\x18\x02 \x01(\t\"$\n\x0eSessionRequest\x12\x12\n\nsession_id\x18\x01 \x01(\t\"9\n\x0fWorkoutResponse\x12\x12\n\nsession_id\x18\x01 \x01(\t\x12\x12\n\nstart_time\x18\x02 \x01(\t\"Z\n\x0bVoteRequest\x12\x12\n\nsession_id\x18\x01 \x01(\t\x12\x0f\n\x07user_id\x18\x02 \x01(\t\x12\x14\n\x0cworkout_type\x18\x03 \x01(\t\x12\x10\n\x08\x64uration\x18\x04 \x01(\x05\"\x1f\n\x0cVoteResponse\x12\x0f\n\x07message\x18\x01 \x01(\t\"<\n\x12\x43ountVotesResponse\x12\x14\n\x0cworkout_type\x18\x01 \x01(\t\x12\x10\n\x08\x64uration\x18\x02 \x01(\x05\"4\n\rMemberRequest\x12\x12\n\nsession_id\x18\x01 \x01(\t\x12\x0f\n\x07user_id\x18\x02 \x01(\t\"&\n\x0eMemberResponse\x12\x14\n\x0cparticipants\x18\x01 \x01(\x05\"\x9a\x01\n\x0cSessionEvent\x12\x12\n\nsession_id\x18\x01 \x01(\t\x12\x0c\n\x04type\x18\x02 \x01(\t\x12\x0f\n\x07user_id\x18\x03 \x01(\t\x12\x14\n\x0cworkout_type\x18\x04 \x01(\t\x12\r\n\x05votes\x18\x05 \x01(\x05\x12\x10\n\x08\x64uration\x18\x06 \x01(\x05\x12\x14\n\x0cparticipants\x18\x07 \x01(\x05\x12\n\n\x02\x61t\x18\x08 \x01(\x01\">\n\x0cStatsRequest\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x0e\n\x06period\x18\x02 \x01(\t\x12\r\n\x05limit\x18\x03 \x01(\x05\"L\n\x10WorkoutTypeStats\x12\x14\n\x0cworkout_type\x18\x01 \x01(\t\x12\x10\n\x08sessions\x18\x02 \x01(\x05\x12\x10\n\x08\x64uration\x18\x03 \x01(\x01\"s\n\x0bStatsBucket\x12\r\n\x05start\x18\x01 \x01(\t\x12\x10\n\x08sessions\x18\x02 \x01(\x05\x12\x10\n\x08\x64uration\x18\x03 \x01(\x01\x12\x31\n\x05types\x18\x04 \x03(\x0b\x32\".activity_service.WorkoutTypeStats\"`\n\rStatsResponse\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x0e\n\x06period\x18\x02 \x01(\t\x12.\n\x07\x62uckets\x18\x03 \x03(\x0b\x32\x1d.activity_service.StatsBucket\"&\n\x13GoalProgressRequest\x12\x0f\n\x07user_id\x18\x01 \x01(\t\"\xb9\x01\n\x0cGoalProgress\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\r\n\x05\x66ound\x18\x02 \x01(\x08\x12\x0c\n\x04goal\x18\x03 \x01(\t\x12\x12\n\nrecognized\x18\x04 \x01(\x08\x12\x0e\n\x06period\x18\x05 \x01(\t\x12\x0e\n\x06metric\x18\x06 \x01(\t\x12\x14\n\x0cperiod_start\x18\x07 \x01(\t\x12\x0e\n\x06target\x18\x08 \x01(\x01\x12\x10\n\x08\x61\x63hieved\x18\t \x01(\x01\x12\x0f\n\x07percent\x18\n \x01(\x01\"Y\n\x12SessionLeaderboard\x12\x12\n\nsession_id\x18\x01 \x01(\t\x12/\n\x07\x65ntries\x18\x02 \x03(\x0b\x32\x1e.activity_service.GoalProgress\"\xa8\x01\n\x12LeaderboardRequest\x12\r\n\x05scope\x18\x01 \x01(\t\x12\x11\n\tgoal_type\x18\x02 \x01(\t\x12\x12\n\nsession_id\x18\x03 \x01(\t\x12\x0e\n\x06metric\x18\x04 \x01(\t\x12\x0e\n\x06period\x18\x05 \x01(\t\x12\x0c\n\x04\x64\x61te\x18\x06 \x01(\t\x12\x0e\n\x06offset\x18\x07 \x01(\x05\x12\r\n\x05limit\x18\x08 \x01(\x05\x12\x0f\n\x07user_id\x18\t \x01(\t\"@\n\x10LeaderboardEntry\x12\x0c\n\x04rank\x18\x01 \x01(\x05\x12\x0f\n\x07user_id\x18\x02 \x01(\t\x12\r\n\x05score\x18\x03 \x01(\x01\"\xbd\x01\n\x0bLeaderboard\x12\r\n\x05scope\x18\x01 \x01(\t\x12\x0e\n\x06metric\x18\x02 \x01(\t\x12\x0e\n\x06period\x18\x03 \x01(\t\x12\x14\n\x0cperiod_start\x18\x04 \x01(\t\x12\r\n\x05total\x18\x05 \x01(\x05\x12\x33\n\x07\x65ntries\x18\x06 \x03(\x0b\x32\".activity_service.LeaderboardEntry\x12\x11\n\tuser_rank\x18\x07 \x01(\x05\x12\x12\n\nuser_score\x18\x08 \x01(\x01\x32\xb6\x08\n\x0f\x41\x63tivityService\x12Z\n\x13StartWorkoutSession\x12 .activity_service.WorkoutRequest\x1a!.activity_service.WorkoutResponse\x12_\n\x18StartGroupWorkoutSession\x12 .activity_service.WorkoutRequest\x1a!.activity_service.WorkoutResponse\x12X\n\x11\x45ndWorkoutSession\x12 .activity_service.SessionRequest\x1a!.activity_service.WorkoutResponse\x12L\n\x0bVoteWorkout\x12\x1d.activity_service.VoteRequest\x1a\x1e.activity_service.VoteResponse\x12T\n\nCountVotes\x12 .activity_service.SessionRequest\x1a$.activity_service.CountVotesResponse\x12U\n\x10JoinGroupSession\x12\x1f.activity_service.MemberRequest\x1a .activity_service.MemberResponse\x12V\n\x11LeaveGroupSession\x12\x1f.activity_service.MemberRequest\x1a .activity_service.MemberResponse\x12V\n\x10SubscribeSession\x12 .activity_service.SessionRequest\x1a\x1e.activity_service.SessionEvent0\x01\x12O\n\x0cGetUserStats\x12\x1e.activity_service.StatsRequest\x1a\x1f.activity_service.StatsResponse\x12X\n\x0fGetGoalProgress\x12%.activity_service.GoalProgressRequest\x1a\x1e.activity_service.GoalProgress\x12_\n\x15GetSessionLeaderboard\x12 .activity_service.SessionRequest\x1a$.activity_service.SessionLeaderboard\x12U\n\x0eGetLeaderboard\x12$.activity_service.LeaderboardRequest\x1a\x1d.activity_service.Leaderboardb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -32,17 +32,43 @@ _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'activity_service_pb2', _glo
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
   _globals['_WORKOUTREQUEST']._serialized_start=44
-  _globals['_WORKOUTREQUEST']._serialized_end=77
-  _globals['_SESSIONREQUEST']._serialized_start=79
-  _globals['_SESSIONREQUEST']._serialized_end=115
-  _globals['_WORKOUTRESPONSE']._serialized_start=117
-  _globals['_WORKOUTRESPONSE']._serialized_end=174
-  _globals['_VOTEREQUEST']._serialized_start=176
-  _globals['_VOTEREQUEST']._serialized_end=266
-  _globals['_VOTERESPONSE']._serialized_start=268
-  _globals['_VOTERESPONSE']._serialized_end=299
-  _globals['_COUNTVOTESRESPONSE']._serialized_start=301
-  _globals['_COUNTVOTESRESPONSE']._serialized_end=361
-  _globals['_ACTIVITYSERVICE']._serialized_start=364
-  _globals['_ACTIVITYSERVICE']._serialized_end=824
+  _globals['_WORKOUTREQUEST']._serialized_end=99
+  _globals['_SESSIONREQUEST']._serialized_start=101
+  _globals['_SESSIONREQUEST']._serialized_end=137
+  _globals['_WORKOUTRESPONSE']._serialized_start=139
+  _globals['_WORKOUTRESPONSE']._serialized_end=196
+  _globals['_VOTEREQUEST']._serialized_start=198
+  _globals['_VOTEREQUEST']._serialized_end=288
+  _globals['_VOTERESPONSE']._serialized_start=290
+  _globals['_VOTERESPONSE']._serialized_end=321
+  _globals['_COUNTVOTESRESPONSE']._serialized_start=323
+  _globals['_COUNTVOTESRESPONSE']._serialized_end=383
+  _globals['_MEMBERREQUEST']._serialized_start=385
+  _globals['_MEMBERREQUEST']._serialized_end=437
+  _globals['_MEMBERRESPONSE']._serialized_start=439
+  _globals['_MEMBERRESPONSE']._serialized_end=477
+  _globals['_SESSIONEVENT']._serialized_start=480
+  _globals['_SESSIONEVENT']._serialized_end=634
+  _globals['_STATSREQUEST']._serialized_start=636
+  _globals['_STATSREQUEST']._serialized_end=698
+  _globals['_WORKOUTTYPESTATS']._serialized_start=700
+  _globals['_WORKOUTTYPESTATS']._serialized_end=776
+  _globals['_STATSBUCKET']._serialized_start=778
+  _globals['_STATSBUCKET']._serialized_end=893
+  _globals['_STATSRESPONSE']._serialized_start=895
+  _globals['_STATSRESPONSE']._serialized_end=991
+  _globals['_GOALPROGRESSREQUEST']._serialized_start=993
+  _globals['_GOALPROGRESSREQUEST']._serialized_end=1031
+  _globals['_GOALPROGRESS']._serialized_start=1034
+  _globals['_GOALPROGRESS']._serialized_end=1219
+  _globals['_SESSIONLEADERBOARD']._serialized_start=1221
+  _globals['_SESSIONLEADERBOARD']._serialized_end=1310
+  _globals['_LEADERBOARDREQUEST']._serialized_start=1313
+  _globals['_LEADERBOARDREQUEST']._serialized_end=1481
+  _globals['_LEADERBOARDENTRY']._serialized_start=1483
+  _globals['_LEADERBOARDENTRY']._serialized_end=1547
+  _globals['_LEADERBOARD']._serialized_start=1550
+  _globals['_LEADERBOARD']._serialized_end=1739
+  _globals['_ACTIVITYSERVICE']._serialized_start=1742
+  _globals['_ACTIVITYSERVICE']._serialized_end=2820
 # @@protoc_insertion_point(module_scope)
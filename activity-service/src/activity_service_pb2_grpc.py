@@ -59,6 +59,41 @@ class ActivityServiceStub(object):
                 request_serializer=activity__service__pb2.SessionRequest.SerializeToString,
                 response_deserializer=activity__service__pb2.CountVotesResponse.FromString,
                 _registered_method=True)
+        self.JoinGroupSession = channel.unary_unary(
+                '/activity_service.ActivityService/JoinGroupSession',
+                request_serializer=activity__service__pb2.MemberRequest.SerializeToString,
+                response_deserializer=activity__service__pb2.MemberResponse.FromString,
+                _registered_method=True)
+        self.LeaveGroupSession = channel.unary_unary(
+                '/activity_service.ActivityService/LeaveGroupSession',
+                request_serializer=activity__service__pb2.MemberRequest.SerializeToString,
+                response_deserializer=activity__service__pb2.MemberResponse.FromString,
+                _registered_method=True)
+        self.SubscribeSession = channel.unary_stream(
+                '/activity_service.ActivityService/SubscribeSession',
+                request_serializer=activity__service__pb2.SessionRequest.SerializeToString,
+                response_deserializer=activity__service__pb2.SessionEvent.FromString,
+                _registered_method=True)
+        self.GetUserStats = channel.unary_unary(
+                '/activity_service.ActivityService/GetUserStats',
+                request_serializer=activity__service__pb2.StatsRequest.SerializeToString,
+                response_deserializer=activity__service__pb2.StatsResponse.FromString,
+                _registered_method=True)
+        self.GetGoalProgress = channel.unary_unary(
+                '/activity_service.ActivityService/GetGoalProgress',
+                request_serializer=activity__service__pb2.GoalProgressRequest.SerializeToString,
+                response_deserializer=activity__service__pb2.GoalProgress.FromString,
+                _registered_method=True)
+        self.GetSessionLeaderboard = channel.unary_unary(
+                '/activity_service.ActivityService/GetSessionLeaderboard',
+                request_serializer=activity__service__pb2.SessionRequest.SerializeToString,
+                response_deserializer=activity__service__pb2.SessionLeaderboard.FromString,
+                _registered_method=True)
+        self.GetLeaderboard = channel.unary_unary(
+                '/activity_service.ActivityService/GetLeaderboard',
+                request_serializer=activity__service__pb2.LeaderboardRequest.SerializeToString,
+                response_deserializer=activity__service__pb2.Leaderboard.FromString,
+                _registered_method=True)
 
 
 class ActivityServiceServicer(object):
@@ -94,6 +129,48 @@ class ActivityServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def JoinGroupSession(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def LeaveGroupSession(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def SubscribeSession(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetUserStats(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetGoalProgress(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetSessionLeaderboard(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetLeaderboard(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_ActivityServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -122,6 +199,41 @@ def add_ActivityServiceServicer_to_server(servicer, server):
                     request_deserializer=activity__service__pb2.SessionRequest.FromString,
                     response_serializer=activity__service__pb2.CountVotesResponse.SerializeToString,
             ),
+            'JoinGroupSession': grpc.unary_unary_rpc_method_handler(
+                    servicer.JoinGroupSession,
+                    request_deserializer=activity__service__pb2.MemberRequest.FromString,
+                    response_serializer=activity__service__pb2.MemberResponse.SerializeToString,
+            ),
+            'LeaveGroupSession': grpc.unary_unary_rpc_method_handler(
+                    servicer.LeaveGroupSession,
+                    request_deserializer=activity__service__pb2.MemberRequest.FromString,
+                    response_serializer=activity__service__pb2.MemberResponse.SerializeToString,
+            ),
+            'SubscribeSession': grpc.unary_stream_rpc_method_handler(
+                    servicer.SubscribeSession,
+                    request_deserializer=activity__service__pb2.SessionRequest.FromString,
+                    response_serializer=activity__service__pb2.SessionEvent.SerializeToString,
+            ),
+            'GetUserStats': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetUserStats,
+                    request_deserializer=activity__service__pb2.StatsRequest.FromString,
+                    response_serializer=activity__service__pb2.StatsResponse.SerializeToString,
+            ),
+            'GetGoalProgress': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetGoalProgress,
+                    request_deserializer=activity__service__pb2.GoalProgressRequest.FromString,
+                    response_serializer=activity__service__pb2.GoalProgress.SerializeToString,
+            ),
+            'GetSessionLeaderboard': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetSessionLeaderboard,
+                    request_deserializer=activity__service__pb2.SessionRequest.FromString,
+                    response_serializer=activity__service__pb2.SessionLeaderboard.SerializeToString,
+            ),
+            'GetLeaderboard': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetLeaderboard,
+                    request_deserializer=activity__service__pb2.LeaderboardRequest.FromString,
+                    response_serializer=activity__service__pb2.Leaderboard.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'activity_service.ActivityService', rpc_method_handlers)
@@ -267,3 +379,192 @@ class ActivityService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def JoinGroupSession(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/activity_service.ActivityService/JoinGroupSession',
+            activity__service__pb2.MemberRequest.SerializeToString,
+            activity__service__pb2.MemberResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def LeaveGroupSession(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/activity_service.ActivityService/LeaveGroupSession',
+            activity__service__pb2.MemberRequest.SerializeToString,
+            activity__service__pb2.MemberResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def SubscribeSession(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/activity_service.ActivityService/SubscribeSession',
+            activity__service__pb2.SessionRequest.SerializeToString,
+            activity__service__pb2.SessionEvent.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetUserStats(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/activity_service.ActivityService/GetUserStats',
+            activity__service__pb2.StatsRequest.SerializeToString,
+            activity__service__pb2.StatsResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetGoalProgress(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/activity_service.ActivityService/GetGoalProgress',
+            activity__service__pb2.GoalProgressRequest.SerializeToString,
+            activity__service__pb2.GoalProgress.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetSessionLeaderboard(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/activity_service.ActivityService/GetSessionLeaderboard',
+            activity__service__pb2.SessionRequest.SerializeToString,
+            activity__service__pb2.SessionLeaderboard.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetLeaderboard(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/activity_service.ActivityService/GetLeaderboard',
+            activity__service__pb2.LeaderboardRequest.SerializeToString,
+            activity__service__pb2.Leaderboard.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
@@ -1,22 +1,138 @@
 import os
+import asyncio
 import grpc
 from concurrent import futures
-from flask import Flask, jsonify
-from pymongo import MongoClient
+from datetime import datetime, timezone
+from flask import Flask, Response, jsonify
+from pymongo import AsyncMongoClient, MongoClient
+from pymongo.errors import PyMongoError
 import redis
+import redis.asyncio
+from redis.asyncio.retry import Retry as AsyncRetry
+from redis.backoff import NoBackoff
+from redis.retry import Retry
 from grpc_health.v1 import health, health_pb2_grpc
 import logging
 
 # Import the generated classes
 import activity_service_pb2
 import activity_service_pb2_grpc
-import user_service_pb2
-import user_service_pb2_grpc
+from health_probe import DependencyProber, health_updater
+from idempotency import AsyncIdempotencyCache, IdempotencyCache
+from interceptors import (
+    AdmissionInterceptor,
+    AsyncAdmissionInterceptor,
+    AsyncIdempotencyInterceptor,
+    AsyncMetricsInterceptor,
+    AsyncReadinessInterceptor,
+    AsyncRequestLoggingInterceptor,
+    IdempotencyInterceptor,
+    MetricsInterceptor,
+    ReadinessInterceptor,
+    RequestLoggingInterceptor,
+)
+from leaderboards import METRICS, PERIODS as LEADERBOARD_PERIODS, AsyncLeaderboards, Leaderboards, scope_name
+from log_setup import setup_logging
+import metrics
+from ratelimit import AsyncRateLimiter, ConcurrencyLimiter, RateLimiter, parse_limits, parse_rate
+from serving import HttpServer, wait_for_shutdown, wait_for_shutdown_async
+from progress import AsyncGoalProgress, GoalProgress, rank
+from rollups import PERIODS, AsyncRollupStore, RollupStore
+from session_cache import AsyncSessionCache, SessionCache
+from session_events import (
+    AsyncEventHub,
+    AsyncSessionEvents,
+    EventHub,
+    SessionEvents,
+    tally_fields,
+)
+from sessions import AsyncSessionStore, SessionStore, isoformat
+from user_client import UserServiceClient
+from votes import AsyncVoteTally, VoteTally
+from write_buffer import AsyncWriteBuffer, AsyncWriteJournal, BufferFull, NotFlushed, WriteBuffer, WriteJournal
 
 # Read environment variables
 MONGO_HOST = os.environ.get('MONGO_HOST', 'localhost')
 REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
 USER_SERVICE_HOST = os.environ.get('USER_SERVICE_HOST', 'user-service-1')
+USER_SERVICE_TIMEOUT = float(os.environ.get('USER_SERVICE_TIMEOUT', '0.5'))
+USER_GOAL_CACHE_TTL = int(os.environ.get('USER_GOAL_CACHE_TTL', '60'))
+VOTE_TTL = int(os.environ.get('VOTE_TTL', '86400'))
+GOAL_PROGRESS_TTL = int(os.environ.get('GOAL_PROGRESS_TTL', '60'))
+# Seconds a leaderboard window is kept after it closes
+LEADERBOARD_RETENTION = int(os.environ.get('LEADERBOARD_RETENTION', '691200'))
+# 'threads' (grpc.server on a thread pool) or 'aio' (grpc.aio on asyncio)
+GRPC_SERVER_MODE = os.environ.get('GRPC_SERVER_MODE', 'threads')
+GRPC_MAX_WORKERS = int(os.environ.get('GRPC_MAX_WORKERS', '10'))
+GRPC_MAX_CONCURRENT_RPCS = int(os.environ.get('GRPC_MAX_CONCURRENT_RPCS', '1000'))
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+LOG_INFO_SAMPLE_RATE = float(os.environ.get('LOG_INFO_SAMPLE_RATE', '1.0'))
+HEALTH_PROBE_INTERVAL = float(os.environ.get('HEALTH_PROBE_INTERVAL', '5'))
+HEALTH_PROBE_TIMEOUT = float(os.environ.get('HEALTH_PROBE_TIMEOUT', '1'))
+HEALTH_SERVICE_NAMES = ['', 'activity_service.ActivityService']
+HTTP_THREADS = int(os.environ.get('HTTP_THREADS', '4'))
+# Seconds in-flight RPCs get to finish after SIGTERM
+SHUTDOWN_GRACE = float(os.environ.get('SHUTDOWN_GRACE', '5'))
+# Set by launcher.py when the service runs as several worker processes
+WORKER_INDEX = os.environ.get('WORKER_INDEX')
+# Token buckets per client and method as "Method=rate:burst,..."; others get the default ("" = unlimited)
+RATE_LIMITS = parse_limits(os.environ.get('RATE_LIMITS', 'VoteWorkout=50:100'), parse_rate)
+RATE_LIMIT_DEFAULT = parse_rate(os.environ.get('RATE_LIMIT_DEFAULT', '1000:2000'))
+RATE_LIMIT_TIMEOUT = float(os.environ.get('RATE_LIMIT_TIMEOUT', '0.05'))
+# Methods whose retries are answered from Redis when they carry an
+# idempotency-key; outcomes are kept IDEMPOTENCY_TTL seconds, and a retry
+# waits up to IDEMPOTENCY_WAIT seconds for an attempt still running
+IDEMPOTENT_METHODS = [
+    m.strip() for m in os.environ.get(
+        'IDEMPOTENT_METHODS', 'StartWorkoutSession,StartGroupWorkoutSession,EndWorkoutSession'
+    ).split(',') if m.strip()
+]
+IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', '86400'))
+IDEMPOTENCY_PENDING_TTL = int(os.environ.get('IDEMPOTENCY_PENDING_TTL', '30'))
+IDEMPOTENCY_WAIT = float(os.environ.get('IDEMPOTENCY_WAIT', '2'))
+# Session starts and rollup upserts are queued and written to MongoDB in
+# bulk, once WRITE_BUFFER_BATCH writes wait or the oldest has waited
+# WRITE_BUFFER_INTERVAL seconds. With WRITE_BUFFER_MAX_PENDING queued, RPCs
+# wait up to WRITE_BUFFER_PUT_TIMEOUT for room and then fail with
+# RESOURCE_EXHAUSTED; 0 writes every RPC's changes directly.
+WRITE_BUFFER_MAX_PENDING = int(os.environ.get('WRITE_BUFFER_MAX_PENDING', '10000'))
+WRITE_BUFFER_BATCH = int(os.environ.get('WRITE_BUFFER_BATCH', '500'))
+WRITE_BUFFER_INTERVAL = float(os.environ.get('WRITE_BUFFER_INTERVAL', '0.05'))
+WRITE_BUFFER_PUT_TIMEOUT = float(os.environ.get('WRITE_BUFFER_PUT_TIMEOUT', '1'))
+# Redis stream keeping queued writes until flushed, so a crash does not
+# lose them ("" = not journaled); every replica needs its own key
+WRITE_BUFFER_JOURNAL = os.environ.get('WRITE_BUFFER_JOURNAL', '')
+if WRITE_BUFFER_JOURNAL and WORKER_INDEX is not None:
+    WRITE_BUFFER_JOURNAL = f'{WRITE_BUFFER_JOURNAL}:{WORKER_INDEX}'
+write_buffer_options = {
+    'max_pending': WRITE_BUFFER_MAX_PENDING,
+    'batch_size': WRITE_BUFFER_BATCH,
+    'interval': WRITE_BUFFER_INTERVAL,
+    'put_timeout': WRITE_BUFFER_PUT_TIMEOUT,
+}
+# Max RPCs of a method running at once, as "Method=n,..."
+CONCURRENCY_LIMITS = parse_limits(
+    os.environ.get('CONCURRENCY_LIMITS', 'StartGroupWorkoutSession=4,EndWorkoutSession=6'),
+    int,
+)
+# A SubscribeSession stream holds a worker thread for its lifetime on the threaded server
+if GRPC_SERVER_MODE == 'threads':
+    CONCURRENCY_LIMITS.setdefault('SubscribeSession', GRPC_MAX_WORKERS // 2)
+# Session state kept for VoteWorkout, CountVotes and EndWorkoutSession: up
+# to SESSION_CACHE_SIZE sessions per process for SESSION_CACHE_LOCAL_TTL
+# seconds, in front of Redis entries kept SESSION_CACHE_TTL seconds
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', '10000'))
+SESSION_CACHE_LOCAL_TTL = float(os.environ.get('SESSION_CACHE_LOCAL_TTL', '30'))
+SESSION_CACHE_TTL = int(os.environ.get('SESSION_CACHE_TTL', '3600'))
+session_cache_options = {
+    'maxsize': SESSION_CACHE_SIZE,
+    'local_ttl': SESSION_CACHE_LOCAL_TTL,
+    'ttl': SESSION_CACHE_TTL,
+}
+# Tally updates are published at most this often per session
+SESSION_TALLY_INTERVAL = float(os.environ.get('SESSION_TALLY_INTERVAL', '0.25'))
+# Seconds between keepalive checks on an idle SubscribeSession stream
+SESSION_SUBSCRIBE_POLL = float(os.environ.get('SESSION_SUBSCRIBE_POLL', '5'))
 
 # MongoDB setup
 mongo_client = MongoClient(f'mongodb://{MONGO_HOST}:27017/')
@@ -25,65 +141,729 @@ sessions_collection = db['sessions']
 
 # Redis setup
 redis_client = redis.Redis(host=REDIS_HOST, port=6379, db=0)
+vote_tally = VoteTally(redis_client, ttl=VOTE_TTL)
+session_events = SessionEvents(
+    redis_client, vote_tally, ttl=VOTE_TTL, tally_interval=SESSION_TALLY_INTERVAL
+)
+event_hub = EventHub(redis_client)
+
+# Session and rollup writes go through the write buffer unless it is disabled
+write_buffer = None
+if WRITE_BUFFER_MAX_PENDING:
+    write_buffer = WriteBuffer(
+        db, journal=WriteJournal(redis_client, WRITE_BUFFER_JOURNAL) if WRITE_BUFFER_JOURNAL else None,
+        **write_buffer_options
+    )
+session_store = SessionStore(sessions_collection, write_buffer)
+rollup_store = RollupStore(db['rollups'], write_buffer)
+session_cache = SessionCache(redis_client, session_store, **session_cache_options)
+
+# Rate limiting gets its own client: a tight timeout and no retries, since a
+# slow answer is worse than falling back to local buckets
+rate_limit_redis = redis.Redis(
+    host=REDIS_HOST, port=6379, db=0,
+    socket_timeout=RATE_LIMIT_TIMEOUT, socket_connect_timeout=RATE_LIMIT_TIMEOUT,
+    retry=Retry(NoBackoff(), 0)
+)
+concurrency_limiter = ConcurrencyLimiter(CONCURRENCY_LIMITS)
 
 # User Service gRPC client
-user_channel = grpc.insecure_channel(f'{USER_SERVICE_HOST}:50051')
-user_stub = user_service_pb2_grpc.UserServiceStub(user_channel)
+user_client = UserServiceClient(
+    f'{USER_SERVICE_HOST}:50051',
+    timeout=USER_SERVICE_TIMEOUT,
+    cache_ttl=USER_GOAL_CACHE_TTL,
+)
+
+goal_progress = GoalProgress(redis_client, rollup_store, user_client.get_goals, ttl=GOAL_PROGRESS_TTL)
+leaderboards = Leaderboards(redis_client, user_client.get_goals, retention=LEADERBOARD_RETENTION)
+
+# Dependency health: sessions live in MongoDB and votes in Redis, so both decide readiness
+prober = DependencyProber(
+    {'mongo': lambda: mongo_client.admin.command('ping'), 'redis': redis_client.ping},
+    critical=['mongo', 'redis'],
+    interval=HEALTH_PROBE_INTERVAL,
+    timeout=HEALTH_PROBE_TIMEOUT,
+)
 
 # Create logs directory
 os.makedirs('/app/logs', exist_ok=True)
 
-# Configure logging
-logging.basicConfig(
-    filename='/app/logs/activity-service.log',
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)s %(message)s'
+# Configure logging: JSON lines written by a background listener thread
+log_handler = setup_logging(
+    'activity-service',
+    '/app/logs/activity-service.log' if WORKER_INDEX is None else f'/app/logs/activity-service-{WORKER_INDEX}.log',
+    queue_size=LOG_QUEUE_SIZE,
+    info_sample_rate=LOG_INFO_SAMPLE_RATE,
+)
+
+metrics.Gauge(
+    'log_records_dropped', 'Log records dropped because the log queue was full.',
+    function=lambda: {(): log_handler.dropped}
+)
+metrics.Gauge(
+    'dependency_healthy', 'Whether each dependency passed its last health probes.', ['dependency'],
+    function=lambda: {(name,): int(dep['healthy']) for name, dep in prober.status()['dependencies'].items()}
+)
+
+INVALID_VOTE = 'session_id, user_id, workout_type and a non-negative duration are required'
+
+def is_valid_vote(request):
+    return bool(request.session_id and request.user_id and request.workout_type) and request.duration >= 0
+
+SESSION_NOT_FOUND = 'Session not found'
+SESSION_STORE_UNAVAILABLE = 'Session store unavailable, try again'
+
+def refuse_vote(session):
+    # Returns (status code, details) when votes on the session are not accepted
+    if session is None:
+        return grpc.StatusCode.NOT_FOUND, SESSION_NOT_FOUND
+    if not session.open:
+        return grpc.StatusCode.FAILED_PRECONDITION, 'Session has ended'
+    return None
+
+INVALID_MEMBER = 'session_id and user_id are required'
+
+def session_event(event):
+    return activity_service_pb2.SessionEvent(
+        session_id=event['session_id'],
+        type=event['type'],
+        user_id=event.get('user_id', ''),
+        workout_type=event.get('workout_type', ''),
+        votes=event.get('votes', 0),
+        duration=event.get('duration', 0),
+        participants=event.get('participants', 0),
+        at=event.get('at', 0),
+    )
+
+INVALID_STATS = 'user_id is required and period must be one of ' + ', '.join(PERIODS)
+DEFAULT_STATS_PERIOD = 'week'
+
+def stats_period(request):
+    # Returns the requested period, or None if the request is invalid
+    period = request.period or DEFAULT_STATS_PERIOD
+    return period if request.user_id and period in PERIODS else None
+
+def stats_response(user_id, period, rollups):
+    return activity_service_pb2.StatsResponse(
+        user_id=user_id,
+        period=period,
+        buckets=[
+            activity_service_pb2.StatsBucket(
+                start=rollup['start'].date().isoformat(),
+                sessions=rollup['sessions'],
+                duration=rollup['duration'],
+                types=[
+                    activity_service_pb2.WorkoutTypeStats(
+                        workout_type=workout_type, sessions=totals['sessions'], duration=totals['duration']
+                    )
+                    for workout_type, totals in sorted(rollup.get('types', {}).items())
+                ],
+            )
+            for rollup in rollups
+        ],
+    )
+
+USER_SERVICE_UNAVAILABLE = 'User service unavailable'
+
+def progress_message(progress):
+    return activity_service_pb2.GoalProgress(**progress)
+
+def leaderboard_response(session_id, progresses):
+    return activity_service_pb2.SessionLeaderboard(
+        session_id=session_id,
+        entries=[progress_message(progress) for progress in rank(progresses)],
+    )
+
+INVALID_LEADERBOARD = (
+    'scope must be global, goal with a goal_type or session with a session_id; metric one of '
+    + ', '.join(METRICS) + '; period one of ' + ', '.join(LEADERBOARD_PERIODS)
+    + '; date YYYY-MM-DD; offset and limit not negative'
 )
 
+def leaderboard_query(request):
+    # Returns (scope, metric, period, when), or None if the request is invalid
+    scope = scope_name(request.scope or 'global', request.goal_type, request.session_id)
+    metric = request.metric or 'duration'
+    period = request.period or DEFAULT_STATS_PERIOD
+    if scope is None or metric not in METRICS or period not in LEADERBOARD_PERIODS:
+        return None
+    if request.offset < 0 or request.limit < 0:
+        return None
+    if not request.date:
+        return scope, metric, period, datetime.now(timezone.utc)
+    try:
+        return scope, metric, period, datetime.strptime(request.date, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+def board_response(request, metric, period, board):
+    return activity_service_pb2.Leaderboard(
+        scope=request.scope or 'global',
+        metric=metric,
+        period=period,
+        period_start=board['period_start'],
+        total=board['total'],
+        entries=[activity_service_pb2.LeaderboardEntry(**entry) for entry in board['entries']],
+        user_rank=board['user_rank'],
+        user_score=board['user_score'],
+    )
+
+def session_participants(session, members):
+    participants = set(members)
+    if session is not None:
+        participants.add(session.user_id)
+    return sorted(participants)
+
+def rollup_workout_type(session, leader):
+    # A group session without a chosen type counts as the winning vote
+    if session.get('workout_type'):
+        return session['workout_type']
+    return leader[0] if leader else ''
+
+def current_tally(session_id, leader):
+    # First message of a subscription, so late joiners start from the current state
+    if leader is None:
+        return []
+    return [session_event(dict(tally_fields(leader), type='tally', session_id=session_id))]
+
+def record_rollup(session):
+    # The session has ended either way, so a failed rollup is logged rather than failing the RPC
+    session_id = str(session['_id'])
+    try:
+        user_ids = {session['user_id']}
+        leader = None
+        if session.get('group'):
+            user_ids.update(session_events.members(session_id))
+            if not session.get('workout_type'):
+                leader = vote_tally.leader(session_id)
+        leaderboards.record(session, sorted(user_ids))
+        rollup_store.record(
+            sorted(user_ids), rollup_workout_type(session, leader),
+            session['start_time'], session['duration'],
+        )
+        goal_progress.invalidate(user_ids)
+    except (PyMongoError, redis.RedisError, BufferFull) as e:
+        logging.error("Failed to update rollups for session %s: %s", session_id, e)
+
 # gRPC service implementation
 class ActivityService(activity_service_pb2_grpc.ActivityServiceServicer):
     def StartWorkoutSession(self, request, context):
-        session_id = "session123"
-        start_time = "2023-11-08T12:00:00Z"
-        logging.info(f"StartWorkoutSession called by user {request.user_id}")
+        try:
+            session = session_store.start(request.user_id, workout_type=request.workout_type)
+        except BufferFull as e:
+            context.set_details(str(e))
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            logging.warning("Rejected session start for user %s: %s", request.user_id, e)
+            return activity_service_pb2.WorkoutResponse()
+        session_cache.put(session)
+        logging.info("Started session %s for user %s", session['_id'], request.user_id)
         return activity_service_pb2.WorkoutResponse(
-            session_id=session_id,
-            start_time=start_time
+            session_id=str(session['_id']),
+            start_time=isoformat(session['start_time'])
         )
 
     def EndWorkoutSession(self, request, context):
-        logging.info(f"EndWorkoutSession called for session {request.session_id}")
+        # A session known to have ended is refused without going to MongoDB;
+        # the cached start lets a session still buffered on another replica end here
+        cached = session_cache.peek(request.session_id)
+        try:
+            session = None
+            if cached is None or cached.open:
+                session = session_store.end(request.session_id, cached.document() if cached else None)
+        except (NotFlushed, PyMongoError) as e:
+            context.set_details(SESSION_STORE_UNAVAILABLE)
+            context.set_code(grpc.StatusCode.UNAVAILABLE)
+            logging.error("Cannot end session %s: %s", request.session_id, e)
+            return activity_service_pb2.WorkoutResponse()
+        if session is None:
+            context.set_details('Session not found or already ended')
+            context.set_code(grpc.StatusCode.NOT_FOUND)
+            logging.error("Cannot end session %s: not found or already ended", request.session_id)
+            return activity_service_pb2.WorkoutResponse()
+        session_cache.put(session)
+        logging.info("Ended session %s after %.0fs", request.session_id, session['duration'])
+        record_rollup(session)
         return activity_service_pb2.WorkoutResponse(
             session_id=request.session_id,
-            start_time=""
+            start_time=isoformat(session['start_time'])
         )
 
+    def GetUserStats(self, request, context):
+        period = stats_period(request)
+        if period is None:
+            context.set_details(INVALID_STATS)
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            return activity_service_pb2.StatsResponse()
+        rollups = rollup_store.stats(request.user_id, period, request.limit)
+        return stats_response(request.user_id, period, rollups)
+
+    def GetGoalProgress(self, request, context):
+        if not request.user_id:
+            context.set_details('user_id is required')
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            return activity_service_pb2.GoalProgress()
+        try:
+            return progress_message(goal_progress.get(request.user_id))
+        except (grpc.RpcError, LookupError) as e:
+            logging.error("Goal lookup for user %s failed: %s", request.user_id, e)
+            context.set_details(USER_SERVICE_UNAVAILABLE)
+            context.set_code(grpc.StatusCode.UNAVAILABLE)
+            return activity_service_pb2.GoalProgress()
+
+    def GetSessionLeaderboard(self, request, context):
+        participants = session_participants(
+            session_cache.get(request.session_id), session_events.members(request.session_id)
+        )
+        if not participants:
+            context.set_details(SESSION_NOT_FOUND)
+            context.set_code(grpc.StatusCode.NOT_FOUND)
+            return activity_service_pb2.SessionLeaderboard()
+        try:
+            progresses = goal_progress.get_many(participants)
+        except (grpc.RpcError, LookupError) as e:
+            logging.error("Goal lookup for session %s failed: %s", request.session_id, e)
+            context.set_details(USER_SERVICE_UNAVAILABLE)
+            context.set_code(grpc.StatusCode.UNAVAILABLE)
+            return activity_service_pb2.SessionLeaderboard()
+        logging.info("Ranked %s participants of session %s", len(progresses), request.session_id)
+        return leaderboard_response(request.session_id, progresses)
+
+    def GetLeaderboard(self, request, context):
+        query = leaderboard_query(request)
+        if query is None:
+            context.set_details(INVALID_LEADERBOARD)
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            return activity_service_pb2.Leaderboard()
+        scope, metric, period, when = query
+        board = leaderboards.get(scope, metric, period, when, request.offset, request.limit, request.user_id)
+        return board_response(request, metric, period, board)
+
     def StartGroupWorkoutSession(self, request, context):
-        session_id = "group_session123"
-        start_time = "2023-11-08T12:00:00Z"
-        logging.info(f"StartGroupWorkoutSession called by user {request.user_id}")
+        try:
+            session = session_store.start(request.user_id, group=True, workout_type=request.workout_type)
+        except BufferFull as e:
+            context.set_details(str(e))
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            logging.warning("Rejected group session start for user %s: %s", request.user_id, e)
+            return activity_service_pb2.WorkoutResponse()
+        session_cache.put(session)
+        logging.info("Started group session %s for user %s", session['_id'], request.user_id)
         return activity_service_pb2.WorkoutResponse(
-            session_id=session_id,
-            start_time=start_time
+            session_id=str(session['_id']),
+            start_time=isoformat(session['start_time'])
         )
 
+    def VoteWorkout(self, request, context):
+        if not is_valid_vote(request):
+            context.set_details(INVALID_VOTE)
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            return activity_service_pb2.VoteResponse()
+        refused = refuse_vote(session_cache.get(request.session_id))
+        if refused is not None:
+            code, details = refused
+            context.set_details(details)
+            context.set_code(code)
+            return activity_service_pb2.VoteResponse()
+        replaced = vote_tally.cast(
+            request.session_id, request.user_id, request.workout_type, request.duration
+        )
+        session_events.voted(request.session_id, request.user_id, request.workout_type)
+        logging.info("User %s voted %s in session %s", request.user_id, request.workout_type, request.session_id)
+        return activity_service_pb2.VoteResponse(
+            message='Vote updated' if replaced else 'Vote recorded'
+        )
+
+    def CountVotes(self, request, context):
+        if session_cache.get(request.session_id) is None:
+            context.set_details(SESSION_NOT_FOUND)
+            context.set_code(grpc.StatusCode.NOT_FOUND)
+            return activity_service_pb2.CountVotesResponse()
+        leader = vote_tally.leader(request.session_id)
+        if leader is None:
+            context.set_details('No votes for session')
+            context.set_code(grpc.StatusCode.NOT_FOUND)
+            logging.error("No votes found for session %s", request.session_id)
+            return activity_service_pb2.CountVotesResponse()
+        workout_type, votes, duration = leader
+        logging.info("Session %s leads with %s (%s votes)", request.session_id, workout_type, votes)
+        return activity_service_pb2.CountVotesResponse(
+            workout_type=workout_type,
+            duration=duration
+        )
+
+    def JoinGroupSession(self, request, context):
+        if not (request.session_id and request.user_id):
+            context.set_details(INVALID_MEMBER)
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            return activity_service_pb2.MemberResponse()
+        participants = session_events.join(request.session_id, request.user_id)
+        logging.info("User %s joined session %s", request.user_id, request.session_id)
+        return activity_service_pb2.MemberResponse(participants=participants)
+
+    def LeaveGroupSession(self, request, context):
+        if not (request.session_id and request.user_id):
+            context.set_details(INVALID_MEMBER)
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            return activity_service_pb2.MemberResponse()
+        participants = session_events.leave(request.session_id, request.user_id)
+        logging.info("User %s left session %s", request.user_id, request.session_id)
+        return activity_service_pb2.MemberResponse(participants=participants)
+
+    def SubscribeSession(self, request, context):
+        subscription = event_hub.subscribe(request.session_id)
+        logging.info("Subscribed to session %s", request.session_id)
+        try:
+            yield from current_tally(request.session_id, vote_tally.leader(request.session_id))
+            while context.is_active() and not subscription.closed:
+                for event in subscription.get(SESSION_SUBSCRIBE_POLL):
+                    yield session_event(event)
+        finally:
+            event_hub.unsubscribe(subscription)
+
+# asyncio gRPC service implementation, used when GRPC_SERVER_MODE=aio
+class AsyncActivityService(activity_service_pb2_grpc.ActivityServiceServicer):
+    def __init__(self, session_store, session_cache, rollup_store, goal_progress, leaderboards, vote_tally,
+                 session_events, event_hub):
+        self.session_store = session_store
+        self.session_cache = session_cache
+        self.rollup_store = rollup_store
+        self.goal_progress = goal_progress
+        self.leaderboards = leaderboards
+        self.vote_tally = vote_tally
+        self.session_events = session_events
+        self.event_hub = event_hub
+
+    async def StartWorkoutSession(self, request, context):
+        try:
+            session = await self.session_store.start(request.user_id, workout_type=request.workout_type)
+        except BufferFull as e:
+            logging.warning("Rejected session start for user %s: %s", request.user_id, e)
+            await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(e))
+        await self.session_cache.put(session)
+        logging.info("Started session %s for user %s", session['_id'], request.user_id)
+        return activity_service_pb2.WorkoutResponse(
+            session_id=str(session['_id']),
+            start_time=isoformat(session['start_time'])
+        )
+
+    async def EndWorkoutSession(self, request, context):
+        cached = await self.session_cache.peek(request.session_id)
+        session = None
+        try:
+            if cached is None or cached.open:
+                session = await self.session_store.end(request.session_id, cached.document() if cached else None)
+        except (NotFlushed, PyMongoError) as e:
+            logging.error("Cannot end session %s: %s", request.session_id, e)
+            await context.abort(grpc.StatusCode.UNAVAILABLE, SESSION_STORE_UNAVAILABLE)
+        if session is None:
+            logging.error("Cannot end session %s: not found or already ended", request.session_id)
+            await context.abort(grpc.StatusCode.NOT_FOUND, 'Session not found or already ended')
+        await self.session_cache.put(session)
+        logging.info("Ended session %s after %.0fs", request.session_id, session['duration'])
+        await self.record_rollup(session)
+        return activity_service_pb2.WorkoutResponse(
+            session_id=request.session_id,
+            start_time=isoformat(session['start_time'])
+        )
+
+    async def record_rollup(self, session):
+        session_id = str(session['_id'])
+        try:
+            user_ids = {session['user_id']}
+            leader = None
+            if session.get('group'):
+                user_ids.update(await self.session_events.members(session_id))
+                if not session.get('workout_type'):
+                    leader = await self.vote_tally.leader(session_id)
+            await self.leaderboards.record(session, sorted(user_ids))
+            await self.rollup_store.record(
+                sorted(user_ids), rollup_workout_type(session, leader),
+                session['start_time'], session['duration'],
+            )
+            await self.goal_progress.invalidate(user_ids)
+        except (PyMongoError, redis.RedisError, BufferFull) as e:
+            logging.error("Failed to update rollups for session %s: %s", session_id, e)
+
+    async def GetUserStats(self, request, context):
+        period = stats_period(request)
+        if period is None:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, INVALID_STATS)
+        rollups = await self.rollup_store.stats(request.user_id, period, request.limit)
+        return stats_response(request.user_id, period, rollups)
+
+    async def GetGoalProgress(self, request, context):
+        if not request.user_id:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'user_id is required')
+        try:
+            progress = await self.goal_progress.get(request.user_id)
+        except (grpc.RpcError, LookupError) as e:
+            logging.error("Goal lookup for user %s failed: %s", request.user_id, e)
+            await context.abort(grpc.StatusCode.UNAVAILABLE, USER_SERVICE_UNAVAILABLE)
+        return progress_message(progress)
+
+    async def GetSessionLeaderboard(self, request, context):
+        session, members = await asyncio.gather(
+            self.session_cache.get(request.session_id),
+            self.session_events.members(request.session_id),
+        )
+        participants = session_participants(session, members)
+        if not participants:
+            await context.abort(grpc.StatusCode.NOT_FOUND, SESSION_NOT_FOUND)
+        try:
+            progresses = await self.goal_progress.get_many(participants)
+        except (grpc.RpcError, LookupError) as e:
+            logging.error("Goal lookup for session %s failed: %s", request.session_id, e)
+            await context.abort(grpc.StatusCode.UNAVAILABLE, USER_SERVICE_UNAVAILABLE)
+        logging.info("Ranked %s participants of session %s", len(progresses), request.session_id)
+        return leaderboard_response(request.session_id, progresses)
+
+    async def GetLeaderboard(self, request, context):
+        query = leaderboard_query(request)
+        if query is None:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, INVALID_LEADERBOARD)
+        scope, metric, period, when = query
+        board = await self.leaderboards.get(scope, metric, period, when, request.offset, request.limit, request.user_id)
+        return board_response(request, metric, period, board)
+
+    async def StartGroupWorkoutSession(self, request, context):
+        try:
+            session = await self.session_store.start(
+                request.user_id, group=True, workout_type=request.workout_type
+            )
+        except BufferFull as e:
+            logging.warning("Rejected group session start for user %s: %s", request.user_id, e)
+            await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(e))
+        await self.session_cache.put(session)
+        logging.info("Started group session %s for user %s", session['_id'], request.user_id)
+        return activity_service_pb2.WorkoutResponse(
+            session_id=str(session['_id']),
+            start_time=isoformat(session['start_time'])
+        )
+
+    async def VoteWorkout(self, request, context):
+        if not is_valid_vote(request):
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, INVALID_VOTE)
+        refused = refuse_vote(await self.session_cache.get(request.session_id))
+        if refused is not None:
+            await context.abort(*refused)
+        replaced = await self.vote_tally.cast(
+            request.session_id, request.user_id, request.workout_type, request.duration
+        )
+        await self.session_events.voted(request.session_id, request.user_id, request.workout_type)
+        logging.info("User %s voted %s in session %s", request.user_id, request.workout_type, request.session_id)
+        return activity_service_pb2.VoteResponse(
+            message='Vote updated' if replaced else 'Vote recorded'
+        )
+
+    async def CountVotes(self, request, context):
+        if await self.session_cache.get(request.session_id) is None:
+            await context.abort(grpc.StatusCode.NOT_FOUND, SESSION_NOT_FOUND)
+        leader = await self.vote_tally.leader(request.session_id)
+        if leader is None:
+            logging.error("No votes found for session %s", request.session_id)
+            await context.abort(grpc.StatusCode.NOT_FOUND, 'No votes for session')
+        workout_type, votes, duration = leader
+        logging.info("Session %s leads with %s (%s votes)", request.session_id, workout_type, votes)
+        return activity_service_pb2.CountVotesResponse(
+            workout_type=workout_type,
+            duration=duration
+        )
+
+    async def JoinGroupSession(self, request, context):
+        if not (request.session_id and request.user_id):
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, INVALID_MEMBER)
+        participants = await self.session_events.join(request.session_id, request.user_id)
+        logging.info("User %s joined session %s", request.user_id, request.session_id)
+        return activity_service_pb2.MemberResponse(participants=participants)
+
+    async def LeaveGroupSession(self, request, context):
+        if not (request.session_id and request.user_id):
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, INVALID_MEMBER)
+        participants = await self.session_events.leave(request.session_id, request.user_id)
+        logging.info("User %s left session %s", request.user_id, request.session_id)
+        return activity_service_pb2.MemberResponse(participants=participants)
+
+    async def SubscribeSession(self, request, context):
+        subscription = self.event_hub.subscribe(request.session_id)
+        logging.info("Subscribed to session %s", request.session_id)
+        try:
+            leader = await self.vote_tally.leader(request.session_id)
+            for message in current_tally(request.session_id, leader):
+                yield message
+            while not subscription.closed:
+                for event in await subscription.get(SESSION_SUBSCRIBE_POLL):
+                    yield session_event(event)
+        finally:
+            self.event_hub.unsubscribe(subscription)
+
 # Start gRPC server
 def serve_grpc():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    session_store.ensure_indexes()
+    rollup_store.ensure_indexes()
+    if write_buffer is not None:
+        write_buffer.recover()
+        write_buffer.start()
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=GRPC_MAX_WORKERS),
+        maximum_concurrent_rpcs=GRPC_MAX_CONCURRENT_RPCS,
+        # Lets launcher.py workers share the port
+        options=[('grpc.so_reuseport', 1)],
+        interceptors=[
+            MetricsInterceptor(),
+            RequestLoggingInterceptor(),
+            ReadinessInterceptor(prober),
+            IdempotencyInterceptor(
+                IdempotencyCache(
+                    redis_client, ttl=IDEMPOTENCY_TTL, pending_ttl=IDEMPOTENCY_PENDING_TTL, wait=IDEMPOTENCY_WAIT
+                ),
+                IDEMPOTENT_METHODS,
+            ),
+            AdmissionInterceptor(
+                concurrency_limiter,
+                RateLimiter(rate_limit_redis, RATE_LIMITS, default=RATE_LIMIT_DEFAULT),
+            ),
+        ]
+    )
     activity_service_pb2_grpc.add_ActivityServiceServicer_to_server(ActivityService(), server)
-    health_pb2_grpc.add_HealthServicer_to_server(health.HealthServicer(), server)
+    health_servicer = health.HealthServicer()
+    health_pb2_grpc.add_HealthServicer_to_server(health_servicer, server)
+    prober.on_change(health_updater(health_servicer, HEALTH_SERVICE_NAMES))
+    prober.start()
+    event_hub.start()
+    session_cache.start()
+    session_events.start()
     server.add_insecure_port('[::]:50052')
     server.start()
     logging.info('Starting Activity Service on port 50052...')
-    server.wait_for_termination()
+    wait_for_shutdown()
+    # Health turns NOT_SERVING first so new RPCs go elsewhere while these drain
+    logging.info('Shutting down, draining RPCs for up to %ss', SHUTDOWN_GRACE)
+    prober.stop()
+    # Subscription streams end instead of holding the drain open
+    event_hub.stop()
+    session_cache.stop()
+    server.stop(SHUTDOWN_GRACE).wait()
+    session_events.stop()
+    # Nothing queues writes any more, so whatever is left can be flushed
+    if write_buffer is not None:
+        write_buffer.stop(SHUTDOWN_GRACE)
+
+async def serve_aio():
+    # Async clients are created inside the running loop they belong to
+    async_mongo_client = AsyncMongoClient(f'mongodb://{MONGO_HOST}:27017/')
+    async_redis_client = redis.asyncio.Redis(host=REDIS_HOST, port=6379, db=0)
+    async_db = async_mongo_client['activity_db']
+    async_write_buffer = None
+    if WRITE_BUFFER_MAX_PENDING:
+        async_write_buffer = AsyncWriteBuffer(
+            async_db,
+            journal=AsyncWriteJournal(async_redis_client, WRITE_BUFFER_JOURNAL) if WRITE_BUFFER_JOURNAL else None,
+            **write_buffer_options
+        )
+    async_session_store = AsyncSessionStore(async_db['sessions'], async_write_buffer)
+    await async_session_store.ensure_indexes()
+    async_session_cache = AsyncSessionCache(async_redis_client, async_session_store, **session_cache_options)
+    async_rollup_store = AsyncRollupStore(async_db['rollups'], async_write_buffer)
+    await async_rollup_store.ensure_indexes()
+    if async_write_buffer is not None:
+        await async_write_buffer.recover()
+        async_write_buffer.start()
 
+    async def lookup_goals(user_ids):
+        # The shared client batches and caches lookups; its futures are awaited here
+        goals = await asyncio.gather(*(asyncio.wrap_future(user_client.lookup(u)) for u in user_ids))
+        return dict(zip(user_ids, goals))
+    async_vote_tally = AsyncVoteTally(async_redis_client, ttl=VOTE_TTL)
+    async_session_events = AsyncSessionEvents(
+        async_redis_client, async_vote_tally, ttl=VOTE_TTL, tally_interval=SESSION_TALLY_INTERVAL
+    )
+    async_event_hub = AsyncEventHub(async_redis_client)
+    async_goal_progress = AsyncGoalProgress(
+        async_redis_client, async_rollup_store, lookup_goals, ttl=GOAL_PROGRESS_TTL
+    )
+    async_leaderboards = AsyncLeaderboards(async_redis_client, lookup_goals, retention=LEADERBOARD_RETENTION)
+
+    async_rate_limit_redis = redis.asyncio.Redis(
+        host=REDIS_HOST, port=6379, db=0,
+        socket_timeout=RATE_LIMIT_TIMEOUT, socket_connect_timeout=RATE_LIMIT_TIMEOUT,
+        retry=AsyncRetry(NoBackoff(), 0)
+    )
+    server = grpc.aio.server(
+        maximum_concurrent_rpcs=GRPC_MAX_CONCURRENT_RPCS,
+        # Lets launcher.py workers share the port
+        options=[('grpc.so_reuseport', 1)],
+        interceptors=[
+            AsyncMetricsInterceptor(),
+            AsyncRequestLoggingInterceptor(),
+            AsyncReadinessInterceptor(prober),
+            AsyncIdempotencyInterceptor(
+                AsyncIdempotencyCache(
+                    async_redis_client, ttl=IDEMPOTENCY_TTL, pending_ttl=IDEMPOTENCY_PENDING_TTL, wait=IDEMPOTENCY_WAIT
+                ),
+                IDEMPOTENT_METHODS,
+            ),
+            AsyncAdmissionInterceptor(
+                concurrency_limiter,
+                AsyncRateLimiter(async_rate_limit_redis, RATE_LIMITS, default=RATE_LIMIT_DEFAULT),
+            ),
+        ]
+    )
+    activity_service_pb2_grpc.add_ActivityServiceServicer_to_server(
+        AsyncActivityService(
+            async_session_store, async_session_cache, async_rollup_store, async_goal_progress, async_leaderboards,
+            async_vote_tally, async_session_events, async_event_hub,
+        ),
+        server
+    )
+    health_servicer = health.aio.HealthServicer()
+    health_pb2_grpc.add_HealthServicer_to_server(health_servicer, server)
+    loop = asyncio.get_running_loop()
+    prober.on_change(health_updater(health_servicer, HEALTH_SERVICE_NAMES, loop))
+    # The first probe round blocks, so it runs off the event loop
+    await loop.run_in_executor(None, prober.start)
+    async_event_hub.start()
+    async_session_cache.start()
+    server.add_insecure_port('[::]:50052')
+    await server.start()
+    logging.info('Starting Activity Service (asyncio) on port 50052...')
+    await wait_for_shutdown_async()
+    logging.info('Shutting down, draining RPCs for up to %ss', SHUTDOWN_GRACE)
+    prober.stop()
+    async_event_hub.stop()
+    async_session_cache.stop()
+    await server.stop(SHUTDOWN_GRACE)
+    if async_write_buffer is not None:
+        await async_write_buffer.stop(SHUTDOWN_GRACE)
+    await async_redis_client.aclose()
+    await async_rate_limit_redis.aclose()
+    await async_mongo_client.close()
+
+# Flask app for status, readiness and metrics
 app = Flask(__name__)
 
 @app.route('/status')
 def status():
-    return jsonify({'status': 'Activity Service Running'})
+    return jsonify({'status': 'Activity Service Running', 'health': prober.status()})
+
+@app.route('/ready')
+def ready():
+    # Readiness for the load balancer / orchestrator: 503 while a critical dependency is down
+    health_status = prober.status()
+    return jsonify(health_status), 200 if health_status['ready'] else 503
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
-    from threading import Thread
-    Thread(target=lambda: app.run(host='0.0.0.0', port=5001)).start()
-    serve_grpc()
+    http_server = HttpServer(app, 5001, threads=HTTP_THREADS, reuse_port=WORKER_INDEX is not None)
+    http_server.start()
+    if GRPC_SERVER_MODE == 'aio':
+        asyncio.run(serve_aio())
+    else:
+        serve_grpc()
+    # gRPC has drained: stop serving HTTP and close the clients
+    http_server.stop()
+    user_client.close()
+    mongo_client.close()
+    logging.info('Activity Service stopped')
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent import futures
+
+from grpc_health.v1 import health_pb2
+
+
+class DependencyProber:
+    """Periodically checks the service's dependencies from a background thread.
+
+    checks maps a dependency name to a callable that raises (or returns
+    False) when the dependency is unhealthy. Only dependencies in critical
+    decide readiness; the rest are reported but, like Redis in front of a
+    database, can fail without taking the replica out of rotation. A check
+    that does not answer within timeout counts as a failure, and a
+    dependency flips to unhealthy after failure_threshold consecutive
+    failures so a single slow probe does not drain the replica.
+    """
+
+    def __init__(self, checks, critical, interval=5.0, timeout=1.0, failure_threshold=2):
+        self._checks = checks
+        self._critical = set(critical)
+        self._interval = interval
+        self._timeout = timeout
+        self._failure_threshold = failure_threshold
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers=len(checks), thread_name_prefix='health-probe'
+        )
+        self._running = {}
+        self._failures = {name: 0 for name in checks}
+        self._status = {name: {'healthy': False, 'error': 'not probed yet'} for name in checks}
+        self._ready = False
+        self._probed = False
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    @property
+    def ready(self):
+        return self._ready
+
+    def status(self):
+        with self._lock:
+            return {'ready': self._ready, 'dependencies': {k: dict(v) for k, v in self._status.items()}}
+
+    def on_change(self, listener):
+        # listener(ready) is called with the readiness after every probe round
+        self._listeners.append(listener)
+
+    def start(self):
+        # The first round runs inline so the server starts with a real status
+        self.probe()
+        threading.Thread(target=self._run, name='health-prober', daemon=True).start()
+
+    def stop(self):
+        # Stops probing and reports not ready from then on, e.g. while draining for shutdown
+        self._stopped.set()
+        with self._lock:
+            self._ready = False
+        for listener in self._listeners:
+            listener(False)
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                self.probe()
+            except Exception:
+                logging.exception("Health probe round failed")
+
+    def probe(self):
+        submitted = {}
+        for name, check in self._checks.items():
+            running = self._running.get(name)
+            if running is not None and not running.done():
+                # Still hanging from an earlier round: counts as another failure
+                continue
+            submitted[name] = self._running[name] = self._executor.submit(self._timed, check)
+
+        deadline = time.monotonic() + self._timeout
+        results = {}
+        for name in self._checks:
+            future = submitted.get(name)
+            if future is None:
+                results[name] = (False, None, 'check still running from a previous round')
+                continue
+            try:
+                ok, latency = future.result(timeout=max(0.0, deadline - time.monotonic()))
+                results[name] = (ok, latency, None if ok else 'check returned false')
+            except futures.TimeoutError:
+                results[name] = (False, None, f'no answer within {self._timeout}s')
+            except Exception as e:
+                results[name] = (False, None, str(e) or type(e).__name__)
+
+        with self._lock:
+            for name, (ok, latency, error) in results.items():
+                self._failures[name] = 0 if ok else self._failures[name] + 1
+                # At startup there is no history to smooth over
+                healthy = self._failures[name] < self._failure_threshold if self._probed else ok
+                if self._probed and healthy != self._status[name]['healthy']:
+                    log = logging.info if healthy else logging.warning
+                    log("Dependency %s is now %s", name, 'healthy' if healthy else 'unhealthy')
+                self._status[name] = {
+                    'healthy': healthy,
+                    'latency_ms': round(latency * 1000, 3) if latency is not None else None,
+                    'error': error,
+                }
+            self._probed = True
+            ready = not self._stopped.is_set() and all(
+                self._status[name]['healthy'] for name in self._critical
+            )
+            changed = ready != self._ready
+            self._ready = ready
+
+        if changed:
+            logging.log(logging.INFO if ready else logging.WARNING,
+                        "Replica is now %s", 'ready' if ready else 'not ready')
+        for listener in self._listeners:
+            listener(ready)
+
+    @staticmethod
+    def _timed(check):
+        start = time.perf_counter()
+        ok = check() is not False
+        return ok, time.perf_counter() - start
+
+
+def health_updater(servicer, service_names, loop=None):
+    """Returns a DependencyProber listener that publishes readiness to grpc_health.
+
+    Pass the event loop when servicer is the grpc.aio HealthServicer, whose
+    set() is a coroutine; the prober thread then schedules it on that loop.
+    """
+
+    def update(ready):
+        status = (health_pb2.HealthCheckResponse.SERVING if ready
+                  else health_pb2.HealthCheckResponse.NOT_SERVING)
+        for name in service_names:
+            if loop is None:
+                servicer.set(name, status)
+            else:
+                asyncio.run_coroutine_threadsafe(servicer.set(name, status), loop)
+
+    return update
@@ -0,0 +1,539 @@
+import logging
+import time
+import uuid
+
+import grpc
+
+from idempotency import fingerprint, response_bytes
+from log_setup import request_id_var
+from metrics import RPC_HANDLED, RPC_IN_FLIGHT, RPC_REJECTED, RPC_REPLAYED, RPC_SECONDS, RPC_STARTED
+
+_BEHAVIORS = {
+    (False, False): ('unary_unary', grpc.unary_unary_rpc_method_handler),
+    (False, True): ('unary_stream', grpc.unary_stream_rpc_method_handler),
+    (True, False): ('stream_unary', grpc.stream_unary_rpc_method_handler),
+    (True, True): ('stream_stream', grpc.stream_stream_rpc_method_handler),
+}
+
+
+def wrap_handler(handler, wrap, response_serializer=None):
+    """Returns a copy of an RpcMethodHandler with its behavior wrapped.
+
+    wrap(behavior, response_streaming) must return a callable with the same
+    (request_or_iterator, context) signature; for streaming responses it
+    must itself be a generator (async generator on the aio server).
+    response_serializer replaces the handler's own when given.
+    """
+    if handler is None:
+        return None
+    attr, factory = _BEHAVIORS[(handler.request_streaming, handler.response_streaming)]
+    return factory(
+        wrap(getattr(handler, attr), handler.response_streaming),
+        request_deserializer=handler.request_deserializer,
+        response_serializer=response_serializer or handler.response_serializer,
+    )
+
+
+def request_id_from(handler_call_details):
+    for key, value in handler_call_details.invocation_metadata or ():
+        if key == 'x-request-id':
+            return value
+    return uuid.uuid4().hex
+
+
+def client_id_from(handler_call_details, context):
+    # Callers behind the gateway send x-client-id; otherwise use the peer's address
+    for key, value in handler_call_details.invocation_metadata or ():
+        if key == 'x-client-id':
+            return value
+    peer = context.peer() or 'unknown'
+    return peer.rsplit(':', 1)[0] if peer.count(':') > 1 else peer
+
+
+def status_of(context, error=None):
+    code = context.code() if hasattr(context, 'code') else None
+    if code is None:
+        code = grpc.StatusCode.UNKNOWN if error is not None else grpc.StatusCode.OK
+    # The aio context reports codes as plain ints
+    return code.name if isinstance(code, grpc.StatusCode) else grpc.StatusCode(code).name
+
+
+def log_rpc(method, start, context, error=None):
+    status = status_of(context, error)
+    duration_ms = round((time.perf_counter() - start) * 1000, 3)
+    level = logging.INFO if status == 'OK' else logging.WARNING
+    logging.log(level, 'rpc %s finished with %s', method, status,
+                extra={'method': method, 'status': status, 'duration_ms': duration_ms})
+
+
+class RequestLoggingInterceptor(grpc.ServerInterceptor):
+    """Tags every log line of an RPC with its request id and logs its duration.
+
+    The request id is taken from the x-request-id metadata when the caller
+    (e.g. the gateway) sends one, otherwise a new one is generated.
+    """
+
+    def intercept_service(self, continuation, handler_call_details):
+        method = handler_call_details.method
+        request_id = request_id_from(handler_call_details)
+
+        def wrap(behavior, response_streaming):
+            if response_streaming:
+                def wrapped(request, context):
+                    token = request_id_var.set(request_id)
+                    start = time.perf_counter()
+                    error = None
+                    try:
+                        yield from behavior(request, context)
+                    except BaseException as e:
+                        error = e
+                        raise
+                    finally:
+                        log_rpc(method, start, context, error)
+                        request_id_var.reset(token)
+            else:
+                def wrapped(request, context):
+                    token = request_id_var.set(request_id)
+                    start = time.perf_counter()
+                    error = None
+                    try:
+                        return behavior(request, context)
+                    except BaseException as e:
+                        error = e
+                        raise
+                    finally:
+                        log_rpc(method, start, context, error)
+                        request_id_var.reset(token)
+            return wrapped
+
+        return wrap_handler(continuation(handler_call_details), wrap)
+
+
+class AsyncRequestLoggingInterceptor(grpc.aio.ServerInterceptor):
+    """RequestLoggingInterceptor for the grpc.aio server."""
+
+    async def intercept_service(self, continuation, handler_call_details):
+        method = handler_call_details.method
+        request_id = request_id_from(handler_call_details)
+
+        def wrap(behavior, response_streaming):
+            if response_streaming:
+                async def wrapped(request, context):
+                    request_id_var.set(request_id)
+                    start = time.perf_counter()
+                    error = None
+                    try:
+                        async for response in behavior(request, context):
+                            yield response
+                    except BaseException as e:
+                        error = e
+                        raise
+                    finally:
+                        log_rpc(method, start, context, error)
+            else:
+                async def wrapped(request, context):
+                    request_id_var.set(request_id)
+                    start = time.perf_counter()
+                    error = None
+                    try:
+                        return await behavior(request, context)
+                    except BaseException as e:
+                        error = e
+                        raise
+                    finally:
+                        log_rpc(method, start, context, error)
+            return wrapped
+
+        return wrap_handler(await continuation(handler_call_details), wrap)
+
+
+def _rpc_started(method):
+    RPC_STARTED.inc(method)
+    RPC_IN_FLIGHT.inc(method)
+    return time.perf_counter()
+
+
+def _rpc_finished(method, start, context, error=None):
+    RPC_SECONDS.observe(time.perf_counter() - start, method)
+    RPC_IN_FLIGHT.dec(method)
+    RPC_HANDLED.inc(method, status_of(context, error))
+
+
+class MetricsInterceptor(grpc.ServerInterceptor):
+    """Per-method request counts, status codes, in-flight gauge and latency."""
+
+    def intercept_service(self, continuation, handler_call_details):
+        method = handler_call_details.method
+
+        def wrap(behavior, response_streaming):
+            if response_streaming:
+                def wrapped(request, context):
+                    start = _rpc_started(method)
+                    error = None
+                    try:
+                        yield from behavior(request, context)
+                    except BaseException as e:
+                        error = e
+                        raise
+                    finally:
+                        _rpc_finished(method, start, context, error)
+            else:
+                def wrapped(request, context):
+                    start = _rpc_started(method)
+                    error = None
+                    try:
+                        return behavior(request, context)
+                    except BaseException as e:
+                        error = e
+                        raise
+                    finally:
+                        _rpc_finished(method, start, context, error)
+            return wrapped
+
+        return wrap_handler(continuation(handler_call_details), wrap)
+
+
+class AsyncMetricsInterceptor(grpc.aio.ServerInterceptor):
+    """MetricsInterceptor for the grpc.aio server."""
+
+    async def intercept_service(self, continuation, handler_call_details):
+        method = handler_call_details.method
+
+        def wrap(behavior, response_streaming):
+            if response_streaming:
+                async def wrapped(request, context):
+                    start = _rpc_started(method)
+                    error = None
+                    try:
+                        async for response in behavior(request, context):
+                            yield response
+                    except BaseException as e:
+                        error = e
+                        raise
+                    finally:
+                        _rpc_finished(method, start, context, error)
+            else:
+                async def wrapped(request, context):
+                    start = _rpc_started(method)
+                    error = None
+                    try:
+                        return await behavior(request, context)
+                    except BaseException as e:
+                        error = e
+                        raise
+                    finally:
+                        _rpc_finished(method, start, context, error)
+            return wrapped
+
+        return wrap_handler(await continuation(handler_call_details), wrap)
+
+
+HEALTH_SERVICE_PREFIX = '/grpc.health.v1.Health/'
+NOT_READY = 'Replica is not ready, retry on another one'
+
+
+def _reject_unready(behavior, response_streaming):
+    if response_streaming:
+        def rejected(request, context):
+            context.abort(grpc.StatusCode.UNAVAILABLE, NOT_READY)
+            yield
+    else:
+        def rejected(request, context):
+            context.abort(grpc.StatusCode.UNAVAILABLE, NOT_READY)
+    return rejected
+
+
+def _reject_unready_async(behavior, response_streaming):
+    if response_streaming:
+        async def rejected(request, context):
+            await context.abort(grpc.StatusCode.UNAVAILABLE, NOT_READY)
+            yield
+    else:
+        async def rejected(request, context):
+            await context.abort(grpc.StatusCode.UNAVAILABLE, NOT_READY)
+    return rejected
+
+
+class ReadinessInterceptor(grpc.ServerInterceptor):
+    """Fails RPCs fast with UNAVAILABLE while the replica is not ready.
+
+    Callers retry UNAVAILABLE, and a retry through the load balancer lands
+    on another replica instead of waiting on a dependency that is down.
+    Health checks are always let through.
+    """
+
+    def __init__(self, prober):
+        self._prober = prober
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if self._prober.ready or handler_call_details.method.startswith(HEALTH_SERVICE_PREFIX):
+            return handler
+        return wrap_handler(handler, _reject_unready)
+
+
+class AsyncReadinessInterceptor(grpc.aio.ServerInterceptor):
+    """ReadinessInterceptor for the grpc.aio server."""
+
+    def __init__(self, prober):
+        self._prober = prober
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if self._prober.ready or handler_call_details.method.startswith(HEALTH_SERVICE_PREFIX):
+            return handler
+        return wrap_handler(handler, _reject_unready_async)
+
+
+OVERLOADED = 'Server is at capacity for this method, retry later'
+
+
+def _rejected(method, reason, retry_after_ms=0):
+    RPC_REJECTED.inc(method, reason)
+    if reason == 'overloaded':
+        return OVERLOADED
+    return f'Rate limit exceeded, retry in {retry_after_ms}ms'
+
+
+class AdmissionInterceptor(grpc.ServerInterceptor):
+    """Sheds load and rate-limits before an RPC reaches its handler.
+
+    An RPC is rejected with RESOURCE_EXHAUSTED when its method already has
+    as many RPCs running as the ConcurrencyLimiter allows, or when the
+    caller's token bucket for the method is empty. Both checks fail fast,
+    so excess work gives its worker thread back at once instead of holding
+    it for the whole call.
+    """
+
+    def __init__(self, concurrency, rate_limiter=None):
+        self._concurrency = concurrency
+        self._rate_limiter = rate_limiter
+
+    def intercept_service(self, continuation, handler_call_details):
+        method = handler_call_details.method
+        if method.startswith(HEALTH_SERVICE_PREFIX):
+            return continuation(handler_call_details)
+        concurrency = self._concurrency
+        rate_limiter = self._rate_limiter
+
+        def admit(context):
+            if not concurrency.try_acquire(method):
+                context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, _rejected(method, 'overloaded'))
+            if rate_limiter is None:
+                return
+            try:
+                allowed, retry_after = rate_limiter.allow(
+                    client_id_from(handler_call_details, context), method)
+                if not allowed:
+                    context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED,
+                                  _rejected(method, 'rate_limited', retry_after))
+            except BaseException:
+                concurrency.release(method)
+                raise
+
+        def wrap(behavior, response_streaming):
+            if response_streaming:
+                def wrapped(request, context):
+                    admit(context)
+                    try:
+                        yield from behavior(request, context)
+                    finally:
+                        concurrency.release(method)
+            else:
+                def wrapped(request, context):
+                    admit(context)
+                    try:
+                        return behavior(request, context)
+                    finally:
+                        concurrency.release(method)
+            return wrapped
+
+        return wrap_handler(continuation(handler_call_details), wrap)
+
+
+class AsyncAdmissionInterceptor(grpc.aio.ServerInterceptor):
+    """AdmissionInterceptor for the grpc.aio server, with an AsyncRateLimiter."""
+
+    def __init__(self, concurrency, rate_limiter=None):
+        self._concurrency = concurrency
+        self._rate_limiter = rate_limiter
+
+    async def intercept_service(self, continuation, handler_call_details):
+        method = handler_call_details.method
+        concurrency = self._concurrency
+        rate_limiter = self._rate_limiter
+
+        async def admit(context):
+            if not concurrency.try_acquire(method):
+                await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, _rejected(method, 'overloaded'))
+            if rate_limiter is None:
+                return
+            try:
+                allowed, retry_after = await rate_limiter.allow(
+                    client_id_from(handler_call_details, context), method)
+                if not allowed:
+                    await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED,
+                                        _rejected(method, 'rate_limited', retry_after))
+            except BaseException:
+                concurrency.release(method)
+                raise
+
+        def wrap(behavior, response_streaming):
+            if response_streaming:
+                async def wrapped(request, context):
+                    await admit(context)
+                    try:
+                        async for response in behavior(request, context):
+                            yield response
+                    finally:
+                        concurrency.release(method)
+            else:
+                async def wrapped(request, context):
+                    await admit(context)
+                    try:
+                        return await behavior(request, context)
+                    finally:
+                        concurrency.release(method)
+            return wrapped
+
+        handler = await continuation(handler_call_details)
+        if method.startswith(HEALTH_SERVICE_PREFIX):
+            return handler
+        return wrap_handler(handler, wrap)
+
+
+IDEMPOTENCY_KEY = 'idempotency-key'
+IN_PROGRESS = 'A request with this idempotency key is still running, retry later'
+KEY_REUSED = 'This idempotency key was already used with a different request'
+
+
+def idempotency_key_from(handler_call_details):
+    for key, value in handler_call_details.invocation_metadata or ():
+        if key == IDEMPOTENCY_KEY:
+            return value
+    return None
+
+
+def _idempotent_handler(handler, method, key, methods):
+    # Only unary RPCs of the listed methods that carry a key are deduplicated
+    return (
+        key is not None and handler is not None
+        and method.rsplit('/', 1)[-1] in methods
+        and not handler.request_streaming and not handler.response_streaming
+    )
+
+
+def _passthrough_serializer(serializer):
+    # Replayed responses are stored already serialized
+    def serialize(response):
+        return response if isinstance(response, bytes) else serializer(response)
+    return serialize
+
+
+def _replayed(method, record, request_fingerprint):
+    # Returns (code, details, serialized response, or None to abort with code)
+    if record is None:
+        RPC_REJECTED.inc(method, 'idempotency_in_progress')
+        return grpc.StatusCode.ABORTED, IN_PROGRESS, None
+    if record['fingerprint'] != request_fingerprint:
+        RPC_REJECTED.inc(method, 'idempotency_key_reused')
+        return grpc.StatusCode.INVALID_ARGUMENT, KEY_REUSED, None
+    RPC_REPLAYED.inc(method)
+    return grpc.StatusCode[record['code']], record['details'], response_bytes(record)
+
+
+def _outcome(context, error, response):
+    details = context.details() or ''
+    # The threaded server's context hands details back encoded
+    if isinstance(details, bytes):
+        details = details.decode('utf-8', 'replace')
+    return status_of(context, error), details, None if response is None else response.SerializeToString()
+
+
+class IdempotencyInterceptor(grpc.ServerInterceptor):
+    """Answers retries of an RPC with the outcome of its first attempt.
+
+    Applies to the unary methods in methods (e.g. 'RegisterUser') when the
+    caller sends idempotency-key metadata and keeps it the same on every
+    attempt. A retry that reaches any replica, e.g. after nginx or the
+    gateway gave up on a slow first attempt, gets the stored response or
+    error from the IdempotencyCache instead of repeating the write.
+    """
+
+    def __init__(self, cache, methods):
+        self._cache = cache
+        self._methods = frozenset(methods)
+
+    def intercept_service(self, continuation, handler_call_details):
+        method = handler_call_details.method
+        key = idempotency_key_from(handler_call_details)
+        handler = continuation(handler_call_details)
+        if not _idempotent_handler(handler, method, key, self._methods):
+            return handler
+        cache = self._cache
+
+        def wrap(behavior, response_streaming):
+            def wrapped(request, context):
+                request_fingerprint = fingerprint(request)
+                owner, record = cache.begin(method, key)
+                if owner is None:
+                    code, details, response = _replayed(method, record, request_fingerprint)
+                    if response is None:
+                        context.abort(code, details)
+                    if code != grpc.StatusCode.OK:
+                        context.set_code(code)
+                        context.set_details(details)
+                    return response
+                response = error = None
+                try:
+                    response = behavior(request, context)
+                    return response
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    cache.finish(method, key, owner, request_fingerprint, *_outcome(context, error, response))
+            return wrapped
+
+        return wrap_handler(handler, wrap, _passthrough_serializer(handler.response_serializer))
+
+
+class AsyncIdempotencyInterceptor(grpc.aio.ServerInterceptor):
+    """IdempotencyInterceptor for the grpc.aio server, with an AsyncIdempotencyCache."""
+
+    def __init__(self, cache, methods):
+        self._cache = cache
+        self._methods = frozenset(methods)
+
+    async def intercept_service(self, continuation, handler_call_details):
+        method = handler_call_details.method
+        key = idempotency_key_from(handler_call_details)
+        handler = await continuation(handler_call_details)
+        if not _idempotent_handler(handler, method, key, self._methods):
+            return handler
+        cache = self._cache
+
+        def wrap(behavior, response_streaming):
+            async def wrapped(request, context):
+                request_fingerprint = fingerprint(request)
+                owner, record = await cache.begin(method, key)
+                if owner is None:
+                    code, details, response = _replayed(method, record, request_fingerprint)
+                    if response is None:
+                        await context.abort(code, details)
+                    if code != grpc.StatusCode.OK:
+                        context.set_code(code)
+                        context.set_details(details)
+                    return response
+                response = error = None
+                try:
+                    response = await behavior(request, context)
+                    return response
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    await cache.finish(method, key, owner, request_fingerprint, *_outcome(context, error, response))
+            return wrapped
+
+        return wrap_handler(handler, wrap, _passthrough_serializer(handler.response_serializer))
@@ -0,0 +1,204 @@
+import logging
+from datetime import timedelta
+
+import grpc
+import redis
+
+from metrics import timed
+from rollups import bucket_start
+
+# Workout volume rankings as Redis sorted sets of user_id -> total in a window:
+#   leaderboard:global:{metric}:{period}:{start}
+#   leaderboard:goal:{goal}:{metric}:{period}:{start}     users sharing a goal
+#   leaderboard:session:{sid}:{metric}:{period}:{start}   a group session's participants
+# metric is duration (seconds) or sessions, period is day, week or month and
+# start the window's first day, as for rollups. A session counts towards the
+# windows of its start time. Every key expires retention seconds after its
+# window closes, so boards do not pile up and past windows stay readable
+# for a while.
+METRICS = ('duration', 'sessions')
+PERIODS = ('day', 'week', 'month')
+SCOPES = ('global', 'goal', 'session')
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+KEY_PREFIX = 'leaderboard:'
+
+
+def bucket_end(period, start):
+    if period == 'day':
+        return start + timedelta(days=1)
+    if period == 'week':
+        return start + timedelta(days=7)
+    return (start + timedelta(days=32)).replace(day=1)
+
+
+def goal_name(goal):
+    # Goals are free text; users share a goal board whatever their case and spacing
+    return ' '.join((goal or '').lower().split())
+
+
+def scope_name(scope, goal_type='', session_id=''):
+    # The scope part of a key, or None when the scope is unknown or lacks its argument
+    if scope == 'global':
+        return 'global'
+    if scope == 'goal' and goal_name(goal_type):
+        return f'goal:{goal_name(goal_type)}'
+    if scope == 'session' and session_id:
+        return f'session:{session_id}'
+    return None
+
+
+def board_key(scope, metric, period, start):
+    return f'{KEY_PREFIX}{scope}:{metric}:{period}:{start:%Y-%m-%d}'
+
+
+def increments(session, user_ids, goals, retention):
+    """Pipeline commands adding an ended session to its users' boards.
+
+    Returns (commands, totals): commands are (method, *args) tuples with the
+    EXPIREATs last, and totals maps the index of each global ZINCRBY, whose
+    reply is the user's new total, to (user_id, metric, period, start).
+    """
+    amounts = {'duration': float(session['duration']), 'sessions': 1}
+    commands, totals, expiry = [], {}, {}
+    for period in PERIODS:
+        start = bucket_start(period, session['start_time'])
+        expires = int(bucket_end(period, start).timestamp()) + retention
+        for metric, amount in amounts.items():
+            for user_id in user_ids:
+                scopes = ['global']
+                if goal_name(goals.get(user_id)):
+                    scopes.append(f'goal:{goal_name(goals[user_id])}')
+                for scope in scopes:
+                    key = board_key(scope, metric, period, start)
+                    if scope == 'global':
+                        totals[len(commands)] = (user_id, metric, period, start)
+                    commands.append(('zincrby', key, amount, user_id))
+                    expiry[key] = expires
+    commands.extend(('expireat', key, expires) for key, expires in expiry.items())
+    return commands, totals
+
+
+def session_board(session_id, totals, replies, retention):
+    # ZADDs ranking a group session's participants by their totals as the session ended
+    scores, expiry = {}, {}
+    for index, (user_id, metric, period, start) in totals.items():
+        key = board_key(f'session:{session_id}', metric, period, start)
+        scores.setdefault(key, {})[user_id] = float(replies[index])
+        expiry[key] = int(bucket_end(period, start).timestamp()) + retention
+    return [('zadd', key, members) for key, members in scores.items()] + [
+        ('expireat', key, expires) for key, expires in expiry.items()
+    ]
+
+
+def read_commands(key, offset, limit, user_id):
+    commands = [('zrevrange', key, offset, offset + limit - 1, True), ('zcard', key)]
+    if user_id:
+        commands += [('zrevrank', key, user_id), ('zscore', key, user_id)]
+    return commands
+
+
+def board(start, offset, replies, user_id):
+    entries, total = replies[0], replies[1]
+    # user_rank is 0 for users not on the board
+    user_rank, user_score = 0, 0.0
+    if user_id and replies[2] is not None:
+        user_rank, user_score = replies[2] + 1, float(replies[3])
+    return {
+        'period_start': start.date().isoformat(),
+        'total': total,
+        'entries': [
+            {'rank': offset + i + 1, 'user_id': member.decode(), 'score': score}
+            for i, (member, score) in enumerate(entries)
+        ],
+        'user_rank': user_rank,
+        'user_score': user_score,
+    }
+
+
+class Leaderboards:
+    """Global, per-goal and per-group-session leaderboards in Redis sorted sets.
+
+    Ending a session adds it to its users' global and goal boards with
+    ZINCRBY in one pipeline; a group session's board then gets each
+    participant's new global total, ranking the group by the window as it
+    stood when the session ended. goal_lookup maps a list of user ids to
+    {user_id: goal or None}; if it fails, only the goal boards miss out.
+
+    A page is one ZREVRANGE and a user's rank one ZREVRANK, O(log N) in the
+    board's size plus the page, read together in one round trip.
+    """
+
+    def __init__(self, redis_client, goal_lookup, retention=8 * 86400):
+        self._redis = redis_client
+        self._goal_lookup = goal_lookup
+        self._retention = retention
+
+    def _pipeline(self, commands):
+        pipe = self._redis.pipeline(transaction=False)
+        for method, *args in commands:
+            getattr(pipe, method)(*args)
+        return pipe
+
+    def _goals(self, user_ids):
+        try:
+            return self._goal_lookup(user_ids)
+        except (grpc.RpcError, LookupError) as e:
+            logging.warning("Goal lookup failed, leaving goal leaderboards out: %s", e)
+            return {}
+
+    def record(self, session, user_ids):
+        # Failures are logged: the session has ended either way
+        self._update(session, user_ids, self._goals(user_ids))
+
+    @timed('redis', 'update_leaderboards')
+    def _update(self, session, user_ids, goals):
+        commands, totals = increments(session, user_ids, goals, self._retention)
+        try:
+            replies = self._pipeline(commands).execute()
+            if session.get('group'):
+                self._pipeline(session_board(session['_id'], totals, replies, self._retention)).execute()
+        except redis.RedisError as e:
+            logging.error("Failed to update leaderboards for session %s: %s", session['_id'], e)
+
+    @timed('redis', 'get_leaderboard')
+    def get(self, scope, metric, period, when, offset=0, limit=0, user_id=''):
+        start = bucket_start(period, when)
+        limit = min(limit or DEFAULT_LIMIT, MAX_LIMIT)
+        replies = self._pipeline(
+            read_commands(board_key(scope, metric, period, start), offset, limit, user_id)
+        ).execute()
+        return board(start, offset, replies, user_id)
+
+
+class AsyncLeaderboards(Leaderboards):
+    """Leaderboards on a redis.asyncio client; goal_lookup is awaited."""
+
+    async def _goals(self, user_ids):
+        try:
+            return await self._goal_lookup(user_ids)
+        except (grpc.RpcError, LookupError) as e:
+            logging.warning("Goal lookup failed, leaving goal leaderboards out: %s", e)
+            return {}
+
+    async def record(self, session, user_ids):
+        await self._update(session, user_ids, await self._goals(user_ids))
+
+    @timed('redis', 'update_leaderboards')
+    async def _update(self, session, user_ids, goals):
+        commands, totals = increments(session, user_ids, goals, self._retention)
+        try:
+            replies = await self._pipeline(commands).execute()
+            if session.get('group'):
+                await self._pipeline(session_board(session['_id'], totals, replies, self._retention)).execute()
+        except redis.RedisError as e:
+            logging.error("Failed to update leaderboards for session %s: %s", session['_id'], e)
+
+    @timed('redis', 'get_leaderboard')
+    async def get(self, scope, metric, period, when, offset=0, limit=0, user_id=''):
+        start = bucket_start(period, when)
+        limit = min(limit or DEFAULT_LIMIT, MAX_LIMIT)
+        replies = await self._pipeline(
+            read_commands(board_key(scope, metric, period, start), offset, limit, user_id)
+        ).execute()
+        return board(start, offset, replies, user_id)
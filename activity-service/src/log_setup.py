@@ -0,0 +1,92 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+from datetime import datetime, timezone
+
+# Set by the request logging interceptor for the duration of each RPC
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+# Attributes every LogRecord has; anything else was passed via extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, so filebeat can ship it without re-parsing."""
+
+    def __init__(self, service):
+        super().__init__()
+        self._service = service
+
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc)
+            .isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+            'level': record.levelname,
+            'service': self._service,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    # Keeps a fraction of INFO-and-below records; warnings and errors always pass
+    def __init__(self, rate):
+        super().__init__()
+        self._rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.INFO or self._rate >= 1 or random.random() < self._rate
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks or formats on the calling thread.
+
+    Records go onto a bounded queue as-is (message formatting and JSON
+    encoding happen on the listener thread); when the queue is full the
+    record is dropped and counted instead of stalling the RPC.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        request_id = request_id_var.get()
+        if request_id is not None and not hasattr(record, 'request_id'):
+            record.request_id = request_id
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Approximate under contention, which is fine for a drop counter
+            self.dropped += 1
+
+
+def setup_logging(service, filename, level=logging.INFO, queue_size=10000, info_sample_rate=1.0):
+    file_handler = logging.FileHandler(filename)
+    file_handler.setFormatter(JsonFormatter(service))
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(info_sample_rate))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.handlers[:] = [queue_handler]
+
+    listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return queue_handler
@@ -0,0 +1,185 @@
+import bisect
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+# Per-thread sharded metrics rendered in the Prometheus text format.
+#
+# Every thread updates its own shard (a plain dict only that thread writes),
+# so recording a sample never takes a lock; a scrape sums all shards. The
+# only locked step is registering a shard the first time a thread records.
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+REGISTRY = []
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _snapshots(self):
+        with self._shards_lock:
+            shards = list(self._shards)
+        # dict() copies under the GIL, so a shard is never read mid-resize
+        return [dict(shard) for shard in shards]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _samples(self):
+        totals = {}
+        for shard in self._snapshots():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        for labels, value in sorted(totals.items()):
+            yield f'{self.name}{_format_labels(self.labelnames, labels)} {value}'
+
+
+class Gauge(Counter):
+    """Additive gauge (inc/dec), or a callback read at scrape time.
+
+    function, when given, returns {label_values_tuple: value}.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self._function = function
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def _samples(self):
+        if self._function is None:
+            yield from super()._samples()
+            return
+        for labels, value in sorted(self._function().items()):
+            yield f'{self.name}{_format_labels(self.labelnames, labels)} {value}'
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        shard = self._shard()
+        entry = shard.get(labels)
+        if entry is None:
+            # per-bucket counts (last slot is +Inf), sum
+            entry = shard[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def _samples(self):
+        totals = {}
+        for shard in self._snapshots():
+            for labels, (counts, total) in shard.items():
+                merged = totals.setdefault(labels, [[0] * (len(self.buckets) + 1), 0.0])
+                for i, count in enumerate(counts):
+                    merged[0][i] += count
+                merged[1] += total
+        for labels, (counts, total) in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, labels, [("le", le)])} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, labels)} {total}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}'
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+RPC_STARTED = Counter(
+    'grpc_server_started_total', 'RPCs started on the server.', ['grpc_method'])
+RPC_HANDLED = Counter(
+    'grpc_server_handled_total', 'RPCs completed on the server, by status code.',
+    ['grpc_method', 'grpc_code'])
+RPC_IN_FLIGHT = Gauge(
+    'grpc_server_in_flight', 'RPCs currently being handled.', ['grpc_method'])
+RPC_SECONDS = Histogram(
+    'grpc_server_handling_seconds', 'Time to handle an RPC, including streaming responses.',
+    ['grpc_method'])
+RPC_REJECTED = Counter(
+    'grpc_server_rejected_total', 'RPCs rejected before running, by reason.',
+    ['grpc_method', 'reason'])
+RPC_REPLAYED = Counter(
+    'grpc_server_idempotent_replays_total', 'Retried RPCs answered with the outcome of their first attempt.',
+    ['grpc_method'])
+DEPENDENCY_SECONDS = Histogram(
+    'dependency_call_seconds', 'Latency of calls to databases, Redis and other services.',
+    ['dependency', 'operation'])
+
+
+def timed(dependency, operation):
+    """Decorator recording a function's latency in DEPENDENCY_SECONDS."""
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with DEPENDENCY_SECONDS.time(dependency, operation):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with DEPENDENCY_SECONDS.time(dependency, operation):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    return decorator
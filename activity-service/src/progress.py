@@ -0,0 +1,181 @@
+import json
+import logging
+import re
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+import redis
+
+from rollups import bucket_start, type_field
+
+# Goals are the free-text goal users register with. Those of the form
+#   <target> <unit> [of <workout_type>] per|a|each|every|/ <day|week|month>
+# e.g. "150 minutes per week", "3 sessions of yoga a week", "1h/day", are
+# measured against the current bucket of the matching rollup; anything else
+# is reported as not recognized.
+GOAL_PATTERN = re.compile(
+    r'^\s*(?P<target>\d+(?:\.\d+)?)\s*(?P<unit>[a-z]+)\s*'
+    r'(?:of\s+(?P<workout_type>[\w-]+)\s*)?'
+    r'(?:(?:per|a|each|every)\s+|/\s*)(?P<period>day|week|month)\s*$',
+    re.IGNORECASE,
+)
+# unit -> (rollup metric, multiplier to the metric's unit)
+UNITS = {
+    'minute': ('duration', 60), 'min': ('duration', 60), 'm': ('duration', 60),
+    'hour': ('duration', 3600), 'hr': ('duration', 3600), 'h': ('duration', 3600),
+    'session': ('sessions', 1), 'workout': ('sessions', 1),
+}
+KEY_PREFIX = 'progress:'
+
+Goal = namedtuple('Goal', 'metric target period workout_type')
+
+
+def parse_goal(text):
+    # Returns a Goal, or None if the text is not a measurable goal
+    match = GOAL_PATTERN.match(text or '')
+    if match is None:
+        return None
+    unit = match['unit'].lower()
+    metric = UNITS.get(unit) or UNITS.get(unit.removesuffix('s'))
+    if metric is None:
+        return None
+    metric, multiplier = metric
+    return Goal(metric, float(match['target']) * multiplier, match['period'].lower(), match['workout_type'])
+
+
+def evaluate(user_id, goal_text, rollups, now):
+    """Progress of one user towards their goal.
+
+    goal_text is None for unknown users; rollups maps (user_id, period) to
+    the current bucket's rollup, with no entry for buckets without sessions.
+    """
+    progress = {
+        'user_id': user_id, 'found': goal_text is not None, 'goal': goal_text or '',
+        'recognized': False, 'period': '', 'metric': '', 'period_start': '',
+        'target': 0.0, 'achieved': 0.0, 'percent': 0.0,
+    }
+    goal = parse_goal(goal_text)
+    if goal is None:
+        return progress
+    totals = rollups.get((user_id, goal.period), {})
+    if goal.workout_type:
+        totals = totals.get('types', {}).get(type_field(goal.workout_type), {})
+    achieved = float(totals.get(goal.metric, 0))
+    progress.update(
+        recognized=True, period=goal.period, metric=goal.metric,
+        period_start=bucket_start(goal.period, now).date().isoformat(),
+        target=goal.target, achieved=achieved,
+        percent=round(100 * achieved / goal.target, 1) if goal.target else 100.0,
+    )
+    return progress
+
+
+def rank(progresses):
+    # Best progress first; users without a measurable goal go last
+    return sorted(progresses, key=lambda p: (not p['recognized'], -p['percent'], p['user_id']))
+
+
+def progress_key(user_id):
+    return KEY_PREFIX + user_id
+
+
+class GoalProgress:
+    """Goal progress per user, cached in Redis and invalidated on new sessions.
+
+    goal_lookup maps a list of user ids to {user_id: goal or None}. Progress
+    for many users (e.g. everyone in a group session) is computed together:
+    one MGET for the cached entries, then for the rest one batched goal
+    lookup, one rollup query and one pipelined write back, however many
+    users there are. Entries expire after ttl seconds and at the next UTC
+    midnight, when the current buckets roll over.
+
+    The cache is best effort: without Redis, progress is computed each time.
+    """
+
+    def __init__(self, redis_client, rollup_store, goal_lookup, ttl=60):
+        self._redis = redis_client
+        self._rollup_store = rollup_store
+        self._goal_lookup = goal_lookup
+        self._ttl = ttl
+
+    def get(self, user_id):
+        return self.get_many([user_id])[0]
+
+    def get_many(self, user_ids):
+        user_ids = list(dict.fromkeys(user_ids))
+        results = self._cached(user_ids, self._mget(user_ids))
+        missing = [user_id for user_id in user_ids if user_id not in results]
+        if missing:
+            now = datetime.now(timezone.utc)
+            computed = self._evaluate(missing, self._goal_lookup(missing),
+                                      self._rollup_store.current(missing, now), now)
+            try:
+                self._store(computed, now).execute()
+            except redis.RedisError as e:
+                logging.warning("Failed to cache goal progress: %s", e)
+            results.update(computed)
+        return [results[user_id] for user_id in user_ids]
+
+    def invalidate(self, user_ids):
+        try:
+            self._redis.delete(*map(progress_key, user_ids))
+        except redis.RedisError as e:
+            logging.warning("Failed to invalidate goal progress: %s", e)
+
+    def _mget(self, user_ids):
+        try:
+            return self._redis.mget(list(map(progress_key, user_ids)))
+        except redis.RedisError as e:
+            logging.warning("Goal progress cache unavailable: %s", e)
+            return [None] * len(user_ids)
+
+    @staticmethod
+    def _cached(user_ids, values):
+        return {user_id: json.loads(value) for user_id, value in zip(user_ids, values) if value is not None}
+
+    @staticmethod
+    def _evaluate(user_ids, goals, rollups, now):
+        return {user_id: evaluate(user_id, goals.get(user_id), rollups, now) for user_id in user_ids}
+
+    def _store(self, computed, now):
+        midnight = bucket_start('day', now) + timedelta(days=1)
+        ttl = max(1, min(self._ttl, int((midnight - now).total_seconds())))
+        pipe = self._redis.pipeline(transaction=False)
+        for user_id, progress in computed.items():
+            pipe.set(progress_key(user_id), json.dumps(progress), ex=ttl)
+        return pipe
+
+
+class AsyncGoalProgress(GoalProgress):
+    """GoalProgress on a redis.asyncio client and AsyncRollupStore; goal_lookup is awaited."""
+
+    async def get(self, user_id):
+        return (await self.get_many([user_id]))[0]
+
+    async def get_many(self, user_ids):
+        user_ids = list(dict.fromkeys(user_ids))
+        results = self._cached(user_ids, await self._mget(user_ids))
+        missing = [user_id for user_id in user_ids if user_id not in results]
+        if missing:
+            now = datetime.now(timezone.utc)
+            computed = self._evaluate(missing, await self._goal_lookup(missing),
+                                      await self._rollup_store.current(missing, now), now)
+            try:
+                await self._store(computed, now).execute()
+            except redis.RedisError as e:
+                logging.warning("Failed to cache goal progress: %s", e)
+            results.update(computed)
+        return [results[user_id] for user_id in user_ids]
+
+    async def invalidate(self, user_ids):
+        try:
+            await self._redis.delete(*map(progress_key, user_ids))
+        except redis.RedisError as e:
+            logging.warning("Failed to invalidate goal progress: %s", e)
+
+    async def _mget(self, user_ids):
+        try:
+            return await self._redis.mget(list(map(progress_key, user_ids)))
+        except redis.RedisError as e:
+            logging.warning("Goal progress cache unavailable: %s", e)
+            return [None] * len(user_ids)
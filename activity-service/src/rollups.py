@@ -0,0 +1,181 @@
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING, DESCENDING, IndexModel, UpdateOne
+
+from metrics import timed
+from write_buffer import update
+
+# Per-user workout totals, one document per (user, period, bucket):
+#   {_id: 'u1:week:2026-10-12', user_id, period, start,
+#    sessions, duration, types: {<workout_type>: {sessions, duration}}}
+# Buckets are UTC days, ISO weeks starting Monday, calendar months, and a
+# single lifetime 'total' bucket. A session counts towards the buckets of
+# its start time.
+PERIODS = ('day', 'week', 'month', 'total')
+DEFAULT_LIMITS = {'day': 30, 'week': 12, 'month': 12, 'total': 1}
+MAX_LIMIT = 366
+DEFAULT_WORKOUT_TYPE = 'other'
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def bucket_start(period, when):
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    day = when.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == 'day':
+        return day
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    return EPOCH
+
+
+def rollup_id(user_id, period, start):
+    return f'{user_id}:{period}:{start:%Y-%m-%d}'
+
+
+def current_ids(user_ids, now):
+    # _id of every user's current bucket in each period, mapped to (user_id, period)
+    return {
+        rollup_id(user_id, period, bucket_start(period, now)): (user_id, period)
+        for user_id in user_ids
+        for period in PERIODS
+    }
+
+
+def type_field(workout_type):
+    # Workout types become field names, which may not contain '.' or start with '$'
+    return (workout_type or DEFAULT_WORKOUT_TYPE).replace('.', '_').lstrip('$') or DEFAULT_WORKOUT_TYPE
+
+
+def rollup_changes(user_ids, workout_type, start_time, duration):
+    # (filter, update) of the upsert adding the session to each of its buckets
+    field = type_field(workout_type)
+    changes = []
+    for user_id in user_ids:
+        for period in PERIODS:
+            start = bucket_start(period, start_time)
+            changes.append((
+                {'_id': rollup_id(user_id, period, start)},
+                {
+                    '$setOnInsert': {'user_id': user_id, 'period': period, 'start': start},
+                    '$inc': {
+                        'sessions': 1,
+                        'duration': duration,
+                        f'types.{field}.sessions': 1,
+                        f'types.{field}.duration': duration,
+                    },
+                },
+            ))
+    return changes
+
+
+def rollup_updates(user_ids, workout_type, start_time, duration):
+    return [
+        UpdateOne(query, change, upsert=True)
+        for query, change in rollup_changes(user_ids, workout_type, start_time, duration)
+    ]
+
+
+def buffered_updates(user_ids, workout_type, start_time, duration):
+    return [
+        update(query, change, upsert=True)
+        for query, change in rollup_changes(user_ids, workout_type, start_time, duration)
+    ]
+
+
+def stats_query(user_id, period, limit):
+    return {'user_id': user_id, 'period': period}, min(limit or DEFAULT_LIMITS[period], MAX_LIMIT)
+
+
+class RollupStore:
+    """Daily, weekly, monthly and lifetime workout totals per user.
+
+    Ending a session adds it to each of its buckets with $inc upserts in one
+    unordered bulk write, so stats are read from a handful of precomputed
+    documents instead of aggregating every session a user ever logged.
+    Buckets without sessions have no document.
+
+    With a WriteBuffer the upserts are queued and flushed together with
+    other sessions'; reads first wait for queued upserts of their users.
+    """
+
+    INDEXES = [
+        IndexModel(
+            [('user_id', ASCENDING), ('period', ASCENDING), ('start', DESCENDING)],
+            name='user_period_start',
+        ),
+    ]
+
+    def __init__(self, collection, buffer=None):
+        self._collection = collection
+        self._buffer = buffer
+
+    def ensure_indexes(self):
+        self._collection.create_indexes(self.INDEXES)
+
+    def _flushed(self, user_ids):
+        if self._buffer is not None:
+            self._buffer.wait_flushed(self._collection.name, user_ids)
+
+    @timed('mongo', 'record_rollup')
+    def record(self, user_ids, workout_type, start_time, duration):
+        if self._buffer is not None:
+            self._buffer.write(
+                self._collection.name, buffered_updates(user_ids, workout_type, start_time, duration), keys=user_ids
+            )
+            return
+        self._collection.bulk_write(
+            rollup_updates(user_ids, workout_type, start_time, duration), ordered=False
+        )
+
+    @timed('mongo', 'get_rollups')
+    def stats(self, user_id, period, limit=0):
+        # Most recent buckets first
+        self._flushed([user_id])
+        query, limit = stats_query(user_id, period, limit)
+        return list(self._collection.find(query).sort('start', DESCENDING).limit(limit))
+
+    @timed('mongo', 'current_rollups')
+    def current(self, user_ids, now):
+        # Returns {(user_id, period): rollup} for the buckets containing now, in one query
+        self._flushed(user_ids)
+        ids = current_ids(user_ids, now)
+        return {ids[rollup['_id']]: rollup for rollup in self._collection.find({'_id': {'$in': list(ids)}})}
+
+
+class AsyncRollupStore(RollupStore):
+    """RollupStore on a pymongo AsyncMongoClient collection."""
+
+    async def ensure_indexes(self):
+        await self._collection.create_indexes(self.INDEXES)
+
+    async def _flushed(self, user_ids):
+        if self._buffer is not None:
+            await self._buffer.wait_flushed(self._collection.name, user_ids)
+
+    @timed('mongo', 'record_rollup')
+    async def record(self, user_ids, workout_type, start_time, duration):
+        if self._buffer is not None:
+            await self._buffer.write(
+                self._collection.name, buffered_updates(user_ids, workout_type, start_time, duration), keys=user_ids
+            )
+            return
+        await self._collection.bulk_write(
+            rollup_updates(user_ids, workout_type, start_time, duration), ordered=False
+        )
+
+    @timed('mongo', 'get_rollups')
+    async def stats(self, user_id, period, limit=0):
+        await self._flushed([user_id])
+        query, limit = stats_query(user_id, period, limit)
+        cursor = self._collection.find(query).sort('start', DESCENDING).limit(limit)
+        return await cursor.to_list(None)
+
+    @timed('mongo', 'current_rollups')
+    async def current(self, user_ids, now):
+        await self._flushed(user_ids)
+        ids = current_ids(user_ids, now)
+        rollups = await self._collection.find({'_id': {'$in': list(ids)}}).to_list(None)
+        return {ids[rollup['_id']]: rollup for rollup in rollups}
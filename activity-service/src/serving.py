@@ -0,0 +1,50 @@
+import asyncio
+import logging
+import signal
+import threading
+
+from cheroot import wsgi
+
+SHUTDOWN_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+
+class HttpServer:
+    """Serves the Flask app (status, readiness, metrics) with cheroot.
+
+    cheroot is a production WSGI server with a fixed worker pool and a
+    thread-safe stop(), which lets shutdown close it after the gRPC server
+    has drained instead of killing a Werkzeug development server thread.
+    """
+
+    def __init__(self, app, port, threads=4, host='0.0.0.0', shutdown_timeout=2, reuse_port=False):
+        self._server = wsgi.Server(
+            (host, port), app, numthreads=threads, shutdown_timeout=shutdown_timeout,
+            reuse_port=reuse_port
+        )
+        self._thread = threading.Thread(target=self._server.serve, name='http-server', daemon=True)
+
+    def start(self):
+        # prepare() binds the socket, so a port conflict fails here rather than in the thread
+        self._server.prepare()
+        self._thread.start()
+        logging.info('Serving HTTP on port %s', self._server.bind_addr[1])
+
+    def stop(self):
+        self._server.stop()
+        self._thread.join()
+
+
+def wait_for_shutdown():
+    # Blocks the main thread until SIGTERM or SIGINT
+    stopping = threading.Event()
+    for sig in SHUTDOWN_SIGNALS:
+        signal.signal(sig, lambda signum, frame: stopping.set())
+    stopping.wait()
+
+
+async def wait_for_shutdown_async():
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    for sig in SHUTDOWN_SIGNALS:
+        loop.add_signal_handler(sig, stopping.set)
+    await stopping.wait()
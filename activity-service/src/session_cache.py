@@ -0,0 +1,360 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import redis
+from bson import ObjectId
+
+from metrics import Counter, timed
+from sessions import session_document
+
+# Session state for the RPCs that only need to know whether a session
+# exists, who started it and whether it is still open, in two tiers:
+#   local  per-process LRU of CachedSession objects, bounded and short-lived
+#   redis  hash session-cache:<session_id>, shared by every replica
+# Entries carry the session's version: 1 once started, 2 once ended, the
+# only change a session document goes through. The Redis entry only ever
+# moves to a newer version, so a slow reader cannot put back an open
+# session that another replica has just ended, and every end is published
+# on session-cache-invalidations for replicas to drop their older copy.
+KEY_PREFIX = 'session-cache:'
+CHANNEL = 'session-cache-invalidations'
+
+LOOKUPS = Counter('session_cache_lookups_total', 'Session lookups by the tier that answered them.', ['tier'])
+
+# Replaces the entry only with a newer version; returns the version stored
+PUT_SCRIPT = '''
+local current = tonumber(redis.call('HGET', KEYS[1], 'version') or '0')
+local version = tonumber(ARGV[1])
+if current >= version then
+    return current
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], 'version', version, unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return version
+'''
+
+
+def cache_key(session_id):
+    return KEY_PREFIX + session_id
+
+
+def session_version(document):
+    return 2 if document.get('end_time') else 1
+
+
+def _timestamp(value):
+    if value is None:
+        return ''
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return repr(value.timestamp())
+
+
+def _datetime(value):
+    return datetime.fromtimestamp(float(value), timezone.utc) if value else None
+
+
+class CachedSession:
+    """The fields of a session document the cache keeps."""
+
+    __slots__ = ('session_id', 'user_id', 'group', 'open', 'workout_type',
+                 'start_time', 'end_time', 'version', 'expires')
+
+    def __init__(self, session_id, user_id, group, open, workout_type, start_time, end_time, version):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.group = group
+        self.open = open
+        self.workout_type = workout_type
+        self.start_time = start_time
+        self.end_time = end_time
+        self.version = version
+        self.expires = 0.0
+
+    @classmethod
+    def from_document(cls, document):
+        return cls(
+            str(document['_id']), document['user_id'], bool(document.get('group')),
+            bool(document.get('open')), document.get('workout_type', ''),
+            document['start_time'], document.get('end_time'), session_version(document),
+        )
+
+    @classmethod
+    def from_fields(cls, session_id, fields):
+        # fields is the Redis hash, with bytes keys and values
+        fields = {key.decode(): value.decode() for key, value in fields.items()}
+        return cls(
+            session_id, fields['user_id'], fields['group'] == '1', fields['open'] == '1',
+            fields['workout_type'], _datetime(fields['start_time']), _datetime(fields['end_time']),
+            int(fields['version']),
+        )
+
+    def document(self):
+        # The session's start document, for SessionStore.end to insert if MongoDB lacks it
+        start_time = self.start_time
+        if start_time.tzinfo is None:
+            start_time = start_time.replace(tzinfo=timezone.utc)
+        return session_document(ObjectId(self.session_id), self.user_id, start_time, self.group, self.workout_type)
+
+    def fields(self):
+        # Flattened field/value pairs for PUT_SCRIPT, version excluded
+        return [
+            'user_id', self.user_id, 'group', int(self.group), 'open', int(self.open),
+            'workout_type', self.workout_type, 'start_time', _timestamp(self.start_time),
+            'end_time', _timestamp(self.end_time),
+        ]
+
+
+class LocalCache:
+    """Bounded LRU of CachedSession, each dropped ttl seconds after it was added."""
+
+    def __init__(self, maxsize, ttl):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if session.expires < time.monotonic():
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def put(self, session):
+        session.expires = time.monotonic() + self._ttl
+        with self._lock:
+            current = self._sessions.get(session.session_id)
+            if current is not None and current.version > session.version:
+                return
+            self._sessions[session.session_id] = session
+            self._sessions.move_to_end(session.session_id)
+            while len(self._sessions) > self._maxsize:
+                self._sessions.popitem(last=False)
+
+    def invalidate(self, session_id, version):
+        # Drops the entry if it is older than version
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and session.version < version:
+                del self._sessions[session_id]
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+
+class SessionCache:
+    """Two-tier cache of session state in front of SessionStore.
+
+    A lookup is answered by the local LRU, then Redis, then MongoDB, and
+    fills the tiers it missed. put() is called with the document a start or
+    an end just wrote. Other replicas then find a new session in Redis
+    before its buffered insert reaches MongoDB, and EndWorkoutSession passes
+    the cached start to SessionStore.end so such a session can be ended
+    there. They learn of an end through pub/sub. Invalidations sent while
+    the subscription is down are lost, so the local tier is cleared on every
+    (re)subscribe and its entries expire after local_ttl seconds regardless.
+
+    Without Redis, lookups fall through to MongoDB and only the local tier
+    is filled.
+    """
+
+    def __init__(self, redis_client, session_store, maxsize=10000, local_ttl=30, ttl=3600):
+        self._redis = redis_client
+        self._store = session_store
+        self._local = LocalCache(maxsize, local_ttl)
+        self._ttl = ttl
+        self._put = redis_client.register_script(PUT_SCRIPT)
+        self._stopped = threading.Event()
+
+    def get(self, session_id):
+        # Returns a CachedSession, or None for unknown sessions
+        session = self.peek(session_id)
+        if session is not None:
+            return session
+        LOOKUPS.inc('mongo')
+        document = self._store.get(session_id)
+        if document is None:
+            return None
+        session = CachedSession.from_document(document)
+        self._fill(session)
+        return session
+
+    def peek(self, session_id):
+        # get without falling back to MongoDB
+        session = self._local.get(session_id)
+        if session is not None:
+            LOOKUPS.inc('local')
+            return session
+        try:
+            fields = self._get_remote(session_id)
+        except redis.RedisError as e:
+            logging.warning("Session cache unavailable: %s", e)
+            return None
+        if not fields:
+            return None
+        LOOKUPS.inc('redis')
+        session = CachedSession.from_fields(session_id, fields)
+        self._local.put(session)
+        return session
+
+    def put(self, document):
+        # Caches the session a start or an end just wrote
+        session = CachedSession.from_document(document)
+        self._fill(session)
+        if session.version > 1:
+            self._publish(session)
+        return session
+
+    @timed('redis', 'get_cached_session')
+    def _get_remote(self, session_id):
+        return self._redis.hgetall(cache_key(session_id))
+
+    def _fill(self, session):
+        try:
+            stored = self._put_remote(session)
+        except redis.RedisError as e:
+            logging.warning("Failed to cache session %s: %s", session.session_id, e)
+            stored = session.version
+        # A newer version in Redis means this copy is already stale
+        if stored == session.version:
+            self._local.put(session)
+
+    @timed('redis', 'cache_session')
+    def _put_remote(self, session):
+        return int(self._put(
+            keys=[cache_key(session.session_id)], args=[session.version, self._ttl, *session.fields()]
+        ))
+
+    def _publish(self, session):
+        try:
+            self._redis.publish(CHANNEL, f'{session.session_id} {session.version}')
+        except redis.RedisError as e:
+            logging.warning("Failed to publish invalidation of session %s: %s", session.session_id, e)
+
+    def start(self):
+        threading.Thread(target=self._run, name='session-cache', daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _invalidate(self, message):
+        if message is None or message['type'] != 'message':
+            return
+        try:
+            session_id, version = message['data'].decode().rsplit(' ', 1)
+            version = int(version)
+        except ValueError as e:
+            logging.error("Skipping malformed session cache invalidation %r: %s", message['data'], e)
+            return
+        self._local.invalidate(session_id, version)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            pubsub = self._redis.pubsub()
+            try:
+                pubsub.subscribe(CHANNEL)
+                self._local.clear()
+                while not self._stopped.is_set():
+                    self._invalidate(pubsub.get_message(timeout=1.0))
+            except redis.RedisError as e:
+                logging.warning("Session cache invalidations lost, resubscribing: %s", e)
+                self._stopped.wait(1.0)
+            finally:
+                pubsub.close()
+
+
+class AsyncSessionCache(SessionCache):
+    """SessionCache on a redis.asyncio client and AsyncSessionStore, listening in a task."""
+
+    async def get(self, session_id):
+        session = await self.peek(session_id)
+        if session is not None:
+            return session
+        LOOKUPS.inc('mongo')
+        document = await self._store.get(session_id)
+        if document is None:
+            return None
+        session = CachedSession.from_document(document)
+        await self._fill(session)
+        return session
+
+    async def peek(self, session_id):
+        session = self._local.get(session_id)
+        if session is not None:
+            LOOKUPS.inc('local')
+            return session
+        try:
+            fields = await self._get_remote(session_id)
+        except redis.RedisError as e:
+            logging.warning("Session cache unavailable: %s", e)
+            return None
+        if not fields:
+            return None
+        LOOKUPS.inc('redis')
+        session = CachedSession.from_fields(session_id, fields)
+        self._local.put(session)
+        return session
+
+    async def put(self, document):
+        session = CachedSession.from_document(document)
+        await self._fill(session)
+        if session.version > 1:
+            await self._publish(session)
+        return session
+
+    @timed('redis', 'get_cached_session')
+    async def _get_remote(self, session_id):
+        return await self._redis.hgetall(cache_key(session_id))
+
+    async def _fill(self, session):
+        try:
+            stored = await self._put_remote(session)
+        except redis.RedisError as e:
+            logging.warning("Failed to cache session %s: %s", session.session_id, e)
+            stored = session.version
+        if stored == session.version:
+            self._local.put(session)
+
+    @timed('redis', 'cache_session')
+    async def _put_remote(self, session):
+        return int(await self._put(
+            keys=[cache_key(session.session_id)], args=[session.version, self._ttl, *session.fields()]
+        ))
+
+    async def _publish(self, session):
+        try:
+            await self._redis.publish(CHANNEL, f'{session.session_id} {session.version}')
+        except redis.RedisError as e:
+            logging.warning("Failed to publish invalidation of session %s: %s", session.session_id, e)
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        super().stop()
+        self._task.cancel()
+
+    async def _run(self):
+        while not self._stopped.is_set():
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(CHANNEL)
+                self._local.clear()
+                while not self._stopped.is_set():
+                    self._invalidate(await pubsub.get_message(timeout=1.0))
+            except redis.RedisError as e:
+                logging.warning("Session cache invalidations lost, resubscribing: %s", e)
+                await asyncio.sleep(1.0)
+            finally:
+                await pubsub.aclose()
@@ -0,0 +1,361 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+import redis
+
+from metrics import timed
+
+# Group-session events are published on Redis pub/sub so subscribers on any
+# replica see them:
+#   session-events:<session_id>   channel, one JSON event per message
+#   session:{<session_id>}:members  set of user ids in the session
+# Each replica holds a single pattern subscription and fans events out to
+# its local SubscribeSession streams.
+CHANNEL_PREFIX = 'session-events:'
+CHANNEL_PATTERN = CHANNEL_PREFIX + '*'
+
+
+def members_key(session_id):
+    return f'session:{{{session_id}}}:members'
+
+
+class SessionEvents:
+    """Publishes join/leave/vote events and coalesced tally updates.
+
+    Every vote is published as a voted event, but not with the new tally:
+    the first vote in a session schedules one tally for tally_interval
+    later, and every vote until then rides along with it. A burst of votes
+    thus costs one voted message per vote but only one tally per interval.
+    Scheduled tallies are published by a single thread, run by start().
+    """
+
+    def __init__(self, redis_client, vote_tally, ttl=86400, tally_interval=0.25):
+        self._redis = redis_client
+        self._vote_tally = vote_tally
+        self._ttl = ttl
+        self._tally_interval = tally_interval
+        self._pending_tallies = set()
+        # (due time, session_id) in due order, the interval being fixed
+        self._due = deque()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._stopped = False
+
+    @timed('redis', 'join_session')
+    def join(self, session_id, user_id):
+        key = members_key(session_id)
+        pipe = self._redis.pipeline()
+        pipe.sadd(key, user_id)
+        pipe.expire(key, self._ttl)
+        pipe.scard(key)
+        _, _, participants = pipe.execute()
+        self.publish(session_id, 'joined', user_id=user_id, participants=participants)
+        return participants
+
+    @timed('redis', 'leave_session')
+    def leave(self, session_id, user_id):
+        pipe = self._redis.pipeline()
+        pipe.srem(members_key(session_id), user_id)
+        pipe.scard(members_key(session_id))
+        _, participants = pipe.execute()
+        self.publish(session_id, 'left', user_id=user_id, participants=participants)
+        return participants
+
+    @timed('redis', 'session_members')
+    def members(self, session_id):
+        return [member.decode() for member in self._redis.smembers(members_key(session_id))]
+
+    def voted(self, session_id, user_id, workout_type):
+        self.publish(session_id, 'voted', user_id=user_id, workout_type=workout_type)
+        with self._changed:
+            if session_id in self._pending_tallies:
+                return
+            self._pending_tallies.add(session_id)
+            self._due.append((time.monotonic() + self._tally_interval, session_id))
+            self._changed.notify()
+
+    def start(self):
+        threading.Thread(target=self._run, name='session-tallies', daemon=True).start()
+
+    def stop(self):
+        # Tallies still scheduled are dropped; subscribers get the next one
+        with self._changed:
+            self._stopped = True
+            self._changed.notify()
+
+    def _run(self):
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: self._due or self._stopped)
+                if self._stopped:
+                    return
+                due, session_id = self._due[0]
+                if due > time.monotonic():
+                    self._changed.wait(due - time.monotonic())
+                    continue
+                self._due.popleft()
+                self._pending_tallies.discard(session_id)
+            try:
+                self._publish_tally(session_id)
+            except Exception:
+                logging.exception("Failed to publish tally for session %s", session_id)
+
+    def publish(self, session_id, event_type, **fields):
+        event = dict(fields, type=event_type, session_id=session_id, at=time.time())
+        try:
+            self._redis.publish(CHANNEL_PREFIX + session_id, json.dumps(event))
+        except redis.RedisError as e:
+            # Events are best effort; the vote or membership change itself is stored
+            logging.warning("Failed to publish %s event for session %s: %s", event_type, session_id, e)
+
+    def _publish_tally(self, session_id):
+        try:
+            leader = self._vote_tally.leader(session_id)
+        except redis.RedisError as e:
+            logging.warning("Failed to read tally for session %s: %s", session_id, e)
+            return
+        if leader is not None:
+            self.publish(session_id, 'tally', **tally_fields(leader))
+
+
+def is_event(event):
+    # Subscriptions rely on both fields; anything else on the channels is skipped
+    return (isinstance(event, dict) and isinstance(event.get('type'), str)
+            and isinstance(event.get('session_id'), str))
+
+
+def tally_fields(leader):
+    workout_type, votes, duration = leader
+    return {'workout_type': workout_type, 'votes': votes, 'duration': duration}
+
+
+class AsyncSessionEvents(SessionEvents):
+    """SessionEvents on a redis.asyncio client; tallies are scheduled on the loop."""
+
+    @timed('redis', 'join_session')
+    async def join(self, session_id, user_id):
+        key = members_key(session_id)
+        pipe = self._redis.pipeline()
+        pipe.sadd(key, user_id)
+        pipe.expire(key, self._ttl)
+        pipe.scard(key)
+        _, _, participants = await pipe.execute()
+        await self.publish(session_id, 'joined', user_id=user_id, participants=participants)
+        return participants
+
+    @timed('redis', 'leave_session')
+    async def leave(self, session_id, user_id):
+        pipe = self._redis.pipeline()
+        pipe.srem(members_key(session_id), user_id)
+        pipe.scard(members_key(session_id))
+        _, participants = await pipe.execute()
+        await self.publish(session_id, 'left', user_id=user_id, participants=participants)
+        return participants
+
+    @timed('redis', 'session_members')
+    async def members(self, session_id):
+        return [member.decode() for member in await self._redis.smembers(members_key(session_id))]
+
+    async def voted(self, session_id, user_id, workout_type):
+        await self.publish(session_id, 'voted', user_id=user_id, workout_type=workout_type)
+        if session_id in self._pending_tallies:
+            return
+        self._pending_tallies.add(session_id)
+        asyncio.get_running_loop().call_later(
+            self._tally_interval, lambda: asyncio.ensure_future(self._publish_tally(session_id))
+        )
+
+    async def publish(self, session_id, event_type, **fields):
+        event = dict(fields, type=event_type, session_id=session_id, at=time.time())
+        try:
+            await self._redis.publish(CHANNEL_PREFIX + session_id, json.dumps(event))
+        except redis.RedisError as e:
+            logging.warning("Failed to publish %s event for session %s: %s", event_type, session_id, e)
+
+    async def _publish_tally(self, session_id):
+        self._pending_tallies.discard(session_id)
+        try:
+            leader = await self._vote_tally.leader(session_id)
+        except redis.RedisError as e:
+            logging.warning("Failed to read tally for session %s: %s", session_id, e)
+            return
+        if leader is not None:
+            await self.publish(session_id, 'tally', **tally_fields(leader))
+
+
+class Subscription:
+    """Events waiting to be streamed to one subscriber.
+
+    A tally that has not been sent yet is replaced by a newer one, so a
+    slow subscriber gets the latest state instead of a backlog. Other
+    events are kept in order, up to max_pending (oldest dropped first).
+    """
+
+    def __init__(self, session_id, max_pending=1000):
+        self.session_id = session_id
+        self.dropped = 0
+        self._max_pending = max_pending
+        self._events = deque()
+        self._tally = None
+        self._ready = threading.Condition()
+        self.closed = False
+
+    def _add(self, event):
+        if event['type'] == 'tally':
+            self._tally = event
+            return
+        if len(self._events) >= self._max_pending:
+            self._events.popleft()
+            self.dropped += 1
+        self._events.append(event)
+
+    def _take(self):
+        events = list(self._events)
+        self._events.clear()
+        if self._tally is not None:
+            events.append(self._tally)
+            self._tally = None
+        return events
+
+    def push(self, event):
+        with self._ready:
+            self._add(event)
+            self._ready.notify()
+
+    def get(self, timeout):
+        # Returns every pending event, or [] after timeout
+        with self._ready:
+            self._ready.wait_for(lambda: self._events or self._tally or self.closed, timeout)
+            return self._take()
+
+    def close(self):
+        with self._ready:
+            self.closed = True
+            self._ready.notify()
+
+
+class AsyncSubscription(Subscription):
+    def __init__(self, session_id, max_pending=1000):
+        super().__init__(session_id, max_pending)
+        self._ready = asyncio.Event()
+
+    def push(self, event):
+        # Called on the event loop by AsyncEventHub
+        self._add(event)
+        self._ready.set()
+
+    async def get(self, timeout):
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._ready.clear()
+        return self._take()
+
+    def close(self):
+        self.closed = True
+        self._ready.set()
+
+
+class EventHub:
+    """Fans session events from one Redis pattern subscription to local subscribers."""
+
+    subscription_class = Subscription
+
+    def __init__(self, redis_client, max_pending=1000):
+        self._redis = redis_client
+        self._max_pending = max_pending
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def subscribe(self, session_id):
+        subscription = self.subscription_class(session_id, self._max_pending)
+        with self._lock:
+            self._subscribers.setdefault(session_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscription.close()
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.session_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.session_id]
+
+    def start(self):
+        threading.Thread(target=self._run, name='session-events', daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        with self._lock:
+            subscriptions = [s for subs in self._subscribers.values() for s in subs]
+        for subscription in subscriptions:
+            subscription.close()
+
+    def _dispatch(self, message):
+        if message is None or message['type'] != 'pmessage':
+            return
+        try:
+            event = json.loads(message['data'])
+        except ValueError as e:
+            logging.error("Skipping malformed session event on %s: %s", message['channel'], e)
+            return
+        if not is_event(event):
+            logging.error("Skipping malformed session event on %s: %r", message['channel'], event)
+            return
+        with self._lock:
+            subscribers = list(self._subscribers.get(event['session_id'], ()))
+        for subscription in subscribers:
+            subscription.push(event)
+
+    def _dispatch_safely(self, message):
+        # One bad message must not end the subscription every stream relies on
+        try:
+            self._dispatch(message)
+        except Exception:
+            logging.exception("Failed to dispatch session event")
+
+    def _run(self):
+        while not self._stopped.is_set():
+            pubsub = self._redis.pubsub()
+            try:
+                pubsub.psubscribe(CHANNEL_PATTERN)
+                while not self._stopped.is_set():
+                    self._dispatch_safely(pubsub.get_message(timeout=1.0))
+            except redis.RedisError as e:
+                logging.warning("Session event subscription lost, reconnecting: %s", e)
+                self._stopped.wait(1.0)
+            finally:
+                pubsub.close()
+
+
+class AsyncEventHub(EventHub):
+    """EventHub on a redis.asyncio client, reading in a task on the loop."""
+
+    subscription_class = AsyncSubscription
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        super().stop()
+        self._task.cancel()
+
+    async def _run(self):
+        while not self._stopped.is_set():
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.psubscribe(CHANNEL_PATTERN)
+                while not self._stopped.is_set():
+                    self._dispatch_safely(await pubsub.get_message(timeout=1.0))
+            except redis.RedisError as e:
+                logging.warning("Session event subscription lost, reconnecting: %s", e)
+                await asyncio.sleep(1.0)
+            finally:
+                await pubsub.aclose()
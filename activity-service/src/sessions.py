@@ -0,0 +1,230 @@
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from metrics import timed
+from write_buffer import NotFlushed, insert
+
+
+def utcnow():
+    # Mongo stores millisecond precision, so truncate up front to keep the
+    # value we return identical to the one persisted
+    now = datetime.now(timezone.utc)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def isoformat(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def new_session(user_id, group=False, workout_type=''):
+    return session_document(ObjectId(), user_id, utcnow(), group, workout_type)
+
+
+def session_document(object_id, user_id, start_time, group=False, workout_type=''):
+    session = {
+        '_id': object_id,
+        'user_id': user_id,
+        'start_time': start_time,
+        'open': True,
+    }
+    if workout_type:
+        session['workout_type'] = workout_type
+    if group:
+        session['group'] = True
+        session['participants'] = [user_id]
+    return session
+
+
+def end_update(now):
+    # Pipeline update computes the duration server-side in one round trip
+    return [
+        {'$set': {
+            'end_time': now,
+            'duration': {'$divide': [{'$subtract': [now, '$start_time']}, 1000]},
+        }},
+        {'$unset': 'open'},
+    ]
+
+
+def ended_session(started, now):
+    # The document end_update leaves, built from a start MongoDB has not seen
+    session = {key: value for key, value in started.items() if key != 'open'}
+    session['end_time'] = now
+    session['duration'] = (now - started['start_time']).total_seconds()
+    return session
+
+
+def parse_session_id(session_id):
+    # Returns None for ids that could not have been issued by SessionStore
+    try:
+        return ObjectId(session_id)
+    except (InvalidId, TypeError):
+        return None
+
+
+class SessionStore:
+    """Workout sessions persisted in MongoDB.
+
+    Session ids are ObjectIds generated in-process (timestamp, per-process
+    random value and counter), so starting a session is a single insert with
+    no lookup. Open sessions carry ``open: True`` which is unset on end; the
+    partial index on it only ever holds sessions in progress, so it stays
+    small however large the collection grows.
+
+    With a WriteBuffer, starts are queued and inserted in bulk; reads first
+    wait for queued starts of the session or user they look up. A start
+    queued on another replica cannot be waited for, so end() takes the
+    start document when the caller knows it and inserts the session already
+    ended; the queued insert is then skipped as a duplicate.
+    """
+
+    INDEXES = [
+        IndexModel([('user_id', ASCENDING), ('start_time', DESCENDING)], name='user_start_time'),
+        IndexModel(
+            [('user_id', ASCENDING)],
+            name='open_sessions',
+            partialFilterExpression={'open': True},
+        ),
+    ]
+
+    def __init__(self, collection, buffer=None):
+        self._collection = collection
+        self._buffer = buffer
+
+    def ensure_indexes(self):
+        self._collection.create_indexes(self.INDEXES)
+
+    def _flushed(self, *keys):
+        # Returns False if queued writes with the keys are still not in MongoDB
+        return self._buffer is None or self._buffer.wait_flushed(self._collection.name, keys)
+
+    @timed('mongo', 'start_session')
+    def start(self, user_id, group=False, workout_type=''):
+        session = new_session(user_id, group, workout_type)
+        if self._buffer is None:
+            self._collection.insert_one(session)
+        else:
+            self._buffer.write(self._collection.name, [insert(session)], keys=(session['_id'], user_id))
+        return session
+
+    @timed('mongo', 'end_session')
+    def end(self, session_id, started=None):
+        """Returns the ended session, or None if it does not exist or already ended.
+
+        started is the session's start document, if known. Raises NotFlushed
+        when the session's queued start could not be flushed and started is
+        not given, as the session may well exist.
+        """
+        object_id = parse_session_id(session_id)
+        if object_id is None:
+            return None
+        if not self._flushed(object_id) and started is None:
+            raise NotFlushed(f'Session {session_id} is not in MongoDB yet')
+        session = self._end(object_id)
+        if session is not None or started is None:
+            return session
+        session = ended_session(started, utcnow())
+        try:
+            self._collection.insert_one(session)
+        except DuplicateKeyError:
+            # The start reached MongoDB meanwhile, or the session already ended
+            return self._end(object_id)
+        return session
+
+    def _end(self, object_id):
+        return self._collection.find_one_and_update(
+            {'_id': object_id, 'open': True},
+            end_update(utcnow()),
+            return_document=ReturnDocument.AFTER,
+        )
+
+    @timed('mongo', 'get_session')
+    def get(self, session_id):
+        object_id = parse_session_id(session_id)
+        if object_id is None:
+            return None
+        self._flushed(object_id)
+        return self._collection.find_one({'_id': object_id})
+
+    @timed('mongo', 'open_sessions')
+    def open_sessions(self, user_id):
+        self._flushed(user_id)
+        return list(self._collection.find(
+            {'user_id': user_id, 'open': True}
+        ).hint('open_sessions'))
+
+    @timed('mongo', 'recent')
+    def recent(self, user_id, limit=20):
+        self._flushed(user_id)
+        return list(self._collection.find(
+            {'user_id': user_id}
+        ).sort('start_time', DESCENDING).limit(limit))
+
+
+class AsyncSessionStore(SessionStore):
+    """SessionStore on a pymongo AsyncMongoClient collection."""
+
+    async def ensure_indexes(self):
+        await self._collection.create_indexes(self.INDEXES)
+
+    async def _flushed(self, *keys):
+        return self._buffer is None or await self._buffer.wait_flushed(self._collection.name, keys)
+
+    @timed('mongo', 'start_session')
+    async def start(self, user_id, group=False, workout_type=''):
+        session = new_session(user_id, group, workout_type)
+        if self._buffer is None:
+            await self._collection.insert_one(session)
+        else:
+            await self._buffer.write(self._collection.name, [insert(session)], keys=(session['_id'], user_id))
+        return session
+
+    @timed('mongo', 'end_session')
+    async def end(self, session_id, started=None):
+        object_id = parse_session_id(session_id)
+        if object_id is None:
+            return None
+        if not await self._flushed(object_id) and started is None:
+            raise NotFlushed(f'Session {session_id} is not in MongoDB yet')
+        session = await self._end(object_id)
+        if session is not None or started is None:
+            return session
+        session = ended_session(started, utcnow())
+        try:
+            await self._collection.insert_one(session)
+        except DuplicateKeyError:
+            return await self._end(object_id)
+        return session
+
+    async def _end(self, object_id):
+        return await self._collection.find_one_and_update(
+            {'_id': object_id, 'open': True},
+            end_update(utcnow()),
+            return_document=ReturnDocument.AFTER,
+        )
+
+    @timed('mongo', 'get_session')
+    async def get(self, session_id):
+        object_id = parse_session_id(session_id)
+        if object_id is None:
+            return None
+        await self._flushed(object_id)
+        return await self._collection.find_one({'_id': object_id})
+
+    @timed('mongo', 'open_sessions')
+    async def open_sessions(self, user_id):
+        await self._flushed(user_id)
+        cursor = self._collection.find({'user_id': user_id, 'open': True}).hint('open_sessions')
+        return await cursor.to_list(None)
+
+    @timed('mongo', 'recent')
+    async def recent(self, user_id, limit=20):
+        await self._flushed(user_id)
+        cursor = self._collection.find({'user_id': user_id}).sort('start_time', DESCENDING).limit(limit)
+        return await cursor.to_list(None)
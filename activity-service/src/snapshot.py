@@ -0,0 +1,115 @@
+"""Exports workout sessions to a Parquet or NDJSON file, and loads one back.
+
+    python src/snapshot.py export sessions.parquet [--mongo mongodb://mongo:27017/]
+    python src/snapshot.py import sessions.ndjson.gz [--mongo ...]
+
+Export walks activity_db.sessions in _id order a chunk at a time; it can
+run against a serving database, but every chunk is read at a different
+moment. Import inserts a chunk per unordered insert_many, keeping session
+ids, and skips sessions that already exist, so an interrupted import can
+simply be run again. Into an empty collection the secondary indexes are
+built once at the end instead of document by document; stop the service
+while importing. Rollups are not part of the file.
+"""
+import argparse
+import logging
+import os
+import time
+
+from bson import ObjectId
+from pymongo import ASCENDING, MongoClient
+from pymongo.errors import BulkWriteError
+
+from datafiles import open_reader, open_writer
+from sessions import SessionStore
+
+FIELDS = [
+    ('_id', 'str'), ('user_id', 'str'), ('start_time', 'time'), ('end_time', 'time'),
+    ('duration', 'float'), ('open', 'bool'), ('workout_type', 'str'), ('group', 'bool'),
+    ('participants', 'strs'),
+]
+DEFAULT_CHUNK = 50000
+DUPLICATE_KEY = 11000
+
+
+def session_row(session):
+    return (str(session['_id']),) + tuple(session.get(name) for name, _ in FIELDS[1:])
+
+
+def session_document(row):
+    # Fields a session does not have are left out rather than stored as null
+    document = {name: value for (name, _), value in zip(FIELDS, row) if value is not None}
+    document['_id'] = ObjectId(document['_id'])
+    return document
+
+
+def export_sessions(collection, writer, chunk_size):
+    exported, query = 0, {}
+    while True:
+        sessions = list(collection.find(query).sort('_id', ASCENDING).limit(chunk_size))
+        if not sessions:
+            return exported
+        writer.write([session_row(session) for session in sessions])
+        exported += len(sessions)
+        query = {'_id': {'$gt': sessions[-1]['_id']}}
+        logging.info("Exported sessions up to %s", sessions[-1]['_id'])
+
+
+def import_sessions(collection, reader):
+    # Returns how many sessions were inserted
+    imported = 0
+    for rows in reader:
+        try:
+            imported += len(collection.insert_many([session_document(row) for row in rows], ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            refused = [error for error in e.details['writeErrors'] if error['code'] != DUPLICATE_KEY]
+            if refused:
+                raise
+            imported += e.details['nInserted']
+        logging.info("Imported %s sessions", imported)
+    return imported
+
+
+def defer_indexes(collection):
+    # Drops the secondary indexes of an empty collection, for SessionStore.ensure_indexes to build
+    if collection.find_one({}, {'_id': 1}) is not None:
+        return False
+    collection.drop_indexes()
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['export', 'import'])
+    parser.add_argument('path', help='.parquet, .ndjson or .ndjson.gz file')
+    parser.add_argument('--mongo', default=f'mongodb://{os.environ.get("MONGO_HOST", "localhost")}:27017/')
+    parser.add_argument('--chunk', type=int, default=DEFAULT_CHUNK, help='sessions per chunk and insert_many')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    client = MongoClient(args.mongo)
+    collection = client['activity_db']['sessions']
+    started = time.perf_counter()
+    try:
+        if args.command == 'export':
+            with open_writer(args.path, FIELDS) as writer:
+                count = export_sessions(collection, writer, args.chunk)
+        else:
+            deferred = defer_indexes(collection)
+            try:
+                with open_reader(args.path, FIELDS, args.chunk) as reader:
+                    count = import_sessions(collection, reader)
+            finally:
+                index_started = time.perf_counter()
+                SessionStore(collection).ensure_indexes()
+                if deferred:
+                    logging.info("Built session indexes in %.1fs", time.perf_counter() - index_started)
+    finally:
+        client.close()
+    elapsed = time.perf_counter() - started
+    print(f'{args.command}ed {count} sessions in {elapsed:.1f}s, {count / elapsed:.0f} sessions/s, '
+          f'file {os.path.getsize(args.path) / 2 ** 20:.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+import json
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError
+
+import grpc
+
+import user_service_pb2
+import user_service_pb2_grpc
+
+from metrics import DEPENDENCY_SECONDS
+
+MISSING = object()
+# Identifies these calls to user-service's rate limiter
+CLIENT_METADATA = (('x-client-id', 'activity-service'),)
+
+
+class TTLCache:
+    """Bounded LRU with a per-entry expiry, safe to share between threads."""
+
+    def __init__(self, maxsize, ttl):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self._ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+def service_config(retries):
+    # gRPC's built-in retries: transient UNAVAILABLE (e.g. a replica behind
+    # nginx restarting) is retried with exponential backoff on the lookups
+    return json.dumps({
+        'methodConfig': [{
+            'name': [
+                {'service': 'user_service.UserService', 'method': 'GetUserGoal'},
+                {'service': 'user_service.UserService', 'method': 'GetUserGoals'},
+            ],
+            'retryPolicy': {
+                'maxAttempts': min(retries + 1, 5),
+                'initialBackoff': '0.05s',
+                'maxBackoff': '1s',
+                'backoffMultiplier': 2,
+                'retryableStatusCodes': ['UNAVAILABLE'],
+            },
+        }],
+    })
+
+
+class UserServiceClient:
+    """Goal lookups against user-service for the activity RPCs.
+
+    A lookup is answered from a local LRU+TTL cache when possible. Otherwise
+    it joins the in-flight lookup for the same user if there is one, or is
+    queued for the batcher thread, which sends everything queued within
+    batch_wait as a single GetUserGoals call with a deadline.
+    """
+
+    def __init__(self, target, timeout=0.5, retries=3, cache_size=10000,
+                 cache_ttl=60, negative_ttl=10, batch_size=100, batch_wait=0.002):
+        self._channel = grpc.insecure_channel(target, options=[
+            ('grpc.keepalive_time_ms', 30000),
+            ('grpc.keepalive_timeout_ms', 10000),
+            ('grpc.keepalive_permit_without_calls', 1),
+            ('grpc.http2.max_pings_without_data', 0),
+            ('grpc.enable_retries', 1),
+            ('grpc.service_config', service_config(retries)),
+        ])
+        self.stub = user_service_pb2_grpc.UserServiceStub(self._channel)
+        self._timeout = timeout
+        self._cache = TTLCache(cache_size, cache_ttl)
+        self._negative_ttl = negative_ttl
+        self._batch_size = batch_size
+        self._batch_wait = batch_wait
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='user-goal-batcher', daemon=True)
+        self._thread.start()
+
+    def lookup(self, user_id):
+        # Returns a Future resolving to the goal, or None for unknown users
+        cached = self._cache.get(user_id)
+        if cached is not MISSING:
+            future = Future()
+            future.set_result(cached)
+            return future
+        with self._pending_lock:
+            future = self._pending.get(user_id)
+            if future is not None:
+                return future
+            future = self._pending[user_id] = Future()
+        self._queue.put(user_id)
+        return future
+
+    def get_goal(self, user_id):
+        return self._result(user_id, self.lookup(user_id))
+
+    def get_goals(self, user_ids):
+        futures = {user_id: self.lookup(user_id) for user_id in user_ids}
+        return {user_id: self._result(user_id, future) for user_id, future in futures.items()}
+
+    def _result(self, user_id, future):
+        # A lookup may wait for the batch in flight before its own is sent
+        try:
+            return future.result(2 * self._timeout + self._batch_wait)
+        except TimeoutError:
+            raise LookupError(f'Goal lookup for user {user_id} timed out') from None
+
+    def invalidate(self, user_id):
+        self._cache.invalidate(user_id)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._channel.close()
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self._batch_wait
+        while len(batch) < self._batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                user_id = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if user_id is None:
+                self._queue.put(None)
+                break
+            batch.append(user_id)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self._fetch(batch)
+            except Exception as e:
+                # The batcher serves every lookup, so it must outlive any one batch
+                logging.exception("Goal lookup batch failed")
+                self._resolve(batch, {}, LookupError(f'Goal lookup failed: {e}'))
+
+    def _fetch(self, user_ids):
+        results = {}
+        error = None
+        try:
+            request = user_service_pb2.GoalsRequest(user_ids=user_ids)
+            with DEPENDENCY_SECONDS.time('user_service', 'get_user_goals'):
+                replies = list(self.stub.GetUserGoals(
+                    request, timeout=self._timeout, metadata=CLIENT_METADATA
+                ))
+            for goal in replies:
+                if goal.found:
+                    results[goal.user_id] = goal.goal_type
+                    self._cache.set(goal.user_id, goal.goal_type)
+                else:
+                    results[goal.user_id] = None
+                    self._cache.set(goal.user_id, None, ttl=self._negative_ttl)
+        except grpc.RpcError as e:
+            error = e
+        except Exception as e:
+            # Callers handle failed lookups as grpc.RpcError or LookupError
+            logging.exception("Goal lookup for %s users failed", len(user_ids))
+            error = LookupError(f'Goal lookup failed: {e}')
+        self._resolve(user_ids, results, error)
+
+    def _resolve(self, user_ids, results, error):
+        with self._pending_lock:
+            futures = [(user_id, self._pending.pop(user_id, None)) for user_id in user_ids]
+        for user_id, future in futures:
+            if future is None or future.done():
+                continue
+            if user_id in results:
+                future.set_result(results[user_id])
+            else:
+                future.set_exception(error or LookupError(f'No goal returned for user {user_id}'))
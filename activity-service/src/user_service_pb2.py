@@ -24,7 +24,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x12user_service.proto\x12\x0cuser_service\"N\n\x0bUserRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\r\n\x05\x65mail\x18\x02 \x01(\t\x12\x10\n\x08password\x18\x03 \x01(\t\x12\x0c\n\x04goal\x18\x04 \x01(\t\"@\n\x0cUserResponse\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x10\n\x08username\x18\x02 \x01(\t\x12\r\n\x05\x65mail\x18\x03 \x01(\t\"\x1e\n\x0bGoalRequest\x12\x0f\n\x07user_id\x18\x01 \x01(\t\"!\n\x0cGoalResponse\x12\x11\n\tgoal_type\x18\x01 \x01(\t2\x9a\x01\n\x0bUserService\x12\x45\n\x0cRegisterUser\x12\x19.user_service.UserRequest\x1a\x1a.user_service.UserResponse\x12\x44\n\x0bGetUserGoal\x12\x19.user_service.GoalRequest\x1a\x1a.user_service.GoalResponseb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x12user_service.proto\x12\x0cuser_service\"N\n\x0bUserRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\r\n\x05\x65mail\x18\x02 \x01(\t\x12\x10\n\x08password\x18\x03 \x01(\t\x12\x0c\n\x04goal\x18\x04 \x01(\t\"@\n\x0cUserResponse\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x10\n\x08username\x18\x02 \x01(\t\x12\r\n\x05\x65mail\x18\x03 \x01(\t\"\x1e\n\x0bGoalRequest\x12\x0f\n\x07user_id\x18\x01 \x01(\t\"!\n\x0cGoalResponse\x12\x11\n\tgoal_type\x18\x01 \x01(\t\"`\n\x0eRegisterResult\x12\r\n\x05index\x18\x01 \x01(\x05\x12\x0f\n\x07user_id\x18\x02 \x01(\t\x12\x10\n\x08username\x18\x03 \x01(\t\x12\r\n\x05\x65mail\x18\x04 \x01(\t\x12\r\n\x05\x65rror\x18\x05 \x01(\t\"F\n\x15\x42\x61tchRegisterResponse\x12-\n\x07results\x18\x01 \x03(\x0b\x32\x1c.user_service.RegisterResult\" \n\x0cGoalsRequest\x12\x10\n\x08user_ids\x18\x01 \x03(\t\"=\n\x08UserGoal\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x11\n\tgoal_type\x18\x02 \x01(\t\x12\r\n\x05\x66ound\x18\x03 \x01(\x08\"2\n\x0cLoginRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x10\n\x08password\x18\x02 \x01(\t\"/\n\rLoginResponse\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\r\n\x05valid\x18\x02 \x01(\x08\x32\x83\x03\n\x0bUserService\x12\x45\n\x0cRegisterUser\x12\x19.user_service.UserRequest\x1a\x1a.user_service.UserResponse\x12\x44\n\x0bGetUserGoal\x12\x19.user_service.GoalRequest\x1a\x1a.user_service.GoalResponse\x12V\n\x12\x42\x61tchRegisterUsers\x12\x19.user_service.UserRequest\x1a#.user_service.BatchRegisterResponse(\x01\x12\x44\n\x0cGetUserGoals\x12\x1a.user_service.GoalsRequest\x1a\x16.user_service.UserGoal0\x01\x12I\n\x0eVerifyPassword\x12\x1a.user_service.LoginRequest\x1a\x1b.user_service.LoginResponseb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -39,6 +39,18 @@ if not _descriptor._USE_C_DESCRIPTORS:
   _globals['_GOALREQUEST']._serialized_end=212
   _globals['_GOALRESPONSE']._serialized_start=214
   _globals['_GOALRESPONSE']._serialized_end=247
-  _globals['_USERSERVICE']._serialized_start=250
-  _globals['_USERSERVICE']._serialized_end=404
+  _globals['_REGISTERRESULT']._serialized_start=249
+  _globals['_REGISTERRESULT']._serialized_end=345
+  _globals['_BATCHREGISTERRESPONSE']._serialized_start=347
+  _globals['_BATCHREGISTERRESPONSE']._serialized_end=417
+  _globals['_GOALSREQUEST']._serialized_start=419
+  _globals['_GOALSREQUEST']._serialized_end=451
+  _globals['_USERGOAL']._serialized_start=453
+  _globals['_USERGOAL']._serialized_end=514
+  _globals['_LOGINREQUEST']._serialized_start=516
+  _globals['_LOGINREQUEST']._serialized_end=566
+  _globals['_LOGINRESPONSE']._serialized_start=568
+  _globals['_LOGINRESPONSE']._serialized_end=615
+  _globals['_USERSERVICE']._serialized_start=618
+  _globals['_USERSERVICE']._serialized_end=1005
 # @@protoc_insertion_point(module_scope)
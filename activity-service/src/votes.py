@@ -0,0 +1,103 @@
+from metrics import timed
+
+# Incremental vote tally kept in Redis so any replica can answer CountVotes
+# without rescanning ballots. Per session (the {session_id} hash tag keeps
+# the keys on one slot):
+#   votes:{sid}:ballots    hash  user_id -> "duration|workout_type"
+#   votes:{sid}:counts     zset  workout_type -> number of votes
+#   votes:{sid}:durations  hash  workout_type -> summed duration
+
+# Replaces the user's previous ballot (if any) by decrementing its old
+# workout_type and incrementing the new one in the same atomic step.
+CAST_VOTE_SCRIPT = '''
+local ballots, counts, durations = KEYS[1], KEYS[2], KEYS[3]
+local user_id, workout_type = ARGV[1], ARGV[2]
+local duration, ttl = tonumber(ARGV[3]), tonumber(ARGV[4])
+
+local previous = redis.call('HGET', ballots, user_id)
+if previous then
+    local sep = string.find(previous, '|', 1, true)
+    local old_duration = tonumber(string.sub(previous, 1, sep - 1))
+    local old_type = string.sub(previous, sep + 1)
+    local remaining = tonumber(redis.call('ZINCRBY', counts, -1, old_type))
+    if remaining <= 0 then
+        redis.call('ZREM', counts, old_type)
+        redis.call('HDEL', durations, old_type)
+    else
+        redis.call('HINCRBY', durations, old_type, -old_duration)
+    end
+end
+
+redis.call('HSET', ballots, user_id, duration .. '|' .. workout_type)
+redis.call('ZINCRBY', counts, 1, workout_type)
+redis.call('HINCRBY', durations, workout_type, duration)
+for _, key in ipairs(KEYS) do
+    redis.call('EXPIRE', key, ttl)
+end
+if previous then
+    return 1
+end
+return 0
+'''
+
+# Reads the leading workout_type and its summed duration together
+LEADER_SCRIPT = '''
+local leader = redis.call('ZREVRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+if #leader == 0 then
+    return nil
+end
+local total = redis.call('HGET', KEYS[2], leader[1])
+return {leader[1], leader[2], total or '0'}
+'''
+
+
+class VoteTally:
+    def __init__(self, redis_client, ttl=86400):
+        self._ttl = ttl
+        self._cast = redis_client.register_script(CAST_VOTE_SCRIPT)
+        self._leader = redis_client.register_script(LEADER_SCRIPT)
+
+    @staticmethod
+    def _keys(session_id):
+        prefix = f'votes:{{{session_id}}}'
+        return [f'{prefix}:ballots', f'{prefix}:counts', f'{prefix}:durations']
+
+    @timed('redis', 'cast_vote')
+    def cast(self, session_id, user_id, workout_type, duration):
+        # Returns True when an earlier ballot from this user was replaced
+        replaced = self._cast(
+            keys=self._keys(session_id),
+            args=[user_id, workout_type, duration, self._ttl],
+        )
+        return bool(replaced)
+
+    @timed('redis', 'vote_leader')
+    def leader(self, session_id):
+        # Returns (workout_type, votes, average_duration) or None without votes
+        _, counts, durations = self._keys(session_id)
+        return self._parse_leader(self._leader(keys=[counts, durations]))
+
+    @staticmethod
+    def _parse_leader(result):
+        if not result:
+            return None
+        workout_type, votes, total = result
+        votes = int(float(votes))
+        return workout_type.decode(), votes, int(total) // votes
+
+
+class AsyncVoteTally(VoteTally):
+    """VoteTally on a redis.asyncio client; scripts are awaited."""
+
+    @timed('redis', 'cast_vote')
+    async def cast(self, session_id, user_id, workout_type, duration):
+        replaced = await self._cast(
+            keys=self._keys(session_id),
+            args=[user_id, workout_type, duration, self._ttl],
+        )
+        return bool(replaced)
+
+    @timed('redis', 'vote_leader')
+    async def leader(self, session_id):
+        _, counts, durations = self._keys(session_id)
+        return self._parse_leader(await self._leader(keys=[counts, durations]))
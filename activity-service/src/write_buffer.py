@@ -0,0 +1,435 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+
+import bson
+import redis
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from metrics import Counter, Gauge, Histogram
+
+# Each write() queues one group of writes to one collection, as plain
+# documents so the group can also be journaled:
+#   {'insert': document}
+#   {'filter': query, 'update': update, 'upsert': bool}
+# With a journal, every group is also appended to a Redis stream
+#   <journal key>  stream, one entry per group, field 'group' holding
+#                  BSON {collection, writes}
+# and deleted once flushed. Groups a process dies with stay in the stream,
+# and recover() queues them again on the next start. A group flushed just
+# before such a crash may be written twice: inserts are then skipped as
+# duplicates, but $inc updates count twice.
+DUPLICATE_KEY = 11000
+RETRY_DELAY = 0.1
+MAX_RETRY_DELAY = 5.0
+
+BATCH_SIZE = Histogram(
+    'write_buffer_batch_size', 'Writes sent to MongoDB in one bulk write.', ['collection'],
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500))
+FLUSH_SECONDS = Histogram(
+    'write_buffer_flush_seconds', 'Latency of the bulk writes flushing the write buffer.', ['collection'])
+PENDING = Gauge('write_buffer_pending', 'Writes accepted by the write buffer and not yet in MongoDB.')
+REJECTED = Counter('write_buffer_rejected_total', 'Writes refused because the write buffer stayed full.')
+FAILED = Counter(
+    'write_buffer_failed_total', 'Buffered writes MongoDB refused, by error code.', ['collection', 'code'])
+
+Group = namedtuple('Group', 'collection writes keys journal_id queued')
+
+
+def insert(document):
+    return {'insert': document}
+
+
+def update(query, change, upsert=False):
+    return {'filter': query, 'update': change, 'upsert': upsert}
+
+
+def operation(write):
+    if 'insert' in write:
+        return InsertOne(write['insert'])
+    return UpdateOne(write['filter'], write['update'], upsert=write['upsert'])
+
+
+def by_collection(groups):
+    # {collection: [operation, ...]} in queue order
+    operations = {}
+    for group in groups:
+        operations.setdefault(group.collection, []).extend(operation(w) for w in group.writes)
+    return operations
+
+
+def log_write_errors(collection, error):
+    # Duplicate inserts are groups replayed from the journal; anything else is lost
+    details = error.details
+    refused = [e for e in details.get('writeErrors', []) if e['code'] != DUPLICATE_KEY]
+    for write_error in refused:
+        FAILED.inc(collection, write_error['code'])
+    if refused:
+        logging.error("MongoDB refused %s buffered writes to %s, first: %s",
+                      len(refused), collection, refused[0]['errmsg'])
+    if details.get('writeConcernErrors'):
+        logging.warning("Write concern errors flushing %s: %s", collection, details['writeConcernErrors'])
+
+
+class BufferFull(Exception):
+    """Raised when writes could not be queued because the buffer stayed full."""
+
+
+class NotFlushed(Exception):
+    """Raised when a read could not wait for the buffered writes it depends on."""
+
+
+class WriteJournal:
+    """Redis stream holding the write groups a WriteBuffer has not flushed.
+
+    Every process needs its own key: recover() replays whatever it finds.
+    Without Redis, writes are buffered unjournaled rather than refused.
+    """
+
+    def __init__(self, redis_client, key):
+        self._redis = redis_client
+        self._key = key
+
+    def append(self, collection, writes):
+        # Returns the entry id, or None if the group could not be journaled
+        try:
+            return self._redis.xadd(self._key, {'group': bson.encode({'collection': collection, 'writes': writes})})
+        except redis.RedisError as e:
+            logging.warning("Write journal unavailable, buffering writes to %s without it: %s", collection, e)
+            return None
+
+    def remove(self, entry_ids):
+        try:
+            self._redis.xdel(self._key, *entry_ids)
+        except redis.RedisError as e:
+            logging.warning("Failed to remove %s flushed groups from the write journal: %s", len(entry_ids), e)
+
+    def read(self, after='-', count=500):
+        # Returns [(entry_id, collection, writes)] after the given entry id
+        entries = self._redis.xrange(self._key, min=after if after == '-' else f'({after}', count=count)
+        return [self._decode(entry_id, fields) for entry_id, fields in entries]
+
+    @staticmethod
+    def _decode(entry_id, fields):
+        group = bson.decode(fields[b'group'])
+        return entry_id.decode(), group['collection'], group['writes']
+
+
+class AsyncWriteJournal(WriteJournal):
+    """WriteJournal on a redis.asyncio client."""
+
+    async def append(self, collection, writes):
+        try:
+            return await self._redis.xadd(self._key, {'group': bson.encode({'collection': collection, 'writes': writes})})
+        except redis.RedisError as e:
+            logging.warning("Write journal unavailable, buffering writes to %s without it: %s", collection, e)
+            return None
+
+    async def remove(self, entry_ids):
+        try:
+            await self._redis.xdel(self._key, *entry_ids)
+        except redis.RedisError as e:
+            logging.warning("Failed to remove %s flushed groups from the write journal: %s", len(entry_ids), e)
+
+    async def read(self, after='-', count=500):
+        entries = await self._redis.xrange(self._key, min=after if after == '-' else f'({after}', count=count)
+        return [self._decode(entry_id, fields) for entry_id, fields in entries]
+
+
+class WriteBuffer:
+    """Writes to MongoDB queued in memory and sent in bulk by a background thread.
+
+    write() returns as soon as its group is queued. The flusher sends the
+    queue as one unordered bulk_write per collection once batch_size writes
+    are waiting or the oldest has waited interval seconds, and retries
+    while MongoDB is unreachable. Once max_pending writes are queued,
+    write() blocks for up to put_timeout and then raises BufferFull.
+
+    Groups carry keys (ids the writes touch); wait_flushed() flushes at
+    once and returns when no queued write to the collection has any of the
+    given keys, so a read that follows a buffered write sees it, or returns
+    False after timeout seconds, as while MongoDB is down. stop()
+    flushes what is left.
+    """
+
+    def __init__(self, db, max_pending=10000, batch_size=500, interval=0.05, put_timeout=1.0, journal=None):
+        self._db = db
+        self._max_pending = max_pending
+        self._batch_size = batch_size
+        self._interval = interval
+        self._put_timeout = put_timeout
+        self._journal = journal
+        self._groups = deque()
+        self._pending = 0
+        # (collection, key) -> number of unflushed groups with that key
+        self._unflushed = {}
+        self._urgent = False
+        self._stopping = False
+        self._changed = threading.Condition()
+        self._thread = None
+
+    def recover(self):
+        # Queues the groups a previous process left in the journal; call before start()
+        if self._journal is None:
+            return 0
+        after, recovered = '-', 0
+        while True:
+            entries = self._journal.read(after, self._batch_size)
+            if not entries:
+                break
+            for entry_id, collection, writes in entries:
+                self._enqueue(Group(collection, writes, (), entry_id, time.monotonic()))
+            after, recovered = entries[-1][0], recovered + len(entries)
+        self._log_recovered(recovered)
+        return recovered
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='write-buffer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        with self._changed:
+            self._stopping = True
+            self._changed.notify_all()
+        self._thread.join(timeout)
+        self._log_unflushed()
+
+    def write(self, collection, writes, keys=()):
+        journal_id = self._journal.append(collection, writes) if self._journal else None
+        group = Group(collection, writes, tuple(keys), journal_id, time.monotonic())
+        with self._changed:
+            if self._changed.wait_for(lambda: self._fits(group), self._put_timeout):
+                self._enqueue(group)
+                self._changed.notify_all()
+                return
+        self._reject(group)
+        if journal_id is not None:
+            self._journal.remove([journal_id])
+        raise BufferFull('Too many writes waiting for MongoDB, try again later')
+
+    def wait_flushed(self, collection, keys, timeout=5.0):
+        # Returns False if the writes were still queued after timeout seconds
+        keys = [(collection, key) for key in keys]
+        with self._changed:
+            if not self._has_unflushed(keys):
+                return True
+            self._urgent = True
+            self._changed.notify_all()
+            return self._changed.wait_for(lambda: not self._has_unflushed(keys), timeout)
+
+    def _fits(self, group):
+        # A group larger than max_pending is let through once the queue is empty
+        return self._pending + len(group.writes) <= self._max_pending or not self._groups
+
+    def _due(self):
+        return self._pending >= self._batch_size or self._urgent or self._stopping
+
+    def _has_unflushed(self, keys):
+        return any(key in self._unflushed for key in keys)
+
+    def _enqueue(self, group):
+        self._groups.append(group)
+        self._pending += len(group.writes)
+        for key in group.keys:
+            key = (group.collection, key)
+            self._unflushed[key] = self._unflushed.get(key, 0) + 1
+        PENDING.inc(amount=len(group.writes))
+
+    def _reject(self, group):
+        REJECTED.inc(amount=len(group.writes))
+        logging.warning("Write buffer full, refused %s writes to %s", len(group.writes), group.collection)
+
+    def _take(self):
+        # Whole groups, oldest first, until the batch has batch_size writes
+        groups, size = [], 0
+        while self._groups and (not groups or size + len(self._groups[0].writes) <= self._batch_size):
+            group = self._groups.popleft()
+            groups.append(group)
+            size += len(group.writes)
+        self._pending -= size
+        self._urgent = self._urgent and bool(self._groups)
+        return groups
+
+    def _release(self, groups):
+        # Called with the lock held once the groups are in MongoDB
+        for group in groups:
+            for key in group.keys:
+                key = (group.collection, key)
+                if self._unflushed[key] == 1:
+                    del self._unflushed[key]
+                else:
+                    self._unflushed[key] -= 1
+        PENDING.dec(amount=sum(len(group.writes) for group in groups))
+
+    def _journal_ids(self, groups):
+        return [group.journal_id for group in groups if group.journal_id is not None]
+
+    def _log_recovered(self, recovered):
+        if recovered:
+            logging.warning("Recovered %s unflushed write groups from the write journal", recovered)
+
+    def _log_unflushed(self):
+        if self._pending or self._groups:
+            logging.error("Stopped with %s buffered writes not flushed", self._pending)
+
+    def _run(self):
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: self._groups or self._stopping)
+                if not self._groups:
+                    return
+                # Wait for a full batch, but never longer than interval after the oldest write
+                self._changed.wait_for(self._due, self._groups[0].queued + self._interval - time.monotonic())
+                groups = self._take()
+                self._changed.notify_all()
+            self._flush(groups)
+
+    def _flush(self, groups):
+        for collection, operations in by_collection(groups).items():
+            self._bulk_write(collection, operations)
+        journal_ids = self._journal_ids(groups)
+        if journal_ids:
+            self._journal.remove(journal_ids)
+        with self._changed:
+            self._release(groups)
+            self._changed.notify_all()
+
+    def _bulk_write(self, collection, operations):
+        BATCH_SIZE.observe(len(operations), collection)
+        delay = RETRY_DELAY
+        while True:
+            try:
+                with FLUSH_SECONDS.time(collection):
+                    self._db[collection].bulk_write(operations, ordered=False)
+                return
+            except BulkWriteError as e:
+                log_write_errors(collection, e)
+                return
+            except PyMongoError as e:
+                logging.warning("Flushing %s writes to %s failed, retrying in %.1fs: %s",
+                                len(operations), collection, delay, e)
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+            except Exception:
+                # Not something retrying fixes, e.g. a document BSON cannot encode
+                logging.exception("Dropped %s buffered writes to %s", len(operations), collection)
+                FAILED.inc(collection, 'exception', amount=len(operations))
+                return
+
+
+class AsyncWriteBuffer(WriteBuffer):
+    """WriteBuffer on a pymongo AsyncMongoClient database, flushed by a task on the loop."""
+
+    def __init__(self, db, max_pending=10000, batch_size=500, interval=0.05, put_timeout=1.0, journal=None):
+        super().__init__(db, max_pending, batch_size, interval, put_timeout, journal)
+        self._changed = asyncio.Condition()
+        self._task = None
+
+    async def recover(self):
+        if self._journal is None:
+            return 0
+        after, recovered = '-', 0
+        while True:
+            entries = await self._journal.read(after, self._batch_size)
+            if not entries:
+                break
+            for entry_id, collection, writes in entries:
+                self._enqueue(Group(collection, writes, (), entry_id, time.monotonic()))
+            after, recovered = entries[-1][0], recovered + len(entries)
+        self._log_recovered(recovered)
+        return recovered
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self, timeout=10.0):
+        async with self._changed:
+            self._stopping = True
+            self._changed.notify_all()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._log_unflushed()
+
+    async def write(self, collection, writes, keys=()):
+        journal_id = await self._journal.append(collection, writes) if self._journal else None
+        group = Group(collection, writes, tuple(keys), journal_id, time.monotonic())
+        async with self._changed:
+            try:
+                await asyncio.wait_for(self._changed.wait_for(lambda: self._fits(group)), self._put_timeout)
+            except asyncio.TimeoutError:
+                pass
+            else:
+                self._enqueue(group)
+                self._changed.notify_all()
+                return
+        self._reject(group)
+        if journal_id is not None:
+            await self._journal.remove([journal_id])
+        raise BufferFull('Too many writes waiting for MongoDB, try again later')
+
+    async def wait_flushed(self, collection, keys, timeout=5.0):
+        keys = [(collection, key) for key in keys]
+        async with self._changed:
+            if not self._has_unflushed(keys):
+                return True
+            self._urgent = True
+            self._changed.notify_all()
+            try:
+                await asyncio.wait_for(self._changed.wait_for(lambda: not self._has_unflushed(keys)), timeout)
+            except asyncio.TimeoutError:
+                return False
+            return True
+
+    async def _run(self):
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: self._groups or self._stopping)
+                if not self._groups:
+                    return
+                try:
+                    await asyncio.wait_for(
+                        self._changed.wait_for(self._due),
+                        max(self._groups[0].queued + self._interval - time.monotonic(), 0),
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                groups = self._take()
+                self._changed.notify_all()
+            await self._flush(groups)
+
+    async def _flush(self, groups):
+        for collection, operations in by_collection(groups).items():
+            await self._bulk_write(collection, operations)
+        journal_ids = self._journal_ids(groups)
+        if journal_ids:
+            await self._journal.remove(journal_ids)
+        async with self._changed:
+            self._release(groups)
+            self._changed.notify_all()
+
+    async def _bulk_write(self, collection, operations):
+        BATCH_SIZE.observe(len(operations), collection)
+        delay = RETRY_DELAY
+        while True:
+            try:
+                with FLUSH_SECONDS.time(collection):
+                    await self._db[collection].bulk_write(operations, ordered=False)
+                return
+            except BulkWriteError as e:
+                log_write_errors(collection, e)
+                return
+            except PyMongoError as e:
+                logging.warning("Flushing %s writes to %s failed, retrying in %.1fs: %s",
+                                len(operations), collection, delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+            except Exception:
+                # Not something retrying fixes, e.g. a document BSON cannot encode
+                logging.exception("Dropped %s buffered writes to %s", len(operations), collection)
+                FAILED.inc(collection, 'exception', amount=len(operations))
+                return
@@ -4,6 +4,7 @@ const WebSocket = require('ws');
 const grpc = require('@grpc/grpc-js');
 const protoLoader = require('@grpc/proto-loader');
 const path = require('path');
+const crypto = require('crypto');
 const { createClient } = require('redis');
 const CircuitBreaker = require('opossum');
 const fs = require('fs');
@@ -53,11 +54,27 @@ function createActivityClient() {
     return new activityProto.ActivityService(`${activityServiceHost}:50052`, grpc.credentials.createInsecure());
 }
 
+// Identifies the end client to the services' per-client rate limits
+function clientMetadata(req) {
+    const metadata = new grpc.Metadata();
+    metadata.set('x-client-id', req.ip);
+    return metadata;
+}
+
+// Writes carry an idempotency key: a retry of the same call, by nginx on
+// another replica or by the client resending its Idempotency-Key header,
+// gets the first attempt's result instead of running twice
+function idempotentMetadata(req) {
+    const metadata = clientMetadata(req);
+    metadata.set('idempotency-key', req.get('Idempotency-Key') || crypto.randomUUID());
+    return metadata;
+}
+
 // Circuit breaker for Activity Service
-function startWorkoutSessionGrpcCall(request) {
+function startWorkoutSessionGrpcCall(request, metadata) {
     return new Promise((resolve, reject) => {
         const client = createActivityClient();
-        client.StartWorkoutSession(request, (err, response) => {
+        client.StartWorkoutSession(request, metadata, (err, response) => {
             if (err) {
                 logger.error('Error calling StartWorkoutSession:', err.message);
                 reject(err);
@@ -83,7 +100,7 @@ breaker.on('close', () => logger.info('Circuit breaker closed'));
 app.post('/users/register', (req, res) => {
     const { username, email, password, goal } = req.body;
     const client = createUserClient();
-    client.RegisterUser({ username, email, password, goal }, (err, response) => {
+    client.RegisterUser({ username, email, password, goal }, idempotentMetadata(req), (err, response) => {
         if (err) {
             logger.error('Error calling RegisterUser:', err.message);
             res.status(500).json({ error: err.message });
@@ -93,10 +110,25 @@ app.post('/users/register', (req, res) => {
     });
 });
 
+app.post('/users/login', (req, res) => {
+    const { username, password } = req.body;
+    const client = createUserClient();
+    client.VerifyPassword({ username, password }, clientMetadata(req), (err, response) => {
+        if (err) {
+            logger.error('Error calling VerifyPassword:', err.message);
+            res.status(err.code === grpc.status.RESOURCE_EXHAUSTED ? 429 : 500).json({ error: err.message });
+        } else if (!response.valid) {
+            res.status(401).json({ error: 'Invalid username or password' });
+        } else {
+            res.json({ user_id: response.user_id });
+        }
+    });
+});
+
 app.get('/users/:id/goal', (req, res) => {
     const user_id = req.params.id;
     const client = createUserClient();
-    client.GetUserGoal({ user_id }, (err, response) => {
+    client.GetUserGoal({ user_id }, clientMetadata(req), (err, response) => {
         if (err) {
             logger.error('Error calling GetUserGoal:', err.message);
             res.status(500).json({ error: err.message });
@@ -107,8 +139,8 @@ app.get('/users/:id/goal', (req, res) => {
 });
 
 app.post('/workouts/start', (req, res) => {
-    const { user_id } = req.body;
-    breaker.fire({ user_id })
+    const { user_id, workout_type } = req.body;
+    breaker.fire({ user_id, workout_type }, idempotentMetadata(req))
         .then((response) => res.json(response))
         .catch((err) => {
             if (breaker.opened) {
@@ -120,9 +152,9 @@ app.post('/workouts/start', (req, res) => {
 });
 
 app.post('/workouts/group/start', (req, res) => {
-    const { user_id } = req.body;
+    const { user_id, workout_type } = req.body;
     const client = createActivityClient();
-    client.StartGroupWorkoutSession({ user_id }, (err, response) => {
+    client.StartGroupWorkoutSession({ user_id, workout_type }, idempotentMetadata(req), (err, response) => {
         if (err) {
             logger.error('Error calling StartGroupWorkoutSession:', err.message);
             res.status(500).json({ error: err.message });
@@ -135,7 +167,7 @@ app.post('/workouts/group/start', (req, res) => {
 app.post('/workouts/end', (req, res) => {
     const { session_id } = req.body;
     const client = createActivityClient();
-    client.EndWorkoutSession({ session_id }, (err, response) => {
+    client.EndWorkoutSession({ session_id }, idempotentMetadata(req), (err, response) => {
         if (err) {
             logger.error('Error calling EndWorkoutSession:', err.message);
             res.status(500).json({ error: err.message });
@@ -145,6 +177,60 @@ app.post('/workouts/end', (req, res) => {
     });
 });
 
+app.get('/users/:id/statistics', (req, res) => {
+    const user_id = req.params.id;
+    const { period, limit } = req.query;
+    const client = createActivityClient();
+    client.GetUserStats({ user_id, period, limit: Number(limit) || 0 }, clientMetadata(req), (err, response) => {
+        if (err) {
+            logger.error('Error calling GetUserStats:', err.message);
+            res.status(err.code === grpc.status.INVALID_ARGUMENT ? 400 : 500).json({ error: err.message });
+        } else {
+            res.json(response);
+        }
+    });
+});
+
+app.get('/users/:id/progress', (req, res) => {
+    const user_id = req.params.id;
+    const client = createActivityClient();
+    client.GetGoalProgress({ user_id }, clientMetadata(req), (err, response) => {
+        if (err) {
+            logger.error('Error calling GetGoalProgress:', err.message);
+            res.status(500).json({ error: err.message });
+        } else {
+            res.json(response);
+        }
+    });
+});
+
+app.get('/workouts/group/:session_id/leaderboard', (req, res) => {
+    const session_id = req.params.session_id;
+    const client = createActivityClient();
+    client.GetSessionLeaderboard({ session_id }, clientMetadata(req), (err, response) => {
+        if (err) {
+            logger.error('Error calling GetSessionLeaderboard:', err.message);
+            res.status(err.code === grpc.status.NOT_FOUND ? 404 : 500).json({ error: err.message });
+        } else {
+            res.json(response);
+        }
+    });
+});
+
+app.get('/leaderboards', (req, res) => {
+    const { scope, goal_type, session_id, metric, period, date, offset, limit, user_id } = req.query;
+    const request = { scope, goal_type, session_id, metric, period, date, offset: Number(offset) || 0, limit: Number(limit) || 0, user_id };
+    const client = createActivityClient();
+    client.GetLeaderboard(request, clientMetadata(req), (err, response) => {
+        if (err) {
+            logger.error('Error calling GetLeaderboard:', err.message);
+            res.status(err.code === grpc.status.INVALID_ARGUMENT ? 400 : 500).json({ error: err.message });
+        } else {
+            res.json(response);
+        }
+    });
+});
+
 // Start HTTP server
 const HTTP_PORT = 8080;
 app.listen(HTTP_PORT, () => {
@@ -157,6 +243,52 @@ const wsServer = new WebSocket.Server({ port: WS_PORT }, () => {
     logger.info(`WebSocket server running on port ${WS_PORT}`);
 });
 
+// One SubscribeSession stream per session in this gateway, shared by its local sockets
+const sessionStreams = new Map();
+const sessionEventTypes = { joined: 'user_joined', left: 'user_left', voted: 'user_voted', tally: 'tally' };
+const activityClient = createActivityClient();
+
+function broadcast(session_id, payload) {
+    wsServer.clients.forEach((client) => {
+        if (client.readyState === WebSocket.OPEN && client.session_id === session_id) {
+            client.send(JSON.stringify(payload));
+        }
+    });
+}
+
+function subscribeSession(session_id) {
+    if (sessionStreams.has(session_id)) return;
+    const call = activityClient.SubscribeSession({ session_id });
+    sessionStreams.set(session_id, call);
+    call.on('data', (event) => {
+        const { type, ...fields } = event;
+        broadcast(session_id, { ...fields, type: sessionEventTypes[type] || type });
+    });
+    call.on('error', (err) => {
+        if (err.code !== grpc.status.CANCELLED) {
+            logger.error('SubscribeSession stream error:', err.message);
+        }
+    });
+    call.on('end', () => {
+        if (sessionStreams.get(session_id) !== call) return;
+        sessionStreams.delete(session_id);
+        // The stream ended on the service side (e.g. a replica shut down); resubscribe if sockets remain
+        if (hasLocalMembers(session_id)) setTimeout(() => subscribeSession(session_id), 1000);
+    });
+}
+
+function hasLocalMembers(session_id) {
+    return [...wsServer.clients].some((client) => client.session_id === session_id);
+}
+
+function unsubscribeSession(session_id) {
+    const call = sessionStreams.get(session_id);
+    if (call && !hasLocalMembers(session_id)) {
+        sessionStreams.delete(session_id);
+        call.cancel();
+    }
+}
+
 wsServer.on('connection', (ws) => {
     logger.info('User connected via WebSocket');
     let session_id = null;
@@ -171,34 +303,20 @@ wsServer.on('connection', (ws) => {
                 ws.session_id = session_id;
                 ws.user_id = user_id;
                 logger.info(`User ${user_id} joined session ${session_id}`);
-
-                try {
-                    const sessionData = await redisClient.hGetAll(`session:${session_id}`);
-                    if (Object.keys(sessionData).length === 0) {
-                        const sessionInfo = { participants: JSON.stringify([user_id]) };
-                        await redisClient.hSet(`session:${session_id}`, sessionInfo);
-                    } else {
-                        let participants = JSON.parse(sessionData.participants);
-                        if (!participants.includes(user_id)) {
-                            participants.push(user_id);
-                            await redisClient.hSet(`session:${session_id}`, 'participants', JSON.stringify(participants));
-                        }
-                    }
-                } catch (err) {
-                    logger.error('Redis error:', err);
-                }
-
-                wsServer.clients.forEach((client) => {
-                    if (client !== ws && client.readyState === WebSocket.OPEN && client.session_id === session_id) {
-                        client.send(JSON.stringify({ type: 'user_joined', user_id: user_id }));
-                    }
+                subscribeSession(session_id);
+                activityClient.JoinGroupSession({ session_id, user_id }, (err) => {
+                    if (err) logger.error('Error calling JoinGroupSession:', err.message);
                 });
-            } else if (data.type === 'chat_message') {
-                wsServer.clients.forEach((client) => {
-                    if (client.readyState === WebSocket.OPEN && client.session_id === session_id) {
-                        client.send(JSON.stringify({ type: 'chat_message', user_id: user_id, message: data.message }));
+            } else if (data.type === 'vote') {
+                const { workout_type, duration } = data;
+                activityClient.VoteWorkout({ session_id, user_id, workout_type, duration }, (err) => {
+                    if (err) {
+                        logger.error('Error calling VoteWorkout:', err.message);
+                        ws.send(JSON.stringify({ type: 'error', error: err.message }));
                     }
                 });
+            } else if (data.type === 'chat_message') {
+                broadcast(session_id, { type: 'chat_message', user_id: user_id, message: data.message });
             }
         } catch (err) {
             logger.error('Error processing message:', err);
@@ -207,5 +325,11 @@ wsServer.on('connection', (ws) => {
 
     ws.on('close', () => {
         logger.info(`User ${user_id} disconnected`);
+        if (session_id === null) return;
+        // wsServer.clients no longer includes this socket
+        unsubscribeSession(session_id);
+        activityClient.LeaveGroupSession({ session_id, user_id }, (err) => {
+            if (err) logger.error('Error calling LeaveGroupSession:', err.message);
+        });
     });
 });
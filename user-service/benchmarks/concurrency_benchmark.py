@@ -0,0 +1,72 @@
+"""Throughput of GetUserGoal at increasing numbers of concurrent streams.
+
+Start the service once per mode and point the benchmark at it:
+    GRPC_SERVER_MODE=threads python src/app.py
+    GRPC_SERVER_MODE=aio python src/app.py
+    python benchmarks/concurrency_benchmark.py --target localhost:50051
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import grpc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import user_service_pb2  # noqa: E402
+import user_service_pb2_grpc  # noqa: E402
+
+
+async def run(stub, concurrency, duration, user_ids):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def stream(worker):
+        nonlocal errors
+        i = worker
+        while time.perf_counter() < deadline:
+            request = user_service_pb2.GoalRequest(user_id=user_ids[i % len(user_ids)])
+            start = time.perf_counter()
+            try:
+                await stub.GetUserGoal(request, timeout=10)
+                latencies.append(time.perf_counter() - start)
+            except grpc.aio.AioRpcError:
+                errors += 1
+            i += concurrency
+
+    await asyncio.gather(*(stream(worker) for worker in range(concurrency)))
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0.0
+    return len(latencies) / duration, p99, errors
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--target', default='localhost:50051')
+    parser.add_argument('--concurrency', default='10,100,1000')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--users', type=int, default=1000)
+    args = parser.parse_args()
+
+    async with grpc.aio.insecure_channel(args.target) as channel:
+        stub = user_service_pb2_grpc.UserServiceStub(channel)
+
+        async def seed():
+            for i in range(args.users):
+                yield user_service_pb2.UserRequest(
+                    username=f'bench{i}', email=f'bench{i}@example.com',
+                    password='secret', goal='endurance'
+                )
+        reply = await stub.BatchRegisterUsers(seed())
+        user_ids = [r.user_id for r in reply.results if r.user_id] or ['1']
+
+        for concurrency in [int(c) for c in args.concurrency.split(',')]:
+            rps, p99, errors = await run(stub, concurrency, args.duration, user_ids)
+            print(f'{concurrency:>5} streams  {rps:>9.0f} req/s  p99 {p99:8.2f} ms  errors {errors}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+"""Checks that user-service replicas agree on the users they store.
+
+Registers users round-robin across the targets, then asks every target for
+each user: the goal (GetUserGoal, GetUserGoals) and a login (VerifyPassword,
+which always reads the database). A second registration of each username
+on another replica must be refused. Exits non-zero on any mismatch:
+    python benchmarks/consistency_check.py --targets user-service-1:50051,user-service-2:50051,user-service-3:50051
+With per-container SQLite files this fails: replicas issue the same user ids
+and only see their own users. With DATABASE_URL pointing every replica at
+PostgreSQL it passes. In docker compose, run it from the app network, e.g.
+    docker compose run --rm --no-deps -v "$PWD/user-service/benchmarks:/app/benchmarks" \\
+        user-service-1 python benchmarks/consistency_check.py
+A single target is also accepted; each call then uses a new connection, so
+calls spread across the launcher workers or load balancer behind it. Calls
+rejected by the service's rate limits are retried.
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+import grpc
+
+SRC = os.path.join(os.path.dirname(__file__), '..', 'src')
+sys.path.insert(0, SRC)
+
+import user_service_pb2  # noqa: E402
+import user_service_pb2_grpc  # noqa: E402
+
+DEFAULT_TARGETS = 'user-service-1:50051,user-service-2:50051,user-service-3:50051'
+
+
+def call(target, method, request, timeout=5, stream=False):
+    # A fresh channel per call, so nothing is pinned to one connection;
+    # streamed replies are read before it closes
+    while True:
+        with grpc.insecure_channel(target) as channel:
+            stub = user_service_pb2_grpc.UserServiceStub(channel)
+            try:
+                reply = getattr(stub, method)(request, timeout=timeout)
+                return list(reply) if stream else reply
+            except grpc.RpcError as e:
+                # The service rate-limits logins and registrations per client
+                if e.code() != grpc.StatusCode.RESOURCE_EXHAUSTED:
+                    raise
+        time.sleep(0.2)
+
+
+def register(targets, count):
+    run = uuid.uuid4().hex[:8]
+    users = []
+    for i in range(count):
+        target = targets[i % len(targets)]
+        username = f'consistency-{run}-{i}'
+        request = user_service_pb2.UserRequest(
+            username=username, email=f'{username}@example.com',
+            password=f'pw-{run}-{i}', goal=f'{i + 1} sessions per week',
+        )
+        reply = call(target, 'RegisterUser', request)
+        users.append({'target': target, 'request': request, 'user_id': reply.user_id})
+    return users
+
+
+def check(targets, users):
+    problems = []
+    ids = [user['user_id'] for user in users]
+    if len(set(ids)) != len(ids):
+        problems.append(f'{len(ids) - len(set(ids))} user ids were issued more than once')
+    for target in targets:
+        goals = {
+            goal.user_id: goal
+            for goal in call(target, 'GetUserGoals', user_service_pb2.GoalsRequest(user_ids=ids), stream=True)
+        }
+        for user in users:
+            request, user_id = user['request'], user['user_id']
+            goal = goals.get(user_id)
+            if goal is None or not goal.found or goal.goal_type != request.goal:
+                problems.append(f'{target}: GetUserGoals for {user_id} returned {goal and goal.goal_type!r}')
+            try:
+                reply = call(target, 'GetUserGoal', user_service_pb2.GoalRequest(user_id=user_id))
+                if reply.goal_type != request.goal:
+                    problems.append(f'{target}: GetUserGoal for {user_id} returned {reply.goal_type!r}')
+            except grpc.RpcError as e:
+                problems.append(f'{target}: GetUserGoal for {user_id} failed with {e.code().name}')
+            login = call(target, 'VerifyPassword', user_service_pb2.LoginRequest(
+                username=request.username, password=request.password))
+            if not login.valid or login.user_id != user_id:
+                problems.append(f'{target}: {request.username} cannot log in (got {login.user_id!r})')
+    for i, user in enumerate(users):
+        # Re-registering through another replica must hit the same unique constraint
+        target = targets[(i + 1) % len(targets)]
+        try:
+            call(target, 'RegisterUser', user['request'])
+            problems.append(f'{target}: accepted a second registration of {user["request"].username}')
+        except grpc.RpcError as e:
+            if e.code() != grpc.StatusCode.ALREADY_EXISTS:
+                problems.append(f'{target}: re-registration failed with {e.code().name}')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--targets', default=DEFAULT_TARGETS, help='comma-separated host:port list')
+    parser.add_argument('--users', type=int, default=30)
+    args = parser.parse_args()
+
+    targets = args.targets.split(',')
+    started = time.perf_counter()
+    users = register(targets, args.users)
+    problems = check(targets, users)
+    print(f'{len(users)} users registered across {len(targets)} target(s), '
+          f'checked in {time.perf_counter() - started:.1f}s')
+    for problem in problems[:20]:
+        print('  ' + problem)
+    if problems:
+        print(f'INCONSISTENT: {len(problems)} problem(s)')
+        sys.exit(1)
+    print('consistent')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Latency of the HTTP /status endpoint, idle and while gRPC is saturated.
+
+The gRPC load runs in separate processes so the measuring client does not
+compete with it for the GIL:
+    python src/app.py
+    python benchmarks/http_benchmark.py --grpc-target localhost:50051 --http-url http://localhost:5000/status
+
+The HTTP server shares the process (and the GIL) with gRPC, so some added
+latency under load is expected; what matters is that it stays in the low
+milliseconds rather than queueing behind RPCs.
+"""
+import argparse
+import asyncio
+import http.client
+import multiprocessing
+import os
+import sys
+import time
+from urllib.parse import urlsplit
+
+import grpc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import user_service_pb2  # noqa: E402
+import user_service_pb2_grpc  # noqa: E402
+
+
+def grpc_load(target, concurrency, duration, counter):
+    async def run():
+        async with grpc.aio.insecure_channel(target) as channel:
+            stub = user_service_pb2_grpc.UserServiceStub(channel)
+            deadline = time.perf_counter() + duration
+            done = 0
+
+            async def stream(worker):
+                nonlocal done
+                i = worker
+                while time.perf_counter() < deadline:
+                    # Unknown ids are fine: NOT_FOUND goes through the same cache and DB path
+                    request = user_service_pb2.GoalRequest(user_id=str(i % 1000 + 1))
+                    try:
+                        await stub.GetUserGoal(request, timeout=10)
+                    except grpc.aio.AioRpcError:
+                        pass
+                    done += 1
+                    i += concurrency
+
+            await asyncio.gather(*(stream(worker) for worker in range(concurrency)))
+            with counter.get_lock():
+                counter.value += done
+
+    asyncio.run(run())
+
+
+def measure_http(url, duration):
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=10)
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        conn.request('GET', parts.path or '/')
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+    latencies.sort()
+    return (
+        latencies[len(latencies) // 2] * 1000,
+        latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        latencies[-1] * 1000,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--grpc-target', default='localhost:50051')
+    parser.add_argument('--http-url', default='http://localhost:5000/status')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=200, help='in-flight RPCs per load process')
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args()
+
+    p50, p99, worst = measure_http(args.http_url, args.duration)
+    print(f'idle       /status p50 {p50:7.2f} ms  p99 {p99:7.2f} ms  max {worst:7.2f} ms')
+
+    counter = multiprocessing.Value('q', 0)
+    loaders = [
+        multiprocessing.Process(
+            target=grpc_load,
+            args=(args.grpc_target, args.concurrency, args.duration + 2, counter),
+        )
+        for _ in range(args.processes)
+    ]
+    for loader in loaders:
+        loader.start()
+    # Let the load ramp up before measuring
+    time.sleep(1)
+    p50, p99, worst = measure_http(args.http_url, args.duration)
+    for loader in loaders:
+        loader.join()
+    rps = counter.value / (args.duration + 2)
+    print(f'saturated  /status p50 {p50:7.2f} ms  p99 {p99:7.2f} ms  max {worst:7.2f} ms'
+          f'  (gRPC {rps:.0f} req/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""RegisterUser throughput with password hashing enabled.
+
+Every registration runs one scrypt hash in the service's hashing pool, so
+throughput is bounded by PASSWORD_HASH_WORKERS and the scrypt cost:
+    PASSWORD_HASH_WORKERS=4 python src/app.py
+    python benchmarks/registration_benchmark.py --target localhost:50051
+Rejections are RESOURCE_EXHAUSTED replies from the bounded hashing queue.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import grpc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import user_service_pb2  # noqa: E402
+import user_service_pb2_grpc  # noqa: E402
+
+
+async def run(stub, concurrency, duration, prefix):
+    latencies = []
+    rejected = 0
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def stream(worker):
+        nonlocal rejected, errors
+        i = 0
+        while time.perf_counter() < deadline:
+            name = f'{prefix}-{worker}-{i}'
+            request = user_service_pb2.UserRequest(
+                username=name, email=f'{name}@example.com', password='correct horse battery', goal='endurance'
+            )
+            start = time.perf_counter()
+            try:
+                await stub.RegisterUser(request, timeout=30)
+                latencies.append(time.perf_counter() - start)
+            except grpc.aio.AioRpcError as e:
+                if e.code() == grpc.StatusCode.RESOURCE_EXHAUSTED:
+                    rejected += 1
+                else:
+                    errors += 1
+            i += 1
+
+    await asyncio.gather(*(stream(worker) for worker in range(concurrency)))
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0.0
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0.0
+    return len(latencies) / duration, p50, p99, rejected, errors
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--target', default='localhost:50051')
+    parser.add_argument('--concurrency', default='1,10,100')
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args()
+
+    async with grpc.aio.insecure_channel(args.target) as channel:
+        stub = user_service_pb2_grpc.UserServiceStub(channel)
+        for concurrency in [int(c) for c in args.concurrency.split(',')]:
+            prefix = f'reg{int(time.time() * 1000)}'
+            rps, p50, p99, rejected, errors = await run(stub, concurrency, args.duration, prefix)
+            print(f'{concurrency:>5} streams  {rps:>7.0f} registrations/s  p50 {p50:7.2f} ms'
+                  f'  p99 {p99:7.2f} ms  rejected {rejected}  errors {errors}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
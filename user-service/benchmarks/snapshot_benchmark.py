@@ -0,0 +1,91 @@
+"""Export and import throughput of src/snapshot.py for a large users table.
+
+Usage: python benchmarks/snapshot_benchmark.py [--users 10000000] [--format parquet]
+       [--target postgresql://...]
+
+Fills a fresh SQLite database with synthetic users, exports it, and
+imports the file into another fresh database (SQLite, or --target, which
+must be an empty PostgreSQL database).
+"""
+import argparse
+import base64
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from datafiles import open_reader, open_writer  # noqa: E402
+from migrations import MigrationRunner  # noqa: E402
+from repository import connect  # noqa: E402
+from sharding import open_store  # noqa: E402
+from snapshot import FIELDS, BulkLoader, export_users, import_users  # noqa: E402
+
+
+def password(i):
+    # Shaped like passwords.hash_password output, without paying for scrypt
+    digest = hashlib.blake2b(str(i).encode(), digest_size=48).digest()
+    return 'scrypt$16384$8$1${}${}'.format(
+        base64.b64encode(digest[:16]).decode(), base64.b64encode(digest[16:]).decode()
+    )
+
+
+def fill(database, users, chunk=100000):
+    MigrationRunner(database).migrate()
+    conn = connect(database)
+    conn.execute('PRAGMA synchronous=OFF')
+    for start in range(1, users + 1, chunk):
+        conn.execute('BEGIN')
+        conn.executemany(
+            'INSERT INTO users (user_id, username, email, password, goal, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+            ((i, f'user{i}', f'user{i}@example.com', password(i), '150 minutes per week', 1700000000 + i)
+             for i in range(start, min(start + chunk, users + 1))),
+        )
+        conn.execute('COMMIT')
+    conn.close()
+
+
+def timed(label, rows, fn):
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    print(f'{label:<28} {rows:>10} rows {elapsed:8.1f}s {rows / elapsed:>10.0f} rows/s')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=10_000_000)
+    parser.add_argument('--format', choices=['parquet', 'ndjson.gz', 'ndjson'], default='parquet')
+    parser.add_argument('--chunk', type=int, default=50000)
+    parser.add_argument('--target', help='empty PostgreSQL database to import into instead of SQLite')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source, path = os.path.join(tmp, 'source.db'), os.path.join(tmp, f'users.{args.format}')
+        timed('fill source (executemany)', args.users, lambda: fill(source, args.users))
+
+        store, _ = open_store(source)
+        with open_writer(path, FIELDS) as writer:
+            timed(f'export to {args.format}', args.users, lambda: export_users({'users': store}, writer, args.chunk))
+        store.close()
+        print(f'file size {os.path.getsize(path) / 2 ** 20:.1f} MiB')
+
+        target = args.target or os.path.join(tmp, 'target.db')
+        store, runner = open_store(target)
+        runner.migrate()
+        store.close()
+        loader = BulkLoader(target)
+        loader.defer_index()
+        with open_reader(path, FIELDS, args.chunk) as reader:
+            imported = timed(f'import from {args.format}', args.users,
+                             lambda: import_users({'users': loader}, reader, sharded=False))
+        timed('build deferred index', args.users, loader.finish)
+        loader.close()
+        assert imported == args.users, imported
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Compare the pooled/WAL repository against a connection per call.
+
+Usage: python benchmarks/storage_benchmark.py [--threads 10] [--requests 5000]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent import futures
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from migrations import MigrationRunner  # noqa: E402
+from repository import UserRepository  # noqa: E402
+
+
+class PerCallRepository:
+    """The original access pattern: open, run one statement, close."""
+
+    def __init__(self, database):
+        self.database = database
+        MigrationRunner(database).migrate()
+
+    def create_user(self, username, email, password, goal):
+        conn = sqlite3.connect(self.database, timeout=30)
+        cursor = conn.cursor()
+        cursor.execute(
+            'INSERT INTO users (username, email, password, goal) VALUES (?, ?, ?, ?)',
+            (username, email, password, goal),
+        )
+        conn.commit()
+        user_id = cursor.lastrowid
+        conn.close()
+        return user_id
+
+    def get_goal(self, user_id):
+        conn = sqlite3.connect(self.database, timeout=30)
+        cursor = conn.cursor()
+        cursor.execute('SELECT goal FROM users WHERE user_id = ?', (user_id,))
+        row = cursor.fetchone()
+        conn.close()
+        return row[0] if row else None
+
+    def close(self):
+        pass
+
+
+def run(repo, threads, requests, read_ratio):
+    latencies = []
+
+    def call(i):
+        start = time.perf_counter()
+        if i % 100 < read_ratio * 100:
+            repo.get_goal(str(i % 1000 + 1))
+        else:
+            repo.create_user(f'user{i}', f'user{i}@example.com', 'secret', 'strength')
+        latencies.append(time.perf_counter() - start)
+
+    # Seed some rows so reads have something to find
+    for i in range(1000):
+        repo.create_user(f'seed{i}', f'seed{i}@example.com', 'secret', 'cardio')
+
+    start = time.perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(call, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    return requests / elapsed, p50, p99
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--read-ratio', type=float, default=0.8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pooled = os.path.join(tmp, 'pooled.db')
+        MigrationRunner(pooled).migrate()
+        backends = [
+            ('per-call connect', PerCallRepository(os.path.join(tmp, 'per_call.db'))),
+            ('pooled WAL', UserRepository(pooled, pool_size=args.threads)),
+        ]
+        for name, repo in backends:
+            rps, p50, p99 = run(repo, args.threads, args.requests, args.read_ratio)
+            repo.close()
+            print(f'{name:<18} {rps:>10.0f} req/s   p50 {p50:6.2f} ms   p99 {p99:6.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""GetUserGoal throughput with the service run as 1, 2, 4 and 8 worker processes.
+
+Starts src/launcher.py with GRPC_WORKERS set for each step, waits for
+/ready, drives it from several client processes and stops it again:
+    python benchmarks/workers_benchmark.py --workers 1,2,4,8
+Redis must be reachable as for a normal run. Scaling flattens once the
+workers (plus the client processes) exceed the machine's cores.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import grpc
+
+SRC = os.path.join(os.path.dirname(__file__), '..', 'src')
+sys.path.insert(0, SRC)
+
+import user_service_pb2  # noqa: E402
+import user_service_pb2_grpc  # noqa: E402
+
+
+def client(target, concurrency, duration, user_ids, counter):
+    async def run():
+        # A channel per client process so connections spread across the workers
+        async with grpc.aio.insecure_channel(target) as channel:
+            stub = user_service_pb2_grpc.UserServiceStub(channel)
+            deadline = time.perf_counter() + duration
+            done = 0
+
+            async def stream(worker):
+                nonlocal done
+                i = worker
+                while time.perf_counter() < deadline:
+                    request = user_service_pb2.GoalRequest(user_id=user_ids[i % len(user_ids)])
+                    try:
+                        await stub.GetUserGoal(request, timeout=10)
+                        done += 1
+                    except grpc.aio.AioRpcError:
+                        pass
+                    i += concurrency
+
+            await asyncio.gather(*(stream(worker) for worker in range(concurrency)))
+            with counter.get_lock():
+                counter.value += done
+
+    asyncio.run(run())
+
+
+def wait_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    raise RuntimeError(f'service not ready at {url} after {timeout}s')
+
+
+def seed(target, users):
+    with grpc.insecure_channel(target) as channel:
+        stub = user_service_pb2_grpc.UserServiceStub(channel)
+        stamp = int(time.time())
+        reply = stub.BatchRegisterUsers(
+            user_service_pb2.UserRequest(
+                username=f'bench{stamp}-{i}', email=f'bench{stamp}-{i}@example.com',
+                password='secret', goal='endurance'
+            )
+            for i in range(users)
+        )
+    return [r.user_id for r in reply.results if r.user_id]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--app', default=os.path.join(SRC, 'app.py'))
+    parser.add_argument('--workers', default='1,2,4,8')
+    parser.add_argument('--clients', type=int, default=4, help='client processes')
+    parser.add_argument('--concurrency', type=int, default=50, help='in-flight RPCs per client')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--users', type=int, default=1000)
+    args = parser.parse_args()
+
+    for workers in [int(w) for w in args.workers.split(',')]:
+        launcher = subprocess.Popen(
+            [sys.executable, os.path.join(SRC, 'launcher.py'), args.app],
+            env=dict(os.environ, GRPC_WORKERS=str(workers)),
+        )
+        try:
+            wait_ready('http://localhost:5000/ready')
+            # Every worker must be listening before the clients connect
+            time.sleep(1 + workers * 0.5)
+            user_ids = seed('localhost:50051', args.users)
+            counter = multiprocessing.Value('q', 0)
+            clients = [
+                multiprocessing.Process(
+                    target=client,
+                    args=('localhost:50051', args.concurrency, args.duration, user_ids, counter),
+                )
+                for _ in range(args.clients)
+            ]
+            for process in clients:
+                process.start()
+            for process in clients:
+                process.join()
+            print(f'{workers:>2} workers  {counter.value / args.duration:>9.0f} req/s')
+        finally:
+            launcher.send_signal(signal.SIGTERM)
+            launcher.wait()
+
+
+if __name__ == '__main__':
+    main()
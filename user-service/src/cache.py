@@ -0,0 +1,373 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+import redis
+
+from metrics import DEPENDENCY_SECONDS, timed
+
+# Cached values carry a one-character tag so a NOT_FOUND marker can never
+# collide with a real goal string.
+FOUND = 'g'
+NOT_FOUND = 'n'
+
+
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {
+            'hits': 0,
+            'negative_hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'db_loads': 0,
+            'errors': 0,
+        }
+        self._latency = {'hit': [0, 0.0], 'miss': [0, 0.0]}
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def observe(self, kind, seconds):
+        with self._lock:
+            entry = self._latency[kind]
+            entry[0] += 1
+            entry[1] += seconds
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self._counters)
+            for kind, (count, total) in self._latency.items():
+                data[f'{kind}_count'] = count
+                data[f'{kind}_avg_ms'] = (total / count * 1000) if count else 0.0
+        lookups = data['hits'] + data['negative_hits'] + data['misses']
+        data['hit_ratio'] = (data['hits'] + data['negative_hits']) / lookups if lookups else 0.0
+        return data
+
+
+class GoalCache:
+    """Read-through Redis cache for user goals.
+
+    Misses are coalesced twice: concurrent lookups of the same key inside this
+    process share one load, and across replicas a short Redis lock lets only
+    one loader hit the database while the others wait for it to fill the key.
+    Any Redis failure falls back to reading the database directly.
+    """
+
+    def __init__(self, redis_client, loader, many_loader=None, ttl=300,
+                 negative_ttl=30, lock_ttl=2.0, lock_wait=0.5, stats=None):
+        self._redis = redis_client
+        self._loader = loader
+        self._many_loader = many_loader
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._lock_ttl_ms = int(lock_ttl * 1000)
+        self._lock_wait = lock_wait
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self.stats = stats or CacheStats()
+
+    @staticmethod
+    def _key(user_id):
+        return f'user_goal:{user_id}'
+
+    def get(self, user_id):
+        # Returns the goal, or None when the user does not exist
+        start = time.perf_counter()
+        key = self._key(user_id)
+        cached = self._read(key)
+        if cached is not None:
+            tag, goal = cached[0], cached[1:]
+            if tag == FOUND:
+                self.stats.incr('hits')
+                self.stats.observe('hit', time.perf_counter() - start)
+                return goal
+            self.stats.incr('negative_hits')
+            self.stats.observe('hit', time.perf_counter() - start)
+            return None
+
+        self.stats.incr('misses')
+        goal = self._load_once(user_id, key)
+        self.stats.observe('miss', time.perf_counter() - start)
+        return goal
+
+    def get_many(self, user_ids):
+        # Returns {user_id: goal or None}; misses are resolved with one
+        # many_loader call and written back in a single pipeline.
+        start = time.perf_counter()
+        user_ids = list(dict.fromkeys(user_ids))
+        keys = [self._key(user_id) for user_id in user_ids]
+        try:
+            with DEPENDENCY_SECONDS.time('redis', 'mget'):
+                values = self._redis.mget(keys) if keys else []
+        except redis.RedisError as e:
+            self.stats.incr('errors')
+            logging.warning("Goal cache mget failed: %s", e)
+            values = [None] * len(keys)
+
+        goals = {}
+        missing = []
+        for user_id, value in zip(user_ids, values):
+            if value is None:
+                missing.append(user_id)
+                continue
+            value = value.decode()
+            if value[0] == FOUND:
+                self.stats.incr('hits')
+                goals[user_id] = value[1:]
+            else:
+                self.stats.incr('negative_hits')
+                goals[user_id] = None
+
+        if missing:
+            self.stats.incr('misses', len(missing))
+            self.stats.incr('db_loads')
+            loaded = self._many_loader(missing)
+            fresh = {user_id: loaded.get(user_id) for user_id in missing}
+            self.set_many(fresh, only_if_absent=True)
+            goals.update(fresh)
+
+        self.stats.observe('miss' if missing else 'hit', time.perf_counter() - start)
+        return goals
+
+    @timed('redis', 'pipeline')
+    def set_many(self, goals, only_if_absent=False):
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            for user_id, goal in goals.items():
+                value, ttl = self._encode(goal)
+                pipe.set(self._key(user_id), value, ex=ttl, nx=only_if_absent)
+            pipe.execute()
+        except redis.RedisError as e:
+            self.stats.incr('errors')
+            logging.warning("Goal cache pipeline write failed: %s", e)
+
+    def set(self, user_id, goal):
+        # Write-through after a goal mutation; also replaces a NOT_FOUND marker
+        self._write(self._key(user_id), goal)
+
+    def invalidate(self, user_id):
+        try:
+            self._redis.delete(self._key(user_id))
+        except redis.RedisError as e:
+            self.stats.incr('errors')
+            logging.warning("Failed to invalidate goal cache for user ID %s: %s", user_id, e)
+
+    def _load_once(self, user_id, key):
+        with self._inflight_lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = Future()
+        if not leader:
+            self.stats.incr('coalesced')
+            return call.result()
+
+        try:
+            goal = self._load_locked(user_id, key)
+            call.set_result(goal)
+            return goal
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+
+    def _load_locked(self, user_id, key):
+        lock_key = f'lock:{key}'
+        try:
+            acquired = bool(self._redis.set(lock_key, 1, nx=True, px=self._lock_ttl_ms))
+            contended = not acquired
+        except redis.RedisError:
+            acquired = contended = False
+
+        if contended:
+            # Another replica is loading this key; wait briefly for it
+            deadline = time.monotonic() + self._lock_wait
+            while time.monotonic() < deadline:
+                time.sleep(0.01)
+                cached = self._read(key)
+                if cached is not None:
+                    self.stats.incr('coalesced')
+                    return cached[1:] if cached[0] == FOUND else None
+
+        self.stats.incr('db_loads')
+        goal = self._loader(user_id)
+        # nx so a concurrent write-through is never overwritten by this load
+        self._write(key, goal, only_if_absent=True)
+        if acquired:
+            try:
+                self._redis.delete(lock_key)
+            except redis.RedisError:
+                pass
+        return goal
+
+    @timed('redis', 'get')
+    def _read(self, key):
+        try:
+            value = self._redis.get(key)
+        except redis.RedisError as e:
+            self.stats.incr('errors')
+            logging.warning("Goal cache read failed for %s: %s", key, e)
+            return None
+        return value.decode() if value is not None else None
+
+    def _encode(self, goal):
+        if goal is None:
+            return NOT_FOUND, self._negative_ttl
+        return FOUND + goal, self._ttl
+
+    @timed('redis', 'set')
+    def _write(self, key, goal, only_if_absent=False):
+        value, ttl = self._encode(goal)
+        try:
+            self._redis.set(key, value, ex=ttl, nx=only_if_absent)
+        except redis.RedisError as e:
+            self.stats.incr('errors')
+            logging.warning("Goal cache write failed for %s: %s", key, e)
+
+
+class AsyncGoalCache(GoalCache):
+    """GoalCache for the grpc.aio server, on a redis.asyncio client.
+
+    loader and many_loader must be coroutine functions. In-process
+    single-flight uses asyncio futures instead of threads.
+    """
+
+    async def get(self, user_id):
+        start = time.perf_counter()
+        key = self._key(user_id)
+        cached = await self._read(key)
+        if cached is not None:
+            self.stats.incr('hits' if cached[0] == FOUND else 'negative_hits')
+            self.stats.observe('hit', time.perf_counter() - start)
+            return cached[1:] if cached[0] == FOUND else None
+
+        self.stats.incr('misses')
+        goal = await self._load_once(user_id, key)
+        self.stats.observe('miss', time.perf_counter() - start)
+        return goal
+
+    async def get_many(self, user_ids):
+        start = time.perf_counter()
+        user_ids = list(dict.fromkeys(user_ids))
+        keys = [self._key(user_id) for user_id in user_ids]
+        try:
+            with DEPENDENCY_SECONDS.time('redis', 'mget'):
+                values = await self._redis.mget(keys) if keys else []
+        except redis.RedisError as e:
+            self.stats.incr('errors')
+            logging.warning("Goal cache mget failed: %s", e)
+            values = [None] * len(keys)
+
+        goals = {}
+        missing = []
+        for user_id, value in zip(user_ids, values):
+            if value is None:
+                missing.append(user_id)
+                continue
+            value = value.decode()
+            self.stats.incr('hits' if value[0] == FOUND else 'negative_hits')
+            goals[user_id] = value[1:] if value[0] == FOUND else None
+
+        if missing:
+            self.stats.incr('misses', len(missing))
+            self.stats.incr('db_loads')
+            loaded = await self._many_loader(missing)
+            fresh = {user_id: loaded.get(user_id) for user_id in missing}
+            await self.set_many(fresh, only_if_absent=True)
+            goals.update(fresh)
+
+        self.stats.observe('miss' if missing else 'hit', time.perf_counter() - start)
+        return goals
+
+    @timed('redis', 'pipeline')
+    async def set_many(self, goals, only_if_absent=False):
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            for user_id, goal in goals.items():
+                value, ttl = self._encode(goal)
+                pipe.set(self._key(user_id), value, ex=ttl, nx=only_if_absent)
+            await pipe.execute()
+        except redis.RedisError as e:
+            self.stats.incr('errors')
+            logging.warning("Goal cache pipeline write failed: %s", e)
+
+    async def set(self, user_id, goal):
+        await self._write(self._key(user_id), goal)
+
+    async def invalidate(self, user_id):
+        try:
+            await self._redis.delete(self._key(user_id))
+        except redis.RedisError as e:
+            self.stats.incr('errors')
+            logging.warning("Failed to invalidate goal cache for user ID %s: %s", user_id, e)
+
+    async def _load_once(self, user_id, key):
+        call = self._inflight.get(key)
+        if call is not None:
+            self.stats.incr('coalesced')
+            return await asyncio.shield(call)
+
+        call = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            goal = await self._load_locked(user_id, key)
+            call.set_result(goal)
+            return goal
+        except BaseException as e:
+            call.set_exception(e)
+            # Consume the exception so it is not reported when nobody waited
+            call.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _load_locked(self, user_id, key):
+        lock_key = f'lock:{key}'
+        try:
+            acquired = bool(await self._redis.set(lock_key, 1, nx=True, px=self._lock_ttl_ms))
+            contended = not acquired
+        except redis.RedisError:
+            acquired = contended = False
+
+        if contended:
+            deadline = time.monotonic() + self._lock_wait
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+                cached = await self._read(key)
+                if cached is not None:
+                    self.stats.incr('coalesced')
+                    return cached[1:] if cached[0] == FOUND else None
+
+        self.stats.incr('db_loads')
+        goal = await self._loader(user_id)
+        await self._write(key, goal, only_if_absent=True)
+        if acquired:
+            try:
+                await self._redis.delete(lock_key)
+            except redis.RedisError:
+                pass
+        return goal
+
+    @timed('redis', 'get')
+    async def _read(self, key):
+        try:
+            value = await self._redis.get(key)
+        except redis.RedisError as e:
+            self.stats.incr('errors')
+            logging.warning("Goal cache read failed for %s: %s", key, e)
+            return None
+        return value.decode() if value is not None else None
+
+    @timed('redis', 'set')
+    async def _write(self, key, goal, only_if_absent=False):
+        value, ttl = self._encode(goal)
+        try:
+            await self._redis.set(key, value, ex=ttl, nx=only_if_absent)
+        except redis.RedisError as e:
+            self.stats.incr('errors')
+            logging.warning("Goal cache write failed for %s: %s", key, e)
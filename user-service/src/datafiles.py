@@ -0,0 +1,124 @@
+import gzip
+import json
+from datetime import datetime
+
+# Snapshot files hold the rows of one table, as a fixed list of
+# (name, type) fields with type one of:
+#   'int', 'float', 'str', 'bool', 'time' (UTC datetime), 'strs' (list of str)
+# Any field may be None. The format follows the file name: '.parquet' is
+# Parquet (zstd compressed, one row group per chunk), '.ndjson' and
+# '.ndjson.gz' are one JSON object per line. Both are written and read a
+# chunk at a time, so neither side ever holds the whole table.
+
+
+def arrow_type(pa, kind):
+    return {
+        'int': pa.int64(),
+        'float': pa.float64(),
+        'str': pa.string(),
+        'bool': pa.bool_(),
+        'time': pa.timestamp('ms', tz='UTC'),
+        'strs': pa.list_(pa.string()),
+    }[kind]
+
+
+def to_json(kind, value):
+    return value.isoformat() if kind == 'time' and value is not None else value
+
+
+def from_json(kind, value):
+    return datetime.fromisoformat(value) if kind == 'time' and value is not None else value
+
+
+class _File:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ParquetWriter(_File):
+    def __init__(self, path, fields):
+        # pyarrow is only needed for Parquet files
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self._pa = pa
+        self._schema = pa.schema([(name, arrow_type(pa, kind)) for name, kind in fields])
+        self._writer = pq.ParquetWriter(path, self._schema, compression='zstd')
+
+    def write(self, rows):
+        columns = zip(*rows) if rows else [[] for _ in self._schema]
+        arrays = [self._pa.array(column, type=field.type) for column, field in zip(columns, self._schema)]
+        self._writer.write_table(self._pa.Table.from_arrays(arrays, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+class ParquetReader(_File):
+    def __init__(self, path, fields, chunk_size):
+        import pyarrow.parquet as pq
+        self._file = pq.ParquetFile(path)
+        self._names = [name for name, _ in fields]
+        self._chunk_size = chunk_size
+
+    def __iter__(self):
+        # Yields lists of row tuples in field order
+        for batch in self._file.iter_batches(batch_size=self._chunk_size, columns=self._names):
+            yield list(zip(*(column.to_pylist() for column in batch.columns)))
+
+    def close(self):
+        self._file.close()
+
+
+class NdjsonWriter(_File):
+    def __init__(self, path, fields):
+        self._fields = fields
+        self._file = gzip.open(path, 'wt', compresslevel=6) if path.endswith('.gz') else open(path, 'w')
+
+    def write(self, rows):
+        self._file.write(''.join(
+            json.dumps({name: to_json(kind, value) for (name, kind), value in zip(self._fields, row)}) + '\n'
+            for row in rows
+        ))
+
+    def close(self):
+        self._file.close()
+
+
+class NdjsonReader(_File):
+    def __init__(self, path, fields, chunk_size):
+        self._fields = fields
+        self._chunk_size = chunk_size
+        self._file = gzip.open(path, 'rt') if path.endswith('.gz') else open(path)
+
+    def __iter__(self):
+        rows = []
+        for line in self._file:
+            record = json.loads(line)
+            rows.append(tuple(from_json(kind, record.get(name)) for name, kind in self._fields))
+            if len(rows) == self._chunk_size:
+                yield rows
+                rows = []
+        if rows:
+            yield rows
+
+    def close(self):
+        self._file.close()
+
+
+def is_parquet(path):
+    if path.endswith('.parquet'):
+        return True
+    if path.endswith(('.ndjson', '.ndjson.gz', '.jsonl', '.jsonl.gz')):
+        return False
+    raise ValueError(f'Unknown snapshot format for {path}: use .parquet, .ndjson or .ndjson.gz')
+
+
+def open_writer(path, fields):
+    return ParquetWriter(path, fields) if is_parquet(path) else NdjsonWriter(path, fields)
+
+
+def open_reader(path, fields, chunk_size=50000):
+    return ParquetReader(path, fields, chunk_size) if is_parquet(path) else NdjsonReader(path, fields, chunk_size)
@@ -0,0 +1,159 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import time
+import uuid
+
+import redis
+
+from metrics import timed
+
+# Outcome of each RPC sent with an idempotency-key, per method and key:
+#   idempotency:<method>:<key>  string, JSON
+#     {"state": "pending", "owner"}  while the first attempt runs
+#     {"state": "done", "fingerprint", "code", "details", "response"}
+# Only outcomes a retry would repeat are stored; for the rest (UNAVAILABLE,
+# RESOURCE_EXHAUSTED, ...) the pending marker is dropped so the retry runs.
+KEY_PREFIX = 'idempotency:'
+FINAL_CODES = frozenset((
+    'OK', 'INVALID_ARGUMENT', 'NOT_FOUND', 'ALREADY_EXISTS',
+    'PERMISSION_DENIED', 'FAILED_PRECONDITION', 'OUT_OF_RANGE',
+))
+# Deletes the pending marker only if this attempt still owns it
+RELEASE_SCRIPT = '''
+local record = redis.call('GET', KEYS[1])
+if record and cjson.decode(record)['owner'] == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+'''
+# Stores the outcome unless another attempt has taken the key over, after
+# this attempt's marker expired, or already stored its own outcome
+FINISH_SCRIPT = '''
+local record = redis.call('GET', KEYS[1])
+if record and cjson.decode(record)['owner'] ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+'''
+
+
+def idempotency_key(method, key):
+    return f'{KEY_PREFIX}{method.rsplit("/", 1)[-1]}:{key}'
+
+
+def fingerprint(request):
+    # Identifies the request a key was first used with
+    return hashlib.sha256(request.SerializeToString(deterministic=True)).hexdigest()[:32]
+
+
+def done_record(request_fingerprint, code, details, response):
+    return json.dumps({
+        'state': 'done', 'fingerprint': request_fingerprint, 'code': code, 'details': details,
+        'response': None if response is None else base64.b64encode(response).decode(),
+    })
+
+
+def response_bytes(record):
+    return None if record['response'] is None else base64.b64decode(record['response'])
+
+
+class IdempotencyCache:
+    """Recent outcomes of RPCs sent with an idempotency key, in Redis.
+
+    begin() claims a key with a pending marker for pending_ttl seconds, so
+    a retry that lands on another replica while the first attempt runs
+    waits for its outcome (up to wait seconds) instead of running the write
+    again. An attempt only stores its outcome while it still holds the key,
+    so one outliving its marker cannot overwrite a retry's. Outcomes are
+    kept for ttl seconds. Without Redis the RPC simply runs, as it would
+    without a key.
+    """
+
+    def __init__(self, redis_client, ttl=86400, pending_ttl=30, wait=2.0, poll_interval=0.05):
+        self._redis = redis_client
+        self._release = redis_client.register_script(RELEASE_SCRIPT)
+        self._finish = redis_client.register_script(FINISH_SCRIPT)
+        self._ttl = ttl
+        self._pending_ttl = pending_ttl
+        self._wait = wait
+        self._poll_interval = poll_interval
+
+    @timed('redis', 'idempotency_begin')
+    def begin(self, method, key):
+        # Returns (owner, None) when this attempt should run, or (None, record)
+        # with a previous attempt's outcome; record is None if it is still running
+        owner = uuid.uuid4().hex
+        name = idempotency_key(method, key)
+        pending = json.dumps({'state': 'pending', 'owner': owner})
+        deadline = time.monotonic() + self._wait
+        try:
+            while True:
+                if self._redis.set(name, pending, nx=True, ex=self._pending_ttl):
+                    return owner, None
+                record = self._redis.get(name)
+                if record is not None and json.loads(record)['state'] == 'done':
+                    return None, json.loads(record)
+                if time.monotonic() >= deadline:
+                    return None, None
+                time.sleep(self._poll_interval)
+        except redis.RedisError as e:
+            logging.warning("Idempotency cache unavailable, running %s without it: %s", method, e)
+            return owner, None
+
+    @timed('redis', 'idempotency_finish')
+    def finish(self, method, key, owner, request_fingerprint, code, details, response):
+        name = idempotency_key(method, key)
+        try:
+            if code in FINAL_CODES:
+                record = done_record(request_fingerprint, code, details, response)
+                if not self._finish(keys=[name], args=[owner, record, self._ttl]):
+                    self._log_taken_over(method, key)
+            else:
+                self._release(keys=[name], args=[owner])
+        except redis.RedisError as e:
+            logging.warning("Failed to store the outcome of %s for idempotency key %s: %s", method, key, e)
+
+    @staticmethod
+    def _log_taken_over(method, key):
+        logging.warning("Outcome of %s not stored: idempotency key %s was taken over by a retry", method, key)
+
+
+class AsyncIdempotencyCache(IdempotencyCache):
+    """IdempotencyCache on a redis.asyncio client."""
+
+    @timed('redis', 'idempotency_begin')
+    async def begin(self, method, key):
+        owner = uuid.uuid4().hex
+        name = idempotency_key(method, key)
+        pending = json.dumps({'state': 'pending', 'owner': owner})
+        deadline = time.monotonic() + self._wait
+        try:
+            while True:
+                if await self._redis.set(name, pending, nx=True, ex=self._pending_ttl):
+                    return owner, None
+                record = await self._redis.get(name)
+                if record is not None and json.loads(record)['state'] == 'done':
+                    return None, json.loads(record)
+                if time.monotonic() >= deadline:
+                    return None, None
+                await asyncio.sleep(self._poll_interval)
+        except redis.RedisError as e:
+            logging.warning("Idempotency cache unavailable, running %s without it: %s", method, e)
+            return owner, None
+
+    @timed('redis', 'idempotency_finish')
+    async def finish(self, method, key, owner, request_fingerprint, code, details, response):
+        name = idempotency_key(method, key)
+        try:
+            if code in FINAL_CODES:
+                record = done_record(request_fingerprint, code, details, response)
+                if not await self._finish(keys=[name], args=[owner, record, self._ttl]):
+                    self._log_taken_over(method, key)
+            else:
+                await self._release(keys=[name], args=[owner])
+        except redis.RedisError as e:
+            logging.warning("Failed to store the outcome of %s for idempotency key %s: %s", method, key, e)
@@ -0,0 +1,111 @@
+"""Pre-fork launcher: runs the service as several worker processes.
+
+    GRPC_WORKERS=4 python src/launcher.py src/app.py
+
+Each worker is a fresh interpreter running the given script with
+WORKER_INDEX set, so database, Redis and gRPC clients are all created after
+the fork and nothing is shared between workers. The workers bind the same
+gRPC and HTTP ports with SO_REUSEPORT and the kernel spreads connections
+across them. A worker that dies is restarted with exponential backoff; on
+SIGTERM/SIGINT the signal is forwarded and the workers drain before the
+launcher exits.
+"""
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+
+GRPC_WORKERS = int(os.environ.get('GRPC_WORKERS', '1'))
+# Time workers get to drain after the signal is forwarded, before they are killed
+WORKER_STOP_TIMEOUT = float(os.environ.get('WORKER_STOP_TIMEOUT', '15'))
+
+RESTART_BACKOFF = 1.0
+MAX_RESTART_BACKOFF = 30.0
+# A worker that stayed up this long has its restart backoff reset
+HEALTHY_UPTIME = 60.0
+
+
+class Worker:
+    def __init__(self, index, argv):
+        self.index = index
+        self.argv = argv
+        self.process = None
+        self.started = 0.0
+        self.backoff = RESTART_BACKOFF
+        self.restart_at = 0.0
+
+    def start(self):
+        env = dict(os.environ, WORKER_INDEX=str(self.index))
+        self.process = subprocess.Popen(self.argv, env=env)
+        self.started = time.monotonic()
+        logging.info('Started worker %s (pid %s)', self.index, self.process.pid)
+
+    def exited(self):
+        # Returns the exit code once the worker has died, else None
+        if self.process is None:
+            return None
+        return self.process.poll()
+
+
+class Supervisor:
+    def __init__(self, argv, workers, stop_timeout=WORKER_STOP_TIMEOUT):
+        self._workers = [Worker(index, argv) for index in range(workers)]
+        self._stop_timeout = stop_timeout
+        self._stopping = False
+
+    def run(self):
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, self._on_signal)
+        for worker in self._workers:
+            worker.start()
+        while not self._stopping:
+            self._supervise()
+            time.sleep(0.2)
+        return self._stop()
+
+    def _on_signal(self, signum, frame):
+        logging.info('Received signal %s, stopping workers', signum)
+        self._stopping = True
+
+    def _supervise(self):
+        now = time.monotonic()
+        for worker in self._workers:
+            if worker.process is None:
+                if now >= worker.restart_at:
+                    worker.start()
+                continue
+            code = worker.exited()
+            if code is None:
+                continue
+            if now - worker.started >= HEALTHY_UPTIME:
+                worker.backoff = RESTART_BACKOFF
+            logging.warning('Worker %s (pid %s) exited with %s, restarting in %.0fs',
+                            worker.index, worker.process.pid, code, worker.backoff)
+            worker.process = None
+            worker.restart_at = now + worker.backoff
+            worker.backoff = min(worker.backoff * 2, MAX_RESTART_BACKOFF)
+
+    def _stop(self):
+        running = [w.process for w in self._workers if w.process is not None and w.process.poll() is None]
+        for process in running:
+            process.send_signal(signal.SIGTERM)
+        deadline = time.monotonic() + self._stop_timeout
+        for process in running:
+            try:
+                process.wait(timeout=max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                logging.warning('Worker pid %s did not stop in time, killing it', process.pid)
+                process.kill()
+                process.wait()
+        logging.info('All workers stopped')
+        return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s launcher %(levelname)s %(message)s')
+    if len(sys.argv) < 2:
+        sys.exit('usage: launcher.py <app.py> [args...]')
+    argv = [sys.executable] + sys.argv[1:]
+    sys.exit(Supervisor(argv, GRPC_WORKERS).run())
@@ -0,0 +1,351 @@
+import fcntl
+import logging
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from repository import connect
+
+# Each migration's statements run in one transaction together with its row in
+# schema_migrations, so a database is always at exactly one version. Work
+# that touches every row is a backfill instead: it runs after startup, in
+# short chunks through the normal write path, while the service is serving.
+# statements maps each storage backend to its dialect of the migration.
+Migration = namedtuple('Migration', 'version name statements backfill')
+
+MIGRATIONS = [
+    Migration(1, 'create_users', {
+        'sqlite': ['''CREATE TABLE users (
+            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE,
+            email TEXT NOT NULL UNIQUE,
+            password TEXT NOT NULL,
+            goal TEXT
+        )'''],
+        'postgres': ['''CREATE TABLE users (
+            user_id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            username TEXT NOT NULL UNIQUE,
+            email TEXT NOT NULL UNIQUE,
+            password TEXT NOT NULL,
+            goal TEXT
+        )'''],
+    }, None),
+    # Unix time; NULL for users registered before this migration
+    Migration(2, 'users_created_at', {
+        'sqlite': ['ALTER TABLE users ADD COLUMN created_at INTEGER'],
+        'postgres': ['ALTER TABLE users ADD COLUMN created_at BIGINT'],
+    }, None),
+    # VerifyPassword looks users up by username for their id and hash; with
+    # both in the index the lookup never touches the table
+    Migration(3, 'users_credentials_index', {
+        'sqlite': ['CREATE INDEX users_credentials ON users (username, password)'],
+        'postgres': ['CREATE INDEX users_credentials ON users (username) INCLUDE (password)'],
+    }, None),
+    # Rows from before password hashing still hold the plain password
+    Migration(4, 'hash_plaintext_passwords', {}, 'hash_plaintext_passwords'),
+    # Sharded storage (sharding.py) claims each username and email here, on
+    # the shard that owns the name, since UNIQUE only holds within one shard
+    Migration(5, 'user_names', {
+        'sqlite': ['''CREATE TABLE user_names (
+            name TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            created_at INTEGER NOT NULL
+        ) WITHOUT ROWID'''],
+        'postgres': ['''CREATE TABLE user_names (
+            name TEXT PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            created_at BIGINT NOT NULL
+        )'''],
+    }, None),
+]
+
+SQLITE_SQL = {
+    'create': '''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at INTEGER NOT NULL,
+            backfilled_at INTEGER
+        )
+    ''',
+    'insert': '''
+        INSERT INTO schema_migrations (version, name, applied_at)
+        VALUES (?, ?, CAST(strftime('%s', 'now') AS INTEGER))
+    ''',
+    'backfilled': '''
+        UPDATE schema_migrations SET backfilled_at = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE version = ?
+    ''',
+    'select': 'SELECT version, backfilled_at FROM schema_migrations',
+}
+POSTGRES_SQL = {
+    'create': '''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at BIGINT NOT NULL,
+            backfilled_at BIGINT
+        )
+    ''',
+    'insert': '''
+        INSERT INTO schema_migrations (version, name, applied_at)
+        VALUES (%s, %s, EXTRACT(EPOCH FROM now())::BIGINT)
+    ''',
+    'backfilled': '''
+        UPDATE schema_migrations SET backfilled_at = EXTRACT(EPOCH FROM now())::BIGINT
+        WHERE version = %s
+    ''',
+    'select': 'SELECT version, backfilled_at FROM schema_migrations',
+}
+# pg_advisory_lock keys, shared by every replica using the database
+POSTGRES_MIGRATE_LOCK = 0x75736572
+POSTGRES_BACKFILL_LOCK = 0x75736573
+
+
+class MigrationError(Exception):
+    """Raised when the database cannot be brought to the current schema."""
+
+
+@contextmanager
+def file_lock(path, blocking=True):
+    # Yields whether the lock was taken
+    with open(path, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def table_columns(conn, table):
+    return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+
+class MigrationRunner:
+    """Brings the SQLite database to the latest version of MIGRATIONS.
+
+    Every worker process calls migrate() at startup; the first one takes the
+    lock and applies what is missing, the others wait for it and then find
+    nothing to do. Backfills are named in MIGRATIONS and implemented by the
+    service: start_backfills() maps each name to a function (after, limit)
+    that processes up to limit rows with keys above after, in key order, and
+    returns the last key it processed, or None when none are left.
+    """
+
+    backend = 'sqlite'
+    sql = SQLITE_SQL
+
+    def __init__(self, database, migrations=MIGRATIONS):
+        self.database = database
+        self._backfills = {}
+        self._migrations = migrations
+        self._lock_path = database + '.migrate.lock'
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def migrate(self):
+        with self._migration_session() as conn:
+            conn.execute(self.sql['create'])
+            applied = self._applied(conn)
+            if not applied:
+                applied = self._baseline(conn)
+            for migration in self._migrations:
+                if migration.version not in applied:
+                    self._apply(conn, migration)
+
+    def status(self):
+        with self._connection() as conn:
+            applied = self._applied(conn)
+        return {
+            'version': max(applied, default=0),
+            'pending_backfills': [m.name for m in self._pending_backfills(applied)],
+        }
+
+    def start_backfills(self, backfills, chunk_size=500, pause=0.1):
+        self._backfills = backfills
+        self._thread = threading.Thread(
+            target=self._run_backfills, args=(chunk_size, pause), name='migration-backfill', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    @contextmanager
+    def _connection(self):
+        conn = connect(self.database)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _migration_session(self):
+        with file_lock(self._lock_path), self._connection() as conn:
+            yield conn
+
+    @contextmanager
+    def _backfill_session(self):
+        # Yields a connection, or None when another process runs the backfills
+        with file_lock(self._lock_path + '.backfill', blocking=False) as locked:
+            if not locked:
+                yield None
+                return
+            with self._connection() as conn:
+                yield conn
+
+    @contextmanager
+    def _transaction(self, conn):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _applied(self, conn):
+        return dict(conn.execute(self.sql['select']).fetchall())
+
+    def _pending_backfills(self, applied):
+        return [
+            m for m in self._migrations
+            if m.backfill is not None and m.version in applied and applied[m.version] is None
+        ]
+
+    def _baseline(self, conn):
+        # Databases created before migrations have the version 1 table already
+        columns = table_columns(conn, 'users')
+        if not columns:
+            return {}
+        if not {'user_id', 'username', 'email', 'password', 'goal'} <= columns:
+            raise MigrationError(f'users table in {self.database} has an unknown schema: {sorted(columns)}')
+        conn.execute(self.sql['insert'], (1, self._migrations[0].name))
+        logging.info("Recorded existing users table in %s as version 1", self.database)
+        return {1: None}
+
+    def _apply(self, conn, migration):
+        started = time.monotonic()
+        try:
+            with self._transaction(conn):
+                for statement in migration.statements.get(self.backend, []):
+                    conn.execute(statement)
+                conn.execute(self.sql['insert'], (migration.version, migration.name))
+        except Exception as e:
+            raise MigrationError(f'Migration {migration.version} ({migration.name}) failed: {e}') from e
+        logging.info("Applied migration %s (%s) in %.3fs",
+                     migration.version, migration.name, time.monotonic() - started)
+
+    def _run_backfills(self, chunk_size, pause):
+        # One process per database runs the backfills; the others skip them
+        with self._backfill_session() as conn:
+            if conn is None:
+                return
+            for migration in self._pending_backfills(self._applied(conn)):
+                if not self._backfill(migration, chunk_size, pause):
+                    return
+                conn.execute(self.sql['backfilled'], (migration.version,))
+
+    def _backfill(self, migration, chunk_size, pause):
+        # Returns True once every row is done, False if stopped first
+        backfill = self._backfills[migration.backfill]
+        logging.info("Backfilling migration %s (%s)", migration.version, migration.name)
+        after, chunks = 0, 0
+        while not self._stopped.is_set():
+            try:
+                last = backfill(after, chunk_size)
+            except Exception:
+                logging.exception("Backfill %s failed, retrying", migration.name)
+                self._stopped.wait(10 * pause)
+                continue
+            if last is None:
+                logging.info("Backfill %s finished after %s chunks", migration.name, chunks)
+                return True
+            after, chunks = last, chunks + 1
+            # Leave room for the service's own writes between chunks
+            self._stopped.wait(pause)
+        return False
+
+
+class PostgresMigrationRunner(MigrationRunner):
+    """MigrationRunner for PostgreSQL, on connections from a psycopg pool.
+
+    Replicas on different hosts share the database, so the locks are
+    advisory locks in PostgreSQL itself rather than files.
+    """
+
+    backend = 'postgres'
+    sql = POSTGRES_SQL
+
+    def __init__(self, pool, migrations=MIGRATIONS):
+        super().__init__('postgres', migrations)
+        self._pool = pool
+
+    @contextmanager
+    def _connection(self):
+        with self._pool.connection() as conn:
+            yield conn
+
+    @contextmanager
+    def _migration_session(self):
+        with self._connection() as conn:
+            conn.execute('SELECT pg_advisory_lock(%s)', (POSTGRES_MIGRATE_LOCK,))
+            try:
+                yield conn
+            finally:
+                conn.execute('SELECT pg_advisory_unlock(%s)', (POSTGRES_MIGRATE_LOCK,))
+
+    @contextmanager
+    def _backfill_session(self):
+        with self._connection() as conn:
+            [locked] = conn.execute('SELECT pg_try_advisory_lock(%s)', (POSTGRES_BACKFILL_LOCK,)).fetchone()
+            if not locked:
+                yield None
+                return
+            try:
+                yield conn
+            finally:
+                conn.execute('SELECT pg_advisory_unlock(%s)', (POSTGRES_BACKFILL_LOCK,))
+
+    @contextmanager
+    def _transaction(self, conn):
+        with conn.transaction():
+            yield
+
+    def _baseline(self, conn):
+        # The PostgreSQL backend has always been migrated, so a users table here is not ours
+        [users] = conn.execute("SELECT to_regclass('users')").fetchone()
+        if users is not None:
+            raise MigrationError('users table exists but schema_migrations is empty')
+        return {}
+
+
+class MigrationGroup:
+    """The MigrationRunners of a sharded store's databases, run together."""
+
+    def __init__(self, runners):
+        self.runners = runners
+        self.backend = runners[0].backend
+
+    def migrate(self):
+        for runner in self.runners:
+            runner.migrate()
+
+    def status(self):
+        shards = [runner.status() for runner in self.runners]
+        return {
+            'version': min(shard['version'] for shard in shards),
+            'pending_backfills': sorted({name for shard in shards for name in shard['pending_backfills']}),
+            'shards': shards,
+        }
+
+    def stop(self):
+        for runner in self.runners:
+            runner.stop()
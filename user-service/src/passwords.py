@@ -0,0 +1,122 @@
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Stored hashes look like scrypt$<n>$<r>$<p>$<salt>$<hash>, so the cost
+# parameters travel with each hash and can be raised without a migration:
+# a login that finds old parameters stores a fresh hash (see needs_rehash).
+SCHEME = 'scrypt'
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing pool has no free slot within the queue timeout."""
+
+
+def _b64encode(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def hash_password(password, n, r, p):
+    salt = os.urandom(SALT_BYTES)
+    key = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                         maxmem=256 * n * r + 1024 * 1024, dklen=KEY_BYTES)
+    return f'{SCHEME}${n}${r}${p}${_b64encode(salt)}${_b64encode(key)}'
+
+
+def is_hashed(encoded):
+    # Rows written before hashing was introduced hold the plain password
+    return encoded.startswith(SCHEME + '$')
+
+
+def verify_password(password, encoded):
+    if not is_hashed(encoded):
+        return hmac.compare_digest(password.encode(), encoded.encode())
+    _, n, r, p, salt, key = encoded.split('$')
+    n, r, p = int(n), int(r), int(p)
+    expected = base64.b64decode(key)
+    actual = hashlib.scrypt(password.encode(), salt=base64.b64decode(salt), n=n, r=r, p=p,
+                            maxmem=256 * n * r + 1024 * 1024, dklen=len(expected))
+    return hmac.compare_digest(actual, expected)
+
+
+def needs_rehash(encoded, n, r, p):
+    return not encoded.startswith(f'{SCHEME}${n}${r}${p}$')
+
+
+def _ignore_signals():
+    # Workers exit when the service closes the pool, not on the signals sent to it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+def _warm_up():
+    return os.getpid()
+
+
+class PasswordHasher:
+    """Runs scrypt in a dedicated process pool, off the gRPC worker threads.
+
+    Hashing gets its own CPU budget (workers processes) instead of competing
+    with request handling, and on the aio server the event loop only awaits
+    the result. At most max_pending hashes are queued or running; a caller
+    that cannot get a slot within queue_timeout gets HasherBusy, which the
+    RPCs turn into RESOURCE_EXHAUSTED instead of piling up work the pool
+    cannot finish.
+
+    The pool forks its workers in start(), which must run before the
+    service starts any threads (repository writer, log listener, gRPC).
+    """
+
+    def __init__(self, workers, max_pending, queue_timeout=1.0, n=2 ** 14, r=8, p=1):
+        self._workers = workers
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._queue_timeout = queue_timeout
+        self.n, self.r, self.p = n, r, p
+        self._pool = None
+
+    def start(self):
+        self._pool = ProcessPoolExecutor(
+            max_workers=self._workers,
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=_ignore_signals,
+        )
+        # With fork, the first submit starts every worker at once
+        self._pool.submit(_warm_up).result()
+
+    def submit_hash(self, password):
+        # May block up to queue_timeout for a slot; returns a Future of the encoded hash
+        return self._submit(hash_password, password, self.n, self.r, self.p)
+
+    def submit_verify(self, password, encoded):
+        return self._submit(verify_password, password, encoded)
+
+    def hash(self, password):
+        return self.submit_hash(password).result()
+
+    def verify(self, password, encoded):
+        return self.submit_verify(password, encoded).result()
+
+    def needs_rehash(self, encoded):
+        return needs_rehash(encoded, self.n, self.r, self.p)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(timeout=self._queue_timeout):
+            raise HasherBusy('Password hashing is saturated, try again later')
+        try:
+            future = self._pool.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
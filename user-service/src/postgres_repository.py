@@ -0,0 +1,140 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg
+from psycopg_pool import ConnectionPool
+
+from metrics import timed
+
+# Same statements as repository.py in PostgreSQL's dialect. psycopg prepares
+# a statement server-side once a connection has run it a few times.
+INSERT_USER = '''
+    INSERT INTO users (username, email, password, goal, created_at)
+    VALUES (%s, %s, %s, %s, EXTRACT(EPOCH FROM now())::BIGINT)
+    RETURNING user_id
+'''
+SELECT_GOAL = 'SELECT goal FROM users WHERE user_id = %s'
+SELECT_GOALS = 'SELECT user_id, goal FROM users WHERE user_id = ANY(%s::BIGINT[])'
+SELECT_CREDENTIALS = 'SELECT user_id, password FROM users WHERE username = %s'
+UPDATE_PASSWORD = 'UPDATE users SET password = %s WHERE user_id = %s AND password = %s RETURNING user_id'
+SELECT_PASSWORDS_AFTER = 'SELECT user_id, password FROM users WHERE user_id > %s ORDER BY user_id LIMIT %s'
+
+MAX_USER_ID = 2 ** 63 - 1
+
+
+def parse_user_id(user_id):
+    # Returns None for ids that cannot be a BIGINT key
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    return user_id if 0 < user_id <= MAX_USER_ID else None
+
+
+class PostgresUserRepository:
+    """UserRepository on a shared PostgreSQL database.
+
+    Every replica reads and writes the same users table, so a user registered
+    through one replica is found by all of them. Connections come from a
+    psycopg pool; PostgreSQL handles concurrent writers itself, so writes go
+    straight to the database instead of through a single writer thread, and
+    the non-blocking submit_* calls run on a small executor.
+    """
+
+    backend = 'postgres'
+    IntegrityError = psycopg.IntegrityError
+
+    def __init__(self, conninfo, pool_size=10, write_workers=4, connect_timeout=5):
+        self.pool = ConnectionPool(
+            conninfo,
+            min_size=min(2, pool_size),
+            max_size=pool_size,
+            kwargs={'autocommit': True, 'connect_timeout': connect_timeout},
+            timeout=connect_timeout,
+            name='users',
+        )
+        self._executor = ThreadPoolExecutor(max_workers=write_workers, thread_name_prefix='postgres-writer')
+
+    def create_user(self, username, email, password, goal):
+        # Raises psycopg.IntegrityError on duplicate username/email
+        [(user_id, error)] = self.create_users([(username, email, password, goal)])
+        if error is not None:
+            raise error
+        return user_id
+
+    @timed('postgres', 'create_users')
+    def create_users(self, rows):
+        # All rows are inserted in one transaction; returns (user_id, error) per row
+        return self._execute_rows(INSERT_USER, rows)
+
+    def submit_users(self, rows):
+        return self._executor.submit(self.create_users, rows)
+
+    def _execute_rows(self, sql, rows):
+        # Each row runs in its own savepoint of one transaction, so a
+        # constraint violation only fails that row; returns (first returned
+        # column or None, error) per row
+        outcomes = []
+        with self.pool.connection() as conn, conn.transaction():
+            for row in rows:
+                try:
+                    with conn.transaction():
+                        cursor = conn.execute(sql, row)
+                        returned = cursor.fetchone() if cursor.description else None
+                    outcomes.append((returned[0] if returned else None, None))
+                except psycopg.IntegrityError as e:
+                    outcomes.append((None, e))
+        return outcomes
+
+    @timed('postgres', 'get_goal')
+    def get_goal(self, user_id):
+        user_id = parse_user_id(user_id)
+        if user_id is None:
+            return None
+        with self.pool.connection() as conn:
+            row = conn.execute(SELECT_GOAL, (user_id,)).fetchone()
+        if row is None:
+            return None
+        return row[0] or ''
+
+    @timed('postgres', 'get_goals')
+    def get_goals(self, user_ids):
+        keys = [key for key in map(parse_user_id, dict.fromkeys(user_ids)) if key is not None]
+        if not keys:
+            return {}
+        with self.pool.connection() as conn:
+            rows = conn.execute(SELECT_GOALS, (keys,)).fetchall()
+        return {str(user_id): goal or '' for user_id, goal in rows}
+
+    @timed('postgres', 'get_credentials')
+    def get_credentials(self, username):
+        with self.pool.connection() as conn:
+            return conn.execute(SELECT_CREDENTIALS, (username,)).fetchone()
+
+    def update_password(self, user_id, old_hash, new_hash):
+        # Non-blocking; returns a Future of [(user_id or None, error)]
+        return self._executor.submit(self._update_password, user_id, old_hash, new_hash)
+
+    @timed('postgres', 'update_password')
+    def _update_password(self, user_id, old_hash, new_hash):
+        return self._execute_rows(UPDATE_PASSWORD, [(new_hash, user_id, old_hash)])
+
+    @timed('postgres', 'passwords_after')
+    def passwords_after(self, user_id, limit):
+        with self.pool.connection() as conn:
+            return conn.execute(SELECT_PASSWORDS_AFTER, (user_id, limit)).fetchall()
+
+    def query(self, sql, params):
+        with self.pool.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def submit(self, sql, rows):
+        # Any write statement; a Future of (first returned column or None, error) per row
+        return self._executor.submit(self._execute_rows, sql, rows)
+
+    def ping(self):
+        with self.pool.connection() as conn:
+            conn.execute('SELECT 1').fetchone()
+
+    def close(self):
+        self._executor.shutdown()
+        self.pool.close()
@@ -0,0 +1,182 @@
+import logging
+import threading
+import time
+
+import redis
+
+from metrics import timed
+
+# Token bucket per (client, method), refilled at rate tokens/s up to burst.
+# Redis' own clock is used so every replica refills the same bucket alike.
+#   ratelimit:<client>:<method>  hash  tokens, ts (ms)
+# Returns {allowed, ms until the next token}.
+TOKEN_BUCKET_SCRIPT = '''
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens, ts = tonumber(bucket[1]), tonumber(bucket[2])
+if tokens == nil or ts == nil then
+    tokens, ts = burst, now
+end
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+if allowed == 1 then
+    return {1, 0}
+end
+return {0, math.ceil((1 - tokens) * 1000 / rate)}
+'''
+
+
+def parse_limits(spec, convert):
+    # "RegisterUser=20:40,GetUserGoal=500:1000" -> {'RegisterUser': convert('20:40'), ...}
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, value = item.split('=', 1)
+        limits[name.strip()] = convert(value.strip())
+    return limits
+
+
+def parse_rate(value):
+    # "rate:burst" (burst defaults to rate), or "" for no limit
+    if not value:
+        return None
+    rate, _, burst = value.partition(':')
+    return float(rate), float(burst or rate)
+
+
+class LocalBuckets:
+    """In-process token buckets, used while Redis is unavailable.
+
+    Limits then apply per replica rather than across all of them, which is
+    looser but keeps the service protected without the shared state.
+    """
+
+    def __init__(self, max_keys=100000):
+        self._buckets = {}
+        self._max_keys = max_keys
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        now = time.monotonic()
+        with self._lock:
+            tokens, ts = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - ts) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self._max_keys:
+                self._prune(now)
+        return allowed, 0 if allowed else int((1 - tokens) * 1000 / rate) + 1
+
+    def _prune(self, now):
+        # Buckets idle for a minute have refilled; dropping them loses nothing but memory
+        for key in [k for k, (_, ts) in self._buckets.items() if now - ts > 60]:
+            del self._buckets[key]
+
+
+class RateLimiter:
+    """Per-client, per-method token buckets shared through a Redis Lua script.
+
+    limits maps a method name (e.g. 'RegisterUser') to (rate, burst);
+    methods not listed use default, and None means unlimited. When Redis
+    errors or times out the limiter switches to LocalBuckets for
+    fallback_period seconds instead of paying the timeout on every RPC.
+    """
+
+    def __init__(self, redis_client, limits, default=None, fallback_period=5.0):
+        self._script = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+        self._limits = limits
+        self._default = default
+        self._fallback_period = fallback_period
+        self._local = LocalBuckets()
+        self._redis_down_until = 0.0
+
+    def limit_for(self, method):
+        return self._limits.get(method.rsplit('/', 1)[-1], self._default)
+
+    def allow(self, client, method):
+        # Returns (allowed, retry_after_ms)
+        limit = self.limit_for(method)
+        if limit is None:
+            return True, 0
+        key = f'ratelimit:{client}:{method}'
+        if time.monotonic() >= self._redis_down_until:
+            try:
+                allowed, retry_after = self._take(key, limit)
+                return bool(allowed), int(retry_after)
+            except redis.RedisError as e:
+                self._redis_failed(e)
+        return self._local.take(key, *limit)
+
+    @timed('redis', 'rate_limit')
+    def _take(self, key, limit):
+        return self._script(keys=[key], args=list(limit))
+
+    def _redis_failed(self, error):
+        logging.warning("Rate limiter falling back to local buckets for %ss: %s",
+                        self._fallback_period, error)
+        self._redis_down_until = time.monotonic() + self._fallback_period
+
+
+class AsyncRateLimiter(RateLimiter):
+    """RateLimiter on a redis.asyncio client."""
+
+    async def allow(self, client, method):
+        limit = self.limit_for(method)
+        if limit is None:
+            return True, 0
+        key = f'ratelimit:{client}:{method}'
+        if time.monotonic() >= self._redis_down_until:
+            try:
+                allowed, retry_after = await self._take(key, limit)
+                return bool(allowed), int(retry_after)
+            except redis.RedisError as e:
+                self._redis_failed(e)
+        return self._local.take(key, *limit)
+
+    @timed('redis', 'rate_limit')
+    async def _take(self, key, limit):
+        return await self._script(keys=[key], args=list(limit))
+
+
+class ConcurrencyLimiter:
+    """Caps how many RPCs of each method run at once.
+
+    limits maps a method name to its cap, so e.g. a burst of RegisterUser
+    can hold at most a few worker threads and GetUserGoal keeps the rest;
+    max_in_flight (0 for none) caps all methods together.
+    """
+
+    def __init__(self, limits, max_in_flight=0):
+        self._limits = limits
+        self._max_in_flight = max_in_flight
+        self._in_flight = {}
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, method):
+        limit = self._limits.get(method.rsplit('/', 1)[-1])
+        with self._lock:
+            running = self._in_flight.get(method, 0)
+            if limit is not None and running >= limit:
+                return False
+            if self._max_in_flight and self._total >= self._max_in_flight:
+                return False
+            self._in_flight[method] = running + 1
+            self._total += 1
+            return True
+
+    def release(self, method):
+        with self._lock:
+            self._in_flight[method] -= 1
+            self._total -= 1
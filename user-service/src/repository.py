@@ -0,0 +1,243 @@
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from metrics import timed
+
+# SQL is kept in module constants so every call passes the exact same string
+# and sqlite3's per-connection statement cache reuses the prepared statement.
+# The schema itself is created and upgraded by migrations.py.
+INSERT_USER = '''
+    INSERT INTO users (username, email, password, goal, created_at)
+    VALUES (?, ?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))
+'''
+SELECT_GOAL = 'SELECT goal FROM users WHERE user_id = ?'
+SELECT_GOALS = 'SELECT user_id, goal FROM users WHERE user_id IN ({})'
+# The planner would pick the UNIQUE(username) index and then read the row;
+# users_credentials (migration 3) answers from the index alone
+SELECT_CREDENTIALS = 'SELECT user_id, password FROM users INDEXED BY users_credentials WHERE username = ?'
+# Only replaces the hash that was verified, so a concurrent password change wins
+UPDATE_PASSWORD = 'UPDATE users SET password = ? WHERE user_id = ? AND password = ? RETURNING user_id'
+SELECT_PASSWORDS_AFTER = 'SELECT user_id, password FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?'
+
+STATEMENT_CACHE_SIZE = 128
+# Stay well under SQLite's bound-parameter limit for IN (...) lookups
+MAX_IN_PARAMS = 500
+
+
+def connect(database):
+    conn = sqlite3.connect(
+        database,
+        check_same_thread=False,
+        isolation_level=None,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA busy_timeout=5000')
+    return conn
+
+
+class ConnectionPool:
+    """Fixed-size pool of read connections shared by the gRPC worker threads."""
+
+    def __init__(self, database, size):
+        self._connections = queue.LifoQueue(maxsize=size)
+        for _ in range(size):
+            self._connections.put(connect(database))
+
+    @contextmanager
+    def connection(self):
+        conn = self._connections.get()
+        try:
+            yield conn
+        finally:
+            self._connections.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._connections.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def returned(cursor):
+    if cursor.description is None:
+        return cursor.lastrowid
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+class WriteQueue:
+    """Single writer thread that group-commits queued statements.
+
+    SQLite allows one writer at a time, so instead of every RPC thread
+    fighting for the write lock, writes are handed to one thread that drains
+    whatever is queued and commits it in a single transaction. Each statement
+    runs in its own savepoint so a constraint violation only fails that
+    statement's future.
+    """
+
+    def __init__(self, database, batch_size, batch_wait):
+        self._database = database
+        self._batch_size = batch_size
+        self._batch_wait = batch_wait
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, sql, rows):
+        # rows is a list of parameter tuples committed in the same transaction;
+        # the future resolves to a list of (lastrowid, error) per row, or of
+        # the first returned column (None for no row) for RETURNING statements
+        future = Future()
+        self._queue.put((sql, rows, future))
+        return future
+
+    def execute(self, sql, params):
+        lastrowid, error = self.submit(sql, [params]).result()[0]
+        if error is not None:
+            raise error
+        return lastrowid
+
+    def execute_many(self, sql, rows):
+        return self.submit(sql, rows).result()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        while len(batch) < self._batch_size:
+            try:
+                item = self._queue.get(timeout=self._batch_wait)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        conn = connect(self._database)
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            self._commit(conn, batch)
+        conn.close()
+
+    @timed('sqlite', 'commit')
+    def _commit(self, conn, batch):
+        results = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for sql, rows, future in batch:
+                outcomes = []
+                for params in rows:
+                    conn.execute('SAVEPOINT stmt')
+                    try:
+                        cursor = conn.execute(sql, params)
+                        outcomes.append((returned(cursor), None))
+                        conn.execute('RELEASE stmt')
+                    except sqlite3.Error as e:
+                        conn.execute('ROLLBACK TO stmt')
+                        conn.execute('RELEASE stmt')
+                        outcomes.append((None, e))
+                results.append((future, outcomes))
+            conn.execute('COMMIT')
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        for future, outcomes in results:
+            future.set_result(outcomes)
+
+
+class UserRepository:
+    backend = 'sqlite'
+    IntegrityError = sqlite3.IntegrityError
+
+    def __init__(self, database, pool_size=10, write_batch_size=64, write_batch_wait=0.002):
+        self.database = database
+        self._pool = ConnectionPool(database, pool_size)
+        self._writer = WriteQueue(database, write_batch_size, write_batch_wait)
+
+    def create_user(self, username, email, password, goal):
+        # Raises sqlite3.IntegrityError on duplicate username/email
+        return self._writer.execute(INSERT_USER, (username, email, password, goal))
+
+    def create_users(self, rows):
+        # All rows are inserted in one transaction; returns (user_id, error) per row
+        return self._writer.execute_many(INSERT_USER, rows)
+
+    def submit_users(self, rows):
+        # Non-blocking create_users: returns a Future of (user_id, error) per row
+        return self._writer.submit(INSERT_USER, rows)
+
+    @timed('sqlite', 'get_goal')
+    def get_goal(self, user_id):
+        # Returns None when the user does not exist
+        with self._pool.connection() as conn:
+            row = conn.execute(SELECT_GOAL, (user_id,)).fetchone()
+        if row is None:
+            return None
+        return row[0] or ''
+
+    @timed('sqlite', 'get_goals')
+    def get_goals(self, user_ids):
+        # Returns {user_id: goal} for the ids that exist
+        user_ids = list(dict.fromkeys(user_ids))
+        goals = {}
+        with self._pool.connection() as conn:
+            for i in range(0, len(user_ids), MAX_IN_PARAMS):
+                chunk = user_ids[i:i + MAX_IN_PARAMS]
+                sql = SELECT_GOALS.format(', '.join('?' * len(chunk)))
+                for user_id, goal in conn.execute(sql, chunk):
+                    goals[str(user_id)] = goal or ''
+        return goals
+
+    @timed('sqlite', 'get_credentials')
+    def get_credentials(self, username):
+        # Returns (user_id, stored password hash), or None for unknown usernames
+        with self._pool.connection() as conn:
+            return conn.execute(SELECT_CREDENTIALS, (username,)).fetchone()
+
+    def update_password(self, user_id, old_hash, new_hash):
+        # Non-blocking; returns a Future of [(user_id or None, error)], with
+        # None if the user's password was no longer old_hash
+        return self._writer.submit(UPDATE_PASSWORD, [(new_hash, user_id, old_hash)])
+
+    @timed('sqlite', 'passwords_after')
+    def passwords_after(self, user_id, limit):
+        # Keyset page of (user_id, password hash) for backfills
+        with self._pool.connection() as conn:
+            return conn.execute(SELECT_PASSWORDS_AFTER, (user_id, limit)).fetchall()
+
+    def query(self, sql, params):
+        # Any read statement, for callers with SQL of their own (sharding.py)
+        with self._pool.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def submit(self, sql, rows):
+        # Any write statement through the writer thread; a Future like submit_users
+        return self._writer.submit(sql, rows)
+
+    def ping(self):
+        # Health check: a pooled connection can still run a query
+        with self._pool.connection() as conn:
+            conn.execute('SELECT 1').fetchone()
+
+    def close(self):
+        self._writer.close()
+        self._pool.close()
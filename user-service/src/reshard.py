@@ -0,0 +1,180 @@
+"""Moves users to their shards after shards are added or removed.
+
+    python src/reshard.py --from shard0=users.db \\
+        --to shard0=users.db,shard1=users-1.db [--delete]
+
+Walks every user row and username/email claim on the --from shards in
+key order, a chunk at a time, and copies those whose shard on the --to
+ring is a different one. It also adds claims for users that have none yet,
+e.g. users registered before sharding. To change shards while the
+service keeps serving:
+
+1. Restart the replicas with USER_SHARDS set to the new list and
+   USER_SHARDS_PREVIOUS set to the old one. Reads then fall back to the old
+   shard, and claims and password changes go to both shards.
+2. Run this tool. Once every replica runs with step 1's settings, run it
+   with --delete, which also removes the moved rows from their old shards.
+3. Restart the replicas without USER_SHARDS_PREVIOUS.
+
+Every run is idempotent. Copies never overwrite rows already on the new
+shard, except for a password that changed on the old shard since the copy.
+"""
+import argparse
+import logging
+import time
+
+from sharding import SQL, HashRing, name_key, open_shards, parse_shards
+
+DEFAULT_CHUNK = 500
+
+
+class Resharder:
+    def __init__(self, stores, ring, chunk_size=DEFAULT_CHUNK, pause=0.0, delete=False):
+        self._stores = stores
+        self._ring = ring
+        self._chunk_size = chunk_size
+        self._pause = pause
+        self._delete = delete
+        self.counts = dict.fromkeys(
+            ('users_scanned', 'users_moved', 'passwords_fixed', 'claims_ensured', 'claims_moved', 'conflicts'), 0
+        )
+
+    def run(self, sources):
+        for source in sources:
+            self.move_users(source)
+        for source in sources:
+            self.move_claims(source)
+
+    def move_users(self, source):
+        after = 0
+        while True:
+            rows = self._query(source, 'users_after', (after, self._chunk_size))
+            if not rows:
+                return
+            moves, claims = {}, {}
+            for row in rows:
+                user_id, username, email, _, _, created_at = row
+                target = self._ring.shard(str(user_id))
+                if target != source:
+                    moves.setdefault(target, []).append(row)
+                for name in (name_key('username', username), name_key('email', email)):
+                    claims.setdefault(self._ring.shard(name), []).append(
+                        (name, user_id, created_at or int(time.time()))
+                    )
+            for target, moved in moves.items():
+                self._copy_users(source, target, moved)
+            for target, batch in claims.items():
+                self.counts['claims_ensured'] += self._submit(target, 'copy_claim', batch)
+            self.counts['users_scanned'] += len(rows)
+            after = rows[-1][0]
+            logging.info("%s: users up to id %s done", source, after)
+            time.sleep(self._pause)
+
+    def move_claims(self, source):
+        after = ''
+        while True:
+            rows = self._query(source, 'claims_after', (after, self._chunk_size))
+            if not rows:
+                return
+            moves = {}
+            for name, user_id, created_at in rows:
+                target = self._ring.shard(name)
+                if target != source:
+                    moves.setdefault(target, []).append((name, user_id, created_at))
+            for target, moved in moves.items():
+                self._submit(target, 'copy_claim', moved)
+                stale = []
+                for name, user_id, _ in moved:
+                    claim = self._query(target, 'select_claim', (name,))
+                    if not claim:
+                        continue  # released by a failed registration meanwhile
+                    owner = claim[0][0]
+                    if owner != user_id:
+                        self.counts['conflicts'] += 1
+                        logging.error("%s is claimed by user %s on %s and by user %s on %s",
+                                      name, owner, target, user_id, source)
+                    else:
+                        stale.append((name, user_id))
+                        self.counts['claims_moved'] += 1
+                if self._delete:
+                    self._submit(source, 'delete_claim', stale)
+            after = rows[-1][0]
+            time.sleep(self._pause)
+
+    def _copy_users(self, source, target, rows):
+        self._submit(target, 'copy_user', rows)
+        # Read the copies before the originals: a password changed through
+        # the service in between is then picked up, and the conditional
+        # update cannot undo one that went to both shards after the reads
+        first, last = rows[0][0], rows[-1][0]
+        copied = dict(self._query(target, 'passwords_between', (first, last)))
+        current = dict(self._query(source, 'passwords_between', (first, last)))
+        fixes = [
+            (current[user_id], user_id, copied[user_id])
+            for user_id, *_ in rows
+            if user_id in copied and user_id in current and copied[user_id] != current[user_id]
+        ]
+        self._submit(target, 'update_password', fixes)
+        self.counts['passwords_fixed'] += len(fixes)
+        moved = [(user_id,) for user_id, *_ in rows if user_id in copied]
+        for user_id, username, email, *_ in rows:
+            if user_id not in copied:
+                # Another user on the target has the username or email
+                self.counts['conflicts'] += 1
+                logging.error("User %s (%s, %s) on %s clashes with a user on %s",
+                              user_id, username, email, source, target)
+        self.counts['users_moved'] += len(moved)
+        if self._delete:
+            self._submit(source, 'delete_user', moved)
+
+    def _query(self, shard, statement, params):
+        store = self._stores[shard]
+        return store.query(SQL[store.backend][statement], params)
+
+    def _submit(self, shard, statement, rows):
+        # Returns how many rows were written; errors are raised
+        if not rows:
+            return 0
+        store = self._stores[shard]
+        outcomes = store.submit(SQL[store.backend][statement], rows).result()
+        for _, error in outcomes:
+            if error is not None:
+                raise error
+        return len(outcomes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--from', dest='source', required=True, help='shards as in USER_SHARDS_PREVIOUS')
+    parser.add_argument('--to', dest='target', required=True, help='shards as in USER_SHARDS')
+    parser.add_argument('--chunk', type=int, default=DEFAULT_CHUNK, help='rows per chunk')
+    parser.add_argument('--pause', type=float, default=0.05, help='seconds between chunks')
+    parser.add_argument('--delete', action='store_true', help='remove moved rows from their old shards')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    previous, current = parse_shards(args.source), parse_shards(args.target)
+    databases = open_shards(current, previous)
+    for _, runner in databases.values():
+        runner.migrate()
+    stores = {name: store for name, (store, _) in databases.items()}
+    resharder = Resharder(
+        stores, HashRing([name for name, _ in current]),
+        chunk_size=args.chunk, pause=args.pause, delete=args.delete,
+    )
+    started = time.perf_counter()
+    try:
+        resharder.run([name for name, _ in previous])
+    finally:
+        for store in stores.values():
+            store.close()
+    elapsed = time.perf_counter() - started
+    counts = resharder.counts
+    print(', '.join(f'{key}={value}' for key, value in counts.items()))
+    print(f'{elapsed:.1f}s, {counts["users_scanned"] / elapsed:.0f} users/s')
+    if counts['conflicts']:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
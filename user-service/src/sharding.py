@@ -0,0 +1,420 @@
+import bisect
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import timed
+from migrations import MigrationRunner, PostgresMigrationRunner
+from repository import UserRepository
+
+# Users are spread over shards (SQLite files or PostgreSQL databases, each
+# with the full schema) by consistent hashing. A user's row lives on the
+# shard that owns str(user_id) on the ring. Each username and email is
+# claimed in user_names on the shard that owns 'username:<name>' or
+# 'email:<email>', which keeps them unique across shards and lets
+# VerifyPassword find a user's id from the username with one lookup.
+SQL = {
+    'sqlite': {
+        'insert_user': '''
+            INSERT INTO users (user_id, username, email, password, goal, created_at)
+            VALUES (?, ?, ?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))
+        ''',
+        'copy_user': '''
+            INSERT INTO users (user_id, username, email, password, goal, created_at)
+            VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT DO NOTHING
+        ''',
+        'delete_user': 'DELETE FROM users WHERE user_id = ?',
+        'select_password': 'SELECT password FROM users WHERE user_id = ?',
+        'update_password': 'UPDATE users SET password = ? WHERE user_id = ? AND password = ? RETURNING user_id',
+        'users_after': '''
+            SELECT user_id, username, email, password, goal, created_at FROM users
+            WHERE user_id > ? ORDER BY user_id LIMIT ?
+        ''',
+        'passwords_between': 'SELECT user_id, password FROM users WHERE user_id BETWEEN ? AND ?',
+        'insert_claim': '''
+            INSERT INTO user_names (name, user_id, created_at)
+            VALUES (?, ?, CAST(strftime('%s', 'now') AS INTEGER))
+        ''',
+        'copy_claim': '''
+            INSERT INTO user_names (name, user_id, created_at) VALUES (?, ?, ?) ON CONFLICT DO NOTHING
+        ''',
+        'delete_claim': 'DELETE FROM user_names WHERE name = ? AND user_id = ?',
+        'select_claim': 'SELECT user_id, created_at FROM user_names WHERE name = ?',
+        'claims_after': 'SELECT name, user_id, created_at FROM user_names WHERE name > ? ORDER BY name LIMIT ?',
+    },
+    'postgres': {
+        'insert_user': '''
+            INSERT INTO users (user_id, username, email, password, goal, created_at)
+            VALUES (%s, %s, %s, %s, %s, EXTRACT(EPOCH FROM now())::BIGINT)
+        ''',
+        'copy_user': '''
+            INSERT INTO users (user_id, username, email, password, goal, created_at)
+            VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT DO NOTHING
+        ''',
+        'delete_user': 'DELETE FROM users WHERE user_id = %s',
+        'select_password': 'SELECT password FROM users WHERE user_id = %s',
+        'update_password': 'UPDATE users SET password = %s WHERE user_id = %s AND password = %s RETURNING user_id',
+        'users_after': '''
+            SELECT user_id, username, email, password, goal, created_at FROM users
+            WHERE user_id > %s ORDER BY user_id LIMIT %s
+        ''',
+        'passwords_between': 'SELECT user_id, password FROM users WHERE user_id BETWEEN %s AND %s',
+        'insert_claim': '''
+            INSERT INTO user_names (name, user_id, created_at)
+            VALUES (%s, %s, EXTRACT(EPOCH FROM now())::BIGINT)
+        ''',
+        'copy_claim': '''
+            INSERT INTO user_names (name, user_id, created_at) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING
+        ''',
+        'delete_claim': 'DELETE FROM user_names WHERE name = %s AND user_id = %s',
+        'select_claim': 'SELECT user_id, created_at FROM user_names WHERE name = %s',
+        'claims_after': 'SELECT name, user_id, created_at FROM user_names WHERE name > %s ORDER BY name LIMIT %s',
+    },
+}
+
+# Snowflake-style ids: milliseconds since ID_EPOCH_MS, node, sequence
+ID_EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+MAX_NODE = (1 << NODE_BITS) - 1
+SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
+MAX_USER_ID = 2 ** 63 - 1
+
+RING_POINTS = 128
+
+
+class DuplicateUser(Exception):
+    """Raised when a username or email is already registered."""
+
+
+def user_key(user_id):
+    # Canonical ring key for a user id, or None if it cannot be one
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    return str(user_id) if 0 < user_id <= MAX_USER_ID else None
+
+
+def name_key(kind, value):
+    return f'{kind}:{value}'
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+def parse_shards(spec):
+    # "name=target,..." or "target,..." (named shard0, shard1, ...) -> [(name, target)]
+    shards = []
+    for index, entry in enumerate(e.strip() for e in spec.split(',') if e.strip()):
+        name, sep, target = entry.partition('=')
+        # postgresql:// URLs may contain '=' in their query string
+        if not sep or '://' in name or '/' in name:
+            name, target = f'shard{index}', entry
+        shards.append((name, target))
+    names = [name for name, _ in shards]
+    if len(set(names)) != len(names):
+        raise ValueError(f'Duplicate shard names in {spec!r}')
+    return shards
+
+
+def open_store(target, postgres=None, pool_size=10, write_batch_size=64, write_batch_wait=0.002):
+    # Returns the repository for one database and its MigrationRunner;
+    # postgres=None decides by whether target is a postgres:// URL
+    if postgres is None:
+        postgres = target.startswith(('postgres://', 'postgresql://'))
+    if postgres:
+        # psycopg is only needed for this backend
+        from postgres_repository import PostgresUserRepository
+        store = PostgresUserRepository(target, pool_size=pool_size)
+        return store, PostgresMigrationRunner(store.pool)
+    store = UserRepository(
+        target,
+        pool_size=pool_size,
+        write_batch_size=write_batch_size,
+        write_batch_wait=write_batch_wait,
+    )
+    return store, MigrationRunner(target)
+
+
+def open_shards(current, previous=(), **options):
+    # Opens each named database once; returns {name: (store, runner)}
+    targets = {}
+    for name, target in [*previous, *current]:
+        if targets.setdefault(name, target) != target:
+            raise ValueError(f'Shard {name} is both {targets[name]} and {target}')
+    return {name: open_store(target, **options) for name, target in targets.items()}
+
+
+class SnowflakeIds:
+    """64-bit user ids that need no sequence shared between processes.
+
+    An id is the milliseconds since ID_EPOCH_MS (41 bits), the node (10
+    bits) and a sequence within the millisecond (12 bits), so ids from up to
+    1024 nodes never collide and sort by creation time. Every process that
+    registers users needs its own node number. If the clock steps back, ids
+    continue from the last millisecond used instead of repeating.
+    """
+
+    def __init__(self, node, clock=time.time):
+        if not 0 <= node <= MAX_NODE:
+            raise ValueError(f'User id node must be between 0 and {MAX_NODE}, got {node}')
+        self._node = node
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._last = 0
+        self._sequence = 0
+
+    def next_id(self):
+        with self._lock:
+            now = max(int(self._clock() * 1000) - ID_EPOCH_MS, self._last)
+            if now == self._last:
+                self._sequence = (self._sequence + 1) & SEQUENCE_MASK
+                if self._sequence == 0:
+                    # 4096 ids in one millisecond: borrow the next one
+                    now += 1
+            else:
+                self._sequence = 0
+            self._last = now
+            return (now << (NODE_BITS + SEQUENCE_BITS)) | (self._node << SEQUENCE_BITS) | self._sequence
+
+
+class HashRing:
+    """Consistent hashing of keys onto named shards.
+
+    Each shard owns `points` positions on a 64-bit ring and a key belongs
+    to the first position at or after its hash. Adding or removing a shard
+    only moves the keys next to its positions, about 1/N of them.
+    """
+
+    def __init__(self, names, points=RING_POINTS):
+        self.names = list(names)
+        ring = sorted((ring_hash(f'{name}#{i}'), name) for name in self.names for i in range(points))
+        self._hashes = [h for h, _ in ring]
+        self._owners = [name for _, name in ring]
+
+    def shard(self, key):
+        return self._owners[bisect.bisect_left(self._hashes, ring_hash(key)) % len(self._hashes)]
+
+
+class ShardedUserRepository:
+    """UserRepository over several databases chosen by consistent hashing.
+
+    stores maps shard names to UserRepository or PostgresUserRepository
+    instances; shards lists the names on the ring. New users get ids from
+    a SnowflakeIds, so shards never agree on a sequence. Registration claims
+    the username and email first and inserts the row only if both claims
+    succeed. A claim whose registration died before inserting the row is
+    taken over once it is claim_timeout seconds old.
+
+    While shards are added or removed (see reshard.py), previous lists the
+    names of the old ring. Reads then fall back to a key's old shard, and
+    claims and password updates go to both shards, so reshard.py can copy
+    rows while the service keeps serving.
+    """
+
+    IntegrityError = DuplicateUser
+
+    def __init__(self, stores, shards, ids, previous=None, claim_timeout=60, workers=4):
+        self.stores = stores
+        self._ring = HashRing(shards)
+        self._previous = HashRing(previous) if previous else None
+        self._ids = ids
+        self._claim_timeout = claim_timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='shard-writer')
+
+    def create_user(self, username, email, password, goal):
+        # Raises DuplicateUser on duplicate username/email
+        [(user_id, error)] = self.create_users([(username, email, password, goal)])
+        if error is not None:
+            raise error
+        return user_id
+
+    @timed('shards', 'create_users')
+    def create_users(self, rows):
+        # Returns (user_id, error) per row, like UserRepository.create_users
+        user_ids = [self._ids.next_id() for _ in rows]
+        claims = [
+            self._claims_of(user_id, username, email)
+            for user_id, (username, email, _, _) in zip(user_ids, rows)
+        ]
+        errors = self._claim(claims)
+        inserts = [
+            (index, self._ring.shard(str(user_id)), (user_id, *row))
+            for index, (user_id, row) in enumerate(zip(user_ids, rows))
+            if errors[index] is None
+        ]
+        failed = self._write('insert_user', [(shard, params) for _, shard, params in inserts])
+        for (index, shard, _), error in zip(inserts, failed):
+            if error is not None:
+                errors[index] = DuplicateUser(str(error)) if self._duplicate(shard, error) else error
+                self._release(claims[index])
+        return [(None, error) if error else (user_id, None) for user_id, error in zip(user_ids, errors)]
+
+    def submit_users(self, rows):
+        # Non-blocking create_users: returns a Future of (user_id, error) per row
+        return self._executor.submit(self.create_users, rows)
+
+    @timed('shards', 'get_goal')
+    def get_goal(self, user_id):
+        key = user_key(user_id)
+        if key is None:
+            return None
+        for shard in self._owners(key):
+            goal = self.stores[shard].get_goal(int(key))
+            if goal is not None:
+                return goal
+        return None
+
+    @timed('shards', 'get_goals')
+    def get_goals(self, user_ids):
+        # One get_goals per shard; while resharding, misses are retried on their old shard
+        goals = {}
+        pending = [key for key in map(user_key, dict.fromkeys(user_ids)) if key is not None]
+        for attempt in range(2):
+            by_shard = {}
+            for key in pending:
+                owners = self._owners(key)
+                if attempt < len(owners):
+                    by_shard.setdefault(owners[attempt], []).append(int(key))
+            for shard, keys in by_shard.items():
+                goals.update(self.stores[shard].get_goals(keys))
+            pending = [key for key in pending if key not in goals]
+            if not pending:
+                break
+        return goals
+
+    @timed('shards', 'get_credentials')
+    def get_credentials(self, username):
+        # Returns (user_id, stored password hash), or None for unknown usernames
+        claim = self._select_claim(name_key('username', username))
+        if claim is None:
+            # Users stored before sharding have no claims until reshard.py adds
+            # them; outside a reshard an unclaimed name is simply unknown, so
+            # failed logins cost one query rather than one per shard
+            return self._scan_credentials(username) if self._previous is not None else None
+        user_id = claim[0]
+        for shard in self._owners(str(user_id)):
+            rows = self._query(shard, 'select_password', (user_id,))
+            if rows:
+                return user_id, rows[0][0]
+        # Claimed by a registration still in progress (or one that died)
+        return None
+
+    def update_password(self, user_id, old_hash, new_hash):
+        # Non-blocking; returns a Future of [(user_id or None, error)], one per copy of the user
+        return self._executor.submit(self._update_password, user_id, old_hash, new_hash)
+
+    def ping(self):
+        for store in self.stores.values():
+            store.ping()
+
+    def close(self):
+        self._executor.shutdown()
+        for store in self.stores.values():
+            store.close()
+
+    def _owners(self, key):
+        # The shard a key belongs to, then its old shard while resharding
+        owner = self._ring.shard(key)
+        if self._previous is None:
+            return [owner]
+        previous = self._previous.shard(key)
+        return [owner] if previous == owner else [owner, previous]
+
+    def _claims_of(self, user_id, username, email):
+        return [
+            (shard, name, user_id)
+            for name in (name_key('username', username), name_key('email', email))
+            for shard in self._owners(name)
+        ]
+
+    def _query(self, shard, statement, params):
+        store = self.stores[shard]
+        return store.query(SQL[store.backend][statement], params)
+
+    def _duplicate(self, shard, error):
+        return isinstance(error, self.stores[shard].IntegrityError)
+
+    def _write(self, statement, items):
+        # Returns the error (or None) per item of _submit
+        return [error for _, error in self._submit(statement, items)]
+
+    def _submit(self, statement, items):
+        # items are (shard, params); each shard's rows go to its store as one
+        # batch, all shards at once. Returns the store's outcome per item
+        batches = {}
+        for index, (shard, params) in enumerate(items):
+            batches.setdefault(shard, []).append((index, params))
+        futures = {
+            shard: self.stores[shard].submit(
+                SQL[self.stores[shard].backend][statement], [params for _, params in batch]
+            )
+            for shard, batch in batches.items()
+        }
+        outcomes = [None] * len(items)
+        for shard, batch in batches.items():
+            for (index, _), outcome in zip(batch, futures[shard].result()):
+                outcomes[index] = outcome
+        return outcomes
+
+    def _claim(self, claims):
+        # claims holds each row's (shard, name, user_id) claims, which all
+        # have to succeed; returns an error or None per row
+        flat = [(row, claim) for row, row_claims in enumerate(claims) for claim in row_claims]
+        results = self._write('insert_claim', [(shard, (name, user_id)) for _, (shard, name, user_id) in flat])
+        errors = [None] * len(claims)
+        for (row, claim), error in zip(flat, results):
+            if error is None or errors[row] is not None:
+                continue
+            if not self._duplicate(claim[0], error):
+                errors[row] = error
+            elif not self._take_over(claim):
+                kind, _, value = claim[1].partition(':')
+                errors[row] = DuplicateUser(f'{kind} {value!r} is already registered')
+        release = [claim for (row, claim), error in zip(flat, results) if errors[row] and error is None]
+        self._release(release)
+        return errors
+
+    def _take_over(self, claim):
+        # Replaces a claim left by a registration that never inserted its
+        # row; returns whether the claim is now ours
+        shard, name, user_id = claim
+        rows = self._query(shard, 'select_claim', (name,))
+        if not rows:
+            [error] = self._write('insert_claim', [(shard, (name, user_id))])
+            return error is None
+        owner, created_at = rows[0]
+        if time.time() - created_at < self._claim_timeout or self.get_goal(owner) is not None:
+            return False
+        logging.warning("Taking over claim on %s left by unregistered user %s", name, owner)
+        self._write('delete_claim', [(shard, (name, owner))])
+        [error] = self._write('insert_claim', [(shard, (name, user_id))])
+        return error is None
+
+    def _release(self, claims):
+        if claims:
+            self._write('delete_claim', [(shard, (name, user_id)) for shard, name, user_id in claims])
+
+    def _select_claim(self, name):
+        for shard in self._owners(name):
+            rows = self._query(shard, 'select_claim', (name,))
+            if rows:
+                return rows[0]
+        return None
+
+    def _scan_credentials(self, username):
+        for store in self.stores.values():
+            credentials = store.get_credentials(username)
+            if credentials is not None:
+                return credentials
+        return None
+
+    @timed('shards', 'update_password')
+    def _update_password(self, user_id, old_hash, new_hash):
+        key = user_key(user_id)
+        # One (user_id, error) per owner, as the user is on both while resharding
+        return self._submit('update_password', [(shard, (new_hash, int(key), old_hash)) for shard in self._owners(key)])
@@ -0,0 +1,184 @@
+"""Exports the users table to a Parquet or NDJSON file, and loads one back.
+
+    python src/snapshot.py export --database users.db users.parquet
+    python src/snapshot.py import --database postgresql://... users.parquet
+    python src/snapshot.py export --shards shard0=users.db,shard1=users-1.db users.ndjson.gz
+
+--database takes a SQLite path or a PostgreSQL URL as in DATABASE /
+DATABASE_URL, --shards a list as in USER_SHARDS. Export walks each
+database in user_id order a chunk at a time; it can run against a serving
+database, but every chunk is read at a different moment. Import migrates
+the target to the current schema and inserts a chunk per transaction
+with executemany, keeping user ids. Rows whose id, username or email
+already exist are skipped, so an interrupted import can simply be run
+again. Into an empty database the credentials index is built once at the end
+instead of row by row; stop the service while importing.
+"""
+import argparse
+import logging
+import os
+import time
+
+from datafiles import open_reader, open_writer
+from migrations import MIGRATIONS
+from repository import connect
+from sharding import SQL, HashRing, name_key, open_shards, open_store, parse_shards
+
+FIELDS = [
+    ('user_id', 'int'), ('username', 'str'), ('email', 'str'),
+    ('password', 'str'), ('goal', 'str'), ('created_at', 'int'),
+]
+DEFAULT_CHUNK = 50000
+# Migration 3's index only serves VerifyPassword, so it can be built after the load
+DEFERRED_INDEX = 'users_credentials'
+# Loading is offline, so each transaction does not need to reach the disk
+SQLITE_LOAD_PRAGMAS = ['PRAGMA synchronous=OFF', 'PRAGMA cache_size=-262144']
+
+
+def is_postgres(target):
+    return target.startswith(('postgres://', 'postgresql://'))
+
+
+def export_users(stores, writer, chunk_size):
+    exported = 0
+    for name, store in stores.items():
+        after = 0
+        while True:
+            rows = store.query(SQL[store.backend]['users_after'], (after, chunk_size))
+            if not rows:
+                break
+            writer.write(rows)
+            exported += len(rows)
+            after = rows[-1][0]
+            logging.info("%s: exported users up to id %s", name, after)
+    return exported
+
+
+class BulkLoader:
+    """Inserts users, and for sharded stores their name claims, into one database."""
+
+    def __init__(self, target):
+        self.backend = 'postgres' if is_postgres(target) else 'sqlite'
+        if self.backend == 'postgres':
+            # psycopg is only needed for this backend
+            import psycopg
+            self._conn = psycopg.connect(target)
+        else:
+            self._conn = connect(target)
+            for pragma in SQLITE_LOAD_PRAGMAS:
+                self._conn.execute(pragma)
+        self._sql = SQL[self.backend]
+        self._deferred = False
+
+    def defer_index(self):
+        # Drops the credentials index of an empty users table, to be built by finish()
+        if self._conn.execute('SELECT 1 FROM users LIMIT 1').fetchone() is not None:
+            return False
+        self._conn.execute(f'DROP INDEX IF EXISTS {DEFERRED_INDEX}')
+        self._commit()
+        self._deferred = True
+        return True
+
+    def load(self, users, claims):
+        # One transaction; returns how many users were inserted, not counting
+        # rows skipped on a conflict
+        if self.backend == 'sqlite':
+            self._conn.execute('BEGIN')
+        cursor = self._conn.cursor()
+        cursor.executemany(self._sql['copy_user'], users)
+        inserted = cursor.rowcount
+        if claims:
+            cursor.executemany(self._sql['copy_claim'], claims)
+        self._commit()
+        return inserted
+
+    def finish(self):
+        if self._deferred:
+            started = time.perf_counter()
+            [migration] = [m for m in MIGRATIONS if m.name == 'users_credentials_index']
+            for statement in migration.statements[self.backend]:
+                self._conn.execute(statement)
+            logging.info("Built index %s in %.1fs", DEFERRED_INDEX, time.perf_counter() - started)
+        if self.backend == 'postgres':
+            # Explicit ids do not advance the identity sequence
+            self._conn.execute(
+                "SELECT setval(pg_get_serial_sequence('users', 'user_id'), GREATEST(MAX(user_id), 1)) FROM users"
+            )
+            self._conn.execute('ANALYZE users')
+        self._commit()
+
+    def close(self):
+        self._conn.close()
+
+    def _commit(self):
+        if self.backend == 'sqlite':
+            if self._conn.in_transaction:
+                self._conn.execute('COMMIT')
+        else:
+            self._conn.commit()
+
+
+def import_users(loaders, reader, sharded):
+    # Routes each chunk's users (and their claims, when sharded) to their shards
+    ring = HashRing(list(loaders))
+    imported = 0
+    for rows in reader:
+        users = {name: [] for name in loaders}
+        claims = {name: [] for name in loaders}
+        for row in rows:
+            user_id, username, email, _, _, created_at = row
+            users[ring.shard(str(user_id))].append(row)
+            if sharded:
+                for key in (name_key('username', username), name_key('email', email)):
+                    claims[ring.shard(key)].append((key, user_id, created_at or int(time.time())))
+        for name, loader in loaders.items():
+            imported += loader.load(users[name], claims[name])
+        logging.info("Imported %s users", imported)
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['export', 'import'])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--database', help='SQLite path or PostgreSQL URL, as in DATABASE / DATABASE_URL')
+    source.add_argument('--shards', help='shards as in USER_SHARDS')
+    parser.add_argument('path', help='.parquet, .ndjson or .ndjson.gz file')
+    parser.add_argument('--chunk', type=int, default=DEFAULT_CHUNK, help='rows per chunk and transaction')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    shards = parse_shards(args.shards) if args.shards else [('users', args.database)]
+    databases = open_shards(shards) if args.shards else {'users': open_store(args.database)}
+    for _, runner in databases.values():
+        runner.migrate()
+    started = time.perf_counter()
+    if args.command == 'export':
+        stores = {name: store for name, (store, _) in databases.items()}
+        try:
+            with open_writer(args.path, FIELDS) as writer:
+                rows = export_users(stores, writer, args.chunk)
+        finally:
+            for store in stores.values():
+                store.close()
+    else:
+        for store, _ in databases.values():
+            store.close()
+        loaders = {name: BulkLoader(target) for name, target in shards}
+        try:
+            deferred = [name for name, loader in loaders.items() if loader.defer_index()]
+            if deferred:
+                logging.info("Empty users tables on %s: building %s after the load", ', '.join(deferred), DEFERRED_INDEX)
+            with open_reader(args.path, FIELDS, args.chunk) as reader:
+                rows = import_users(loaders, reader, sharded=bool(args.shards))
+        finally:
+            for loader in loaders.values():
+                loader.finish()
+                loader.close()
+    elapsed = time.perf_counter() - started
+    print(f'{args.command}ed {rows} users in {elapsed:.1f}s, {rows / elapsed:.0f} users/s, '
+          f'file {os.path.getsize(args.path) / 2 ** 20:.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
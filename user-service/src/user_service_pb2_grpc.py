@@ -44,6 +44,21 @@ class UserServiceStub(object):
                 request_serializer=user__service__pb2.GoalRequest.SerializeToString,
                 response_deserializer=user__service__pb2.GoalResponse.FromString,
                 _registered_method=True)
+        self.BatchRegisterUsers = channel.stream_unary(
+                '/user_service.UserService/BatchRegisterUsers',
+                request_serializer=user__service__pb2.UserRequest.SerializeToString,
+                response_deserializer=user__service__pb2.BatchRegisterResponse.FromString,
+                _registered_method=True)
+        self.GetUserGoals = channel.unary_stream(
+                '/user_service.UserService/GetUserGoals',
+                request_serializer=user__service__pb2.GoalsRequest.SerializeToString,
+                response_deserializer=user__service__pb2.UserGoal.FromString,
+                _registered_method=True)
+        self.VerifyPassword = channel.unary_unary(
+                '/user_service.UserService/VerifyPassword',
+                request_serializer=user__service__pb2.LoginRequest.SerializeToString,
+                response_deserializer=user__service__pb2.LoginResponse.FromString,
+                _registered_method=True)
 
 
 class UserServiceServicer(object):
@@ -61,6 +76,24 @@ class UserServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def BatchRegisterUsers(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetUserGoals(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def VerifyPassword(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_UserServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -74,6 +107,21 @@ def add_UserServiceServicer_to_server(servicer, server):
                     request_deserializer=user__service__pb2.GoalRequest.FromString,
                     response_serializer=user__service__pb2.GoalResponse.SerializeToString,
             ),
+            'BatchRegisterUsers': grpc.stream_unary_rpc_method_handler(
+                    servicer.BatchRegisterUsers,
+                    request_deserializer=user__service__pb2.UserRequest.FromString,
+                    response_serializer=user__service__pb2.BatchRegisterResponse.SerializeToString,
+            ),
+            'GetUserGoals': grpc.unary_stream_rpc_method_handler(
+                    servicer.GetUserGoals,
+                    request_deserializer=user__service__pb2.GoalsRequest.FromString,
+                    response_serializer=user__service__pb2.UserGoal.SerializeToString,
+            ),
+            'VerifyPassword': grpc.unary_unary_rpc_method_handler(
+                    servicer.VerifyPassword,
+                    request_deserializer=user__service__pb2.LoginRequest.FromString,
+                    response_serializer=user__service__pb2.LoginResponse.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'user_service.UserService', rpc_method_handlers)
@@ -138,3 +186,84 @@ class UserService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def BatchRegisterUsers(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(
+            request_iterator,
+            target,
+            '/user_service.UserService/BatchRegisterUsers',
+            user__service__pb2.UserRequest.SerializeToString,
+            user__service__pb2.BatchRegisterResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetUserGoals(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/user_service.UserService/GetUserGoals',
+            user__service__pb2.GoalsRequest.SerializeToString,
+            user__service__pb2.UserGoal.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def VerifyPassword(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/user_service.UserService/VerifyPassword',
+            user__service__pb2.LoginRequest.SerializeToString,
+            user__service__pb2.LoginResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)